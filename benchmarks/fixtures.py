@@ -0,0 +1,191 @@
+"""Bases de datos de tamaño fijo para los benchmarks.
+
+Las filas salen de un random.Random con semilla fija: dos corridas del mismo tamaño
+generan los mismos datos (las fechas son relativas al día de la corrida, así que los
+filtros de "últimos 30 días" siempre ven la misma proporción). Se insertan con Core en
+lotes, sin pasar por el ORM.
+"""
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+from sqlalchemy import insert
+from src.models.user import (
+    db, User, Marca, Producto, Activacion, Recompensa, UsuarioRecompensa, BackfillRecompensa, Tarea,
+    LoteCodigos, CodigoUnidad, ActivacionArchivada, ParticionActivacion, ReporteMarca, AlertaActivacion,
+    parse_reward_amount
+)
+from src.models.schema import upgrade_schema, upgrade_data
+from src.models.search import init_product_search
+from src.services.activation_archive import period_of
+
+SEED = 42
+HISTORY_DAYS = 540  # 18 meses: lo anterior a ACTIVATION_ARCHIVE_MONTHS queda archivado
+CATEGORIAS = ['Premium', 'Básico', 'Especial', 'Bebidas', 'Snacks', 'Cuidado personal']
+ESTADOS_RECOMPENSA = (('disponible', 70), ('reclamada', 25), ('expirada', 5))
+CODIGOS_POR_LOTE = 200
+
+SIZES = {
+    'small': {'marcas': 5, 'productos_por_marca': 20, 'consumidores': 500, 'activaciones_por_consumidor': 8},
+    'medium': {'marcas': 20, 'productos_por_marca': 50, 'consumidores': 5000, 'activaciones_por_consumidor': 12},
+}
+
+
+def _months_before(fecha, months):
+    index = fecha.year * 12 + fecha.month - 1 - months
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def _median_key(counts):
+    """La clave con la cantidad mediana: una fila "típica", no la más cargada ni la vacía"""
+    ordered = sorted(counts, key=lambda key: (counts[key], key))
+    return ordered[len(ordered) // 2]
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(insert(model.__table__), rows)
+
+
+def build(size, archive_months=12):
+    """Crea el esquema y carga los datos de `size` en la base de la app actual.
+
+    Devuelve (ids, conteos): los ids representativos que usan los benchmarks ({'User': id, ...}
+    para to_dict y los usuarios con que se llaman los handlers) y las filas cargadas por tabla.
+    """
+    params = SIZES[size]
+    rng = random.Random(SEED)
+    ahora = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    archivar_antes_de = _months_before(ahora, archive_months)
+    password_hash = generate_password_hash('Test123!')
+
+    db.create_all()
+    upgrade_schema(db.engine)
+    upgrade_data(db.engine)
+    init_product_search(db.engine)
+
+    usuarios = [{'id': 1, 'email': 'plataforma@bench.test', 'password_hash': password_hash,
+                 'nombre': 'Admin Plataforma', 'user_type': 'platform_admin', 'fecha_registro': ahora,
+                 'activo': True, 'puntos_totales': 0, 'nivel_actual': 1}]
+    marcas, productos, recompensas = [], [], []
+    for m in range(1, params['marcas'] + 1):
+        admin_id = len(usuarios) + 1
+        usuarios.append({'id': admin_id, 'email': f'marca{m}@bench.test', 'password_hash': password_hash,
+                         'nombre': f'Admin Marca {m}', 'user_type': 'brand_admin', 'fecha_registro': ahora,
+                         'activo': True, 'puntos_totales': 0, 'nivel_actual': 1})
+        marcas.append({'id': m, 'nombre': f'Marca {m}', 'descripcion': f'Marca de benchmark {m}',
+                       'admin_id': admin_id, 'fecha_creacion': ahora - timedelta(days=HISTORY_DAYS + 30),
+                       'activa': True})
+        for _ in range(params['productos_por_marca']):
+            producto_id = len(productos) + 1
+            productos.append({
+                'id': producto_id, 'nombre': f'Producto {producto_id}',
+                'descripcion': f'Producto {producto_id} de la marca {m}',
+                'codigo_activacion': f'WEEV-B{producto_id:07d}', 'categoria': rng.choice(CATEGORIAS),
+                'precio': round(rng.uniform(5, 80), 2), 'marca_id': m,
+                'fecha_creacion': ahora - timedelta(days=HISTORY_DAYS + 30), 'activo': rng.random() > 0.1
+            })
+            for nombre, tipo, valor, cupon in (
+                (f'Puntos por Producto {producto_id}', 'puntos', '100 puntos', None),
+                (f'Descuento Producto {producto_id}', 'descuento', f'{rng.choice((10, 15, 20))}%',
+                 f'DESC-{producto_id:05d}'),
+            ):
+                recompensas.append({
+                    'id': len(recompensas) + 1, 'nombre': nombre, 'descripcion': nombre, 'tipo': tipo,
+                    'valor': valor, 'valor_numerico': parse_reward_amount(valor), 'codigo_cupon': cupon,
+                    'usa_pool_cupones': False, 'producto_id': producto_id, 'activa': True
+                })
+
+    recompensas_por_producto = {}
+    for recompensa in recompensas:
+        recompensas_por_producto.setdefault(recompensa['producto_id'], []).append(recompensa['id'])
+
+    producto_ids = [p['id'] for p in productos]
+    estados, pesos = zip(*ESTADOS_RECOMPENSA)
+    activaciones, archivadas, otorgadas = [], [], []
+    filas_por_periodo = Counter()
+    activaciones_por_usuario, activaciones_por_producto = {}, Counter()
+    primera_por_producto = {}
+    for _ in range(params['consumidores']):
+        usuario_id = len(usuarios) + 1
+        elegidos = rng.sample(producto_ids, rng.randint(0, 2 * params['activaciones_por_consumidor']))
+        for producto_id in elegidos:
+            fecha = ahora - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+            periodo = period_of(fecha)
+            if periodo < archivar_antes_de:
+                archivadas.append({'usuario_id': usuario_id, 'producto_id': producto_id, 'periodo': periodo})
+                filas_por_periodo[periodo] += 1
+            else:
+                activaciones.append({'id': len(activaciones) + 1, 'usuario_id': usuario_id,
+                                     'producto_id': producto_id, 'fecha_activacion': fecha, 'puntos_ganados': 10})
+                primera_por_producto.setdefault(producto_id, len(activaciones))
+            activaciones_por_producto[producto_id] += 1
+            for recompensa_id in recompensas_por_producto[producto_id]:
+                estado = rng.choices(estados, pesos)[0]
+                otorgadas.append({
+                    'id': len(otorgadas) + 1, 'usuario_id': usuario_id, 'recompensa_id': recompensa_id,
+                    'fecha_otorgada': fecha, 'estado': estado,
+                    'fecha_reclamada': fecha + timedelta(days=rng.randint(0, 30)) if estado == 'reclamada' else None
+                })
+        activaciones_por_usuario[usuario_id] = len(elegidos)
+        puntos = 10 * len(elegidos)
+        usuarios.append({'id': usuario_id, 'email': f'usuario{usuario_id}@bench.test',
+                         'password_hash': password_hash, 'nombre': f'Usuario {usuario_id}',
+                         'user_type': 'consumer', 'fecha_registro': ahora - timedelta(days=HISTORY_DAYS),
+                         'activo': True, 'puntos_totales': puntos, 'nivel_actual': puntos // 100 + 1})
+
+    # Datos operativos: algunas filas de cada tabla auxiliar
+    particiones = [{'periodo': periodo, 'archivo': f'activaciones-{periodo}.db', 'filas': filas,
+                    'fecha_archivado': ahora} for periodo, filas in sorted(filas_por_periodo.items())]
+    reportes = [{'marca_id': m['id'], 'periodo': _months_before(ahora, meses), 'estado': 'listo',
+                 'huella': '0' * 64, 'archivo': f"marca-{m['id']}-{_months_before(ahora, meses)}.pdf",
+                 'fecha_generado': ahora} for m in marcas for meses in range(1, 7)]
+    alertas = [{'marca_id': p['marca_id'], 'producto_id': p['id'], 'ip': f'10.0.0.{i % 250 + 1}',
+                'alcance': 'ip', 'clave': f'10.0.0.{i % 250 + 1}', 'accion': 'marcar', 'conteo': 40,
+                'ventana_segundos': 300, 'estado': 'pendiente', 'fecha': ahora}
+               for i, p in enumerate(productos[::10])]
+    lotes = [{'id': 1, 'producto_id': 1, 'cantidad': CODIGOS_POR_LOTE, 'generados': CODIGOS_POR_LOTE,
+              'estado': 'completado', 'fecha_creacion': ahora}]
+    codigos = [{'codigo': f'U{i:011d}', 'producto_id': 1, 'lote_id': 1, 'canjeado': False}
+               for i in range(CODIGOS_POR_LOTE)]
+    backfills = [{'id': 1, 'recompensa_id': 1, 'producto_id': 1, 'total_activaciones': activaciones_por_producto[1],
+                  'procesadas': activaciones_por_producto[1], 'otorgadas': activaciones_por_producto[1],
+                  'estado': 'completado', 'fecha_creacion': ahora, 'fecha_actualizacion': ahora}]
+    tareas = [{'id': 1, 'tipo': 'recalcular_recomendaciones', 'payload': '{}', 'prioridad': 0,
+               'estado': 'pendiente', 'intentos': 0, 'max_intentos': 5, 'disponible_en': ahora,
+               'clave_unica': 'recalcular_recomendaciones', 'fecha_creacion': ahora}]
+
+    for model, rows in ((User, usuarios), (Marca, marcas), (Producto, productos), (Recompensa, recompensas),
+                        (Activacion, activaciones), (ActivacionArchivada, archivadas),
+                        (ParticionActivacion, particiones), (UsuarioRecompensa, otorgadas),
+                        (ReporteMarca, reportes), (AlertaActivacion, alertas), (LoteCodigos, lotes),
+                        (CodigoUnidad, codigos), (BackfillRecompensa, backfills), (Tarea, tareas)):
+        _insert(model, rows)
+    db.session.commit()
+
+    consumidor_id = _median_key(activaciones_por_usuario)
+    producto_id = _median_key({p: activaciones_por_producto[p] for p in primera_por_producto})
+    recompensa_id = recompensas_por_producto[producto_id][0]
+    ids = {
+        'consumer': consumidor_id,
+        'brand_admin': marcas[0]['admin_id'],
+        'platform_admin': 1,
+        'User': consumidor_id,
+        'Marca': marcas[0]['id'],
+        'Producto': producto_id,
+        'Activacion': primera_por_producto[producto_id],
+        'Recompensa': recompensa_id,
+        'UsuarioRecompensa': next(o['id'] for o in otorgadas if o['recompensa_id'] == recompensa_id),
+        'BackfillRecompensa': 1,
+        'Tarea': 1,
+        'LoteCodigos': 1,
+        'CodigoUnidad': 1,
+        'ParticionActivacion': particiones[0]['periodo'] if particiones else None,
+        'ReporteMarca': 1,
+        'AlertaActivacion': 1,
+    }
+    counts = {
+        'usuarios': len(usuarios), 'productos': len(productos), 'activaciones': len(activaciones),
+        'archivadas': len(archivadas), 'recompensas_otorgadas': len(otorgadas)
+    }
+    return ids, counts
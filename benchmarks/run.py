@@ -0,0 +1,321 @@
+"""Micro-benchmarks de serialización de modelos, validadores y handlers de dashboard.
+
+    python -m benchmarks.run                       # tamaño small, compara con la corrida anterior
+    python -m benchmarks.run --size medium --check
+
+Cada corrida arma una base de tamaño fijo (ver benchmarks/fixtures.py) en un directorio
+temporal, mide cada caso y lo compara con los resultados guardados en el archivo de
+baseline, que después reemplaza (salvo --no-save). Con --check termina con código 1 si
+algún caso empeoró más que --threshold o hace más consultas SQL que antes; en ese caso
+la baseline no se reemplaza.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Flask, session
+from sqlalchemy import event
+from src.models.user import db
+from src.routes.auth import validate_email, validate_password
+from src.routes.products import generate_activation_code
+from src.routes.dashboard import dashboard_bp
+from benchmarks.fixtures import SIZES, build
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_REPEAT = 30
+DEFAULT_THRESHOLD = 0.20
+WARMUP_CALLS = 3
+# Las funciones de pocos microsegundos se llaman en bucle hasta cubrir este tiempo por muestra
+MIN_SAMPLE_SECONDS = 0.002
+
+# (nombre, vista, usuario de la fixture, user_type, query string)
+HANDLERS = [
+    ('get_user_dashboard', 'dashboard.get_user_dashboard', 'consumer', 'consumer', None),
+    ('get_brand_dashboard', 'dashboard.get_brand_dashboard', 'brand_admin', 'brand_admin', None),
+    ('get_brand_reports', 'dashboard.get_brand_reports', 'brand_admin', 'brand_admin', None),
+    ('get_analytics', 'dashboard.get_analytics', 'brand_admin', 'brand_admin', None),
+    ('get_platform_analytics', 'dashboard.get_platform_analytics', 'platform_admin', 'platform_admin', None),
+    ('get_platform_analytics/sort=usuarios', 'dashboard.get_platform_analytics', 'platform_admin',
+     'platform_admin', {'sort': 'usuarios_unicos', 'order': 'asc'}),
+    ('get_activation_archive', 'dashboard.get_activation_archive', 'platform_admin', 'platform_admin', None),
+]
+
+VALIDATORS = [
+    ('validate_email/valido', validate_email, 'usuario.prueba+weev@example.com'),
+    ('validate_email/invalido', validate_email, 'usuario.prueba@example'),
+    ('validate_password/valida', validate_password, 'Weev-Segura-2024!'),
+    ('validate_password/debil', validate_password, 'weevweevweev'),
+]
+
+
+class Benchmark:
+    """`fn` es lo único que se mide. `context` (opcional) prepara cada llamada fuera del
+    tiempo medido y entrega sus argumentos; sin context, `fn` se llama en bucle."""
+
+    def __init__(self, name, fn, context=None):
+        self.name = name
+        self.fn = fn
+        self.context = context
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def create_app(directory):
+    """App mínima con la base de la fixture: no importa src.main para no cargar sus datos de prueba"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'weev-benchmarks'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['ACTIVATION_ARCHIVE_MONTHS'] = 12
+    app.config['ACTIVATION_ARCHIVE_DIR'] = os.path.join(directory, 'archive')
+    app.config['REPORTS_DIR'] = os.path.join(directory, 'reports')
+    app.register_blueprint(dashboard_bp, url_prefix='/api')
+    db.init_app(app)
+
+    with app.app_context():
+        # Igual que en src/main.py
+        @event.listens_for(db.engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.close()
+    return app
+
+
+def _fresh_instance(model, pk):
+    """Cada llamada recibe la fila recién cargada: los lazy loads de to_dict() entran en la medición"""
+    @contextmanager
+    def context():
+        db.session.remove()
+        yield (db.session.get(model, pk),)
+    return context
+
+
+def _request(app, user_id, user_type, query_string):
+    @contextmanager
+    def context():
+        with app.test_request_context(query_string=query_string):
+            session['user_id'] = user_id
+            session['user_type'] = user_type
+            try:
+                yield ()
+            finally:
+                db.session.remove()
+    return context
+
+
+def _handler(view):
+    def call():
+        response, status = view()
+        if status != 200:
+            raise RuntimeError(f'{view.__name__} respondió {status}: {response.get_data(as_text=True)}')
+    return call
+
+
+def collect(app, ids, name_filter=None):
+    benchmarks = []
+    models = sorted((m.class_ for m in db.Model.registry.mappers if hasattr(m.class_, 'to_dict')),
+                    key=lambda cls: cls.__name__)
+    for model in models:
+        if ids.get(model.__name__) is None:
+            print(f'Aviso: la fixture no tiene una fila de {model.__name__}; se omite to_dict', file=sys.stderr)
+            continue
+        benchmarks.append(Benchmark(f'to_dict/{model.__name__}', model.to_dict,
+                                    _fresh_instance(model, ids[model.__name__])))
+
+    for name, fn, value in VALIDATORS:
+        benchmarks.append(Benchmark(f'auth/{name}', lambda fn=fn, value=value: fn(value)))
+    benchmarks.append(Benchmark('products/generate_activation_code', generate_activation_code))
+
+    for name, endpoint, usuario, user_type, query_string in HANDLERS:
+        benchmarks.append(Benchmark(f'dashboard/{name}', _handler(app.view_functions[endpoint]),
+                                    _request(app, ids[usuario], user_type, query_string)))
+
+    if name_filter:
+        benchmarks = [b for b in benchmarks if name_filter in b.name]
+    return benchmarks
+
+
+def _calibrate(fn):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= MIN_SAMPLE_SECONDS:
+            return number
+        number *= 2
+
+
+def measure(benchmark, counter, repeat):
+    """{'median_us', 'p95_us', 'min_us', 'queries'} por llamada"""
+    context = benchmark.context
+    for _ in range(WARMUP_CALLS):
+        if context is None:
+            benchmark.fn()
+        else:
+            with context() as args:
+                benchmark.fn(*args)
+
+    samples = []
+    if context is None:
+        counter.count = 0
+        benchmark.fn()
+        queries = counter.count
+        number = _calibrate(benchmark.fn)
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                benchmark.fn()
+            samples.append((time.perf_counter_ns() - start) / number)
+    else:
+        queries = None
+        for _ in range(repeat):
+            with context() as args:
+                counter.count = 0
+                start = time.perf_counter_ns()
+                benchmark.fn(*args)
+                samples.append(time.perf_counter_ns() - start)
+                if queries is None:
+                    queries = counter.count
+
+    samples.sort()
+    return {
+        'median_us': round(statistics.median(samples) / 1000, 3),
+        'p95_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1000, 3),
+        'min_us': round(samples[0] / 1000, 3),
+        'queries': queries,
+    }
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results, previous, threshold):
+    """{nombre: (variación de la mediana o None, regresión)}"""
+    comparison = {}
+    for name, result in results.items():
+        before = previous.get(name)
+        if before is None:
+            comparison[name] = (None, False)
+            continue
+        change = result['median_us'] / before['median_us'] - 1 if before['median_us'] else 0.0
+        more_queries = before.get('queries') is not None and result['queries'] > before['queries']
+        comparison[name] = (change, change > threshold or more_queries)
+    return comparison
+
+
+def print_table(results, comparison, previous):
+    width = max(len(name) for name in results)
+    print(f"{'caso':<{width}}  {'mediana µs':>12}  {'p95 µs':>12}  {'mín µs':>12}  {'SQL':>5}  vs. anterior")
+    for name, result in results.items():
+        change, regression = comparison.get(name, (None, False))
+        if change is None:
+            versus = '-' if comparison else ''
+        else:
+            versus = f'{change:+.1%}'
+            before = previous[name].get('queries')
+            if before is not None and result['queries'] != before:
+                versus += f" (SQL {before} -> {result['queries']})"
+            if regression:
+                versus += '  REGRESIÓN'
+        print(f"{name:<{width}}  {result['median_us']:>12.3f}  {result['p95_us']:>12.3f}  "
+              f"{result['min_us']:>12.3f}  {result['queries']:>5}  {versus}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de Weev con comparación contra la corrida anterior')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small', help='tamaño de la base de prueba')
+    parser.add_argument('--filter', help='solo los casos cuyo nombre contiene este texto')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='muestras por caso')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='archivo JSON con los resultados anteriores')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='aumento de la mediana que cuenta como regresión (0.20 = 20%%)')
+    parser.add_argument('--check', action='store_true', help='código de salida 1 si hay regresiones')
+    parser.add_argument('--no-save', action='store_true', help='no reemplazar el archivo de baseline')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='weev-bench-')
+    try:
+        app = create_app(directory)
+        with app.app_context():
+            start = time.perf_counter()
+            ids, counts = build(args.size, app.config['ACTIVATION_ARCHIVE_MONTHS'])
+            print(f"Fixture {args.size}: {', '.join(f'{k}={v}' for k, v in counts.items())} "
+                  f'({time.perf_counter() - start:.1f} s)')
+
+            counter = QueryCounter(db.engine)
+            results = {}
+            for benchmark in collect(app, ids, args.filter):
+                results[benchmark.name] = measure(benchmark, counter, args.repeat)
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = load_baseline(args.baseline)
+    previous = {}
+    if baseline is None:
+        print(f'Sin resultados anteriores en {args.baseline}')
+    elif baseline.get('version') != BASELINE_VERSION or baseline.get('size') != args.size:
+        print(f"La baseline es de otro formato o tamaño ({baseline.get('size')}); no se compara")
+    else:
+        previous = baseline['benchmarks']
+        print(f"Comparando con {baseline.get('commit') or 'sin commit'} del {baseline.get('created')}")
+
+    comparison = compare(results, previous, args.threshold) if previous else {}
+    print_table(results, comparison, previous)
+    regressions = [name for name, (_, regression) in comparison.items() if regression]
+    if regressions:
+        print(f"\n{len(regressions)} regresión(es): {', '.join(regressions)}")
+
+    if not args.no_save and not (args.check and regressions):
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': BASELINE_VERSION,
+                'created': datetime.utcnow().isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'size': args.size,
+                'repeat': args.repeat,
+                'fixture': counts,
+                # Con --filter se conservan los casos que no se corrieron
+                'benchmarks': {**previous, **results},
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Resultados guardados en {args.baseline}')
+
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,89 @@
 import os
 import sys
+import hmac
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from datetime import timedelta
+from flask import Flask, Response, request, session, jsonify, send_from_directory
+from sqlalchemy import event
 from flask_cors import CORS
 from src.models.user import db
+from src.models.schema import upgrade_schema, upgrade_data
+from src.models.search import init_product_search
 from src.routes.user import user_bp
+from src.routes.user_routes import user_bp as user_profile_bp
 from src.routes.auth import auth_bp
 from src.routes.products import products_bp
 from src.routes.rewards import rewards_bp
 from src.routes.dashboard import dashboard_bp
+from src.services.jobs import start_workers, queue_stats
+from src.services.group_commit import activation_writer
+from src.services.reward_backfill import resume_pending_backfills
+from src.services.activation_archive import schedule_archival
+from src.services.recommendations import schedule_recommendations
+from src.services.activation_feed import feed as activation_feed
+from src.services.activation_anomalies import detector as anomaly_detector
+from src.utils.static_assets import StaticIndex
+from src.utils.rate_limit import limiter
+from src.utils.idempotency import store as idempotency_store
+from src.utils.metrics import registry, init_metrics, CallbackCounter, CallbackGauge
+from src.utils.slow_queries import init_slow_query_log
+from src.utils.compression import init_compression
+from src.utils.auth_tokens import init_auth_tokens
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'weev-secret-key-2024-mvp-development'
+# Cortar requests demasiado grandes antes de parsear el cuerpo (fotos de perfil: 5 MB + margen multipart)
+app.config['MAX_CONTENT_LENGTH'] = 6 * 1024 * 1024
+# Límites por endpoint: DEFAULT_LIMITS en src/utils/rate_limit.py; para cambiar alguno,
+# app.config['RATE_LIMITS'] = {'activate': (20, 10)} (solicitudes por minuto, ráfaga)
+# Ráfagas de activaciones: (ventana en segundos, umbral para marcar, umbral para bloquear o None).
+# Ver src/services/activation_anomalies.py
+app.config['ANOMALY_THRESHOLDS'] = {
+    'codigo': (300, 100, 1000),
+    'ip': (300, 30, 100),
+    'usuario': (60, 10, 30),
+}
+# Respuestas guardadas por Idempotency-Key en /activate y /claim (ver src/utils/idempotency.py);
+# con IDEMPOTENCY_PERSIST también en SQLite, para reintentos tras un reinicio o en otro proceso
+app.config['IDEMPOTENCY_TTL'] = timedelta(hours=24)
+app.config['IDEMPOTENCY_PERSIST'] = False
+# Recomendaciones por co-activación: vecinos guardados por producto, cuántos se muestran y
+# cada cuánto se recalculan los productos con activaciones nuevas (None = no recalcular)
+app.config['RECOMMENDATIONS_TOP_K'] = 20
+app.config['RECOMMENDATIONS_LIMIT'] = 5
+app.config['RECOMMENDATIONS_INTERVAL'] = timedelta(minutes=15)
+# Group-commit de activaciones: un hilo escritor confirma hasta MAX_BATCH activaciones (o las que
+# lleguen en MAX_WAIT_MS) con un solo COMMIT; cada request espera el resultado de la suya
+app.config['GROUP_COMMIT_ACTIVATIONS'] = False
+app.config['GROUP_COMMIT_MAX_BATCH'] = 64
+app.config['GROUP_COMMIT_MAX_WAIT_MS'] = 5
+app.config['GROUP_COMMIT_TIMEOUT_SECONDS'] = 10
+# Hilos que consumen la cola de tareas diferidas (0 = solo procesar con drain())
+app.config['JOB_WORKERS'] = 2
+# Activaciones más viejas que estos meses se mueven a un archivo SQLite por mes (0 = no archivar)
+app.config['ACTIVATION_ARCHIVE_MONTHS'] = 12
+app.config['ACTIVATION_ARCHIVE_DIR'] = os.path.join(os.path.dirname(__file__), 'database', 'archive')
+# PDFs mensuales de marca (uno por marca y período, se regeneran si cambian los datos)
+app.config['REPORTS_DIR'] = os.path.join(os.path.dirname(__file__), 'database', 'reports')
+# Sentencias SQL más lentas que este umbral se registran en logs/slow_queries.log (0 = desactivado)
+app.config['SLOW_QUERY_MS'] = 100
+# Conexiones SSE simultáneas (cada una ocupa un hilo del servidor)
+app.config['SSE_MAX_CONNECTIONS'] = 50
+app.config['SSE_MAX_CONNECTIONS_PER_BRAND'] = 5
+# Compresión de respuestas JSON: tamaño mínimo y niveles (los estáticos usan br 11 / zopfli al arrancar)
+app.config['COMPRESSION_MIN_BYTES'] = 1024
+app.config['COMPRESSION_LEVELS'] = {'br': 4, 'gzip': 6}
+
+# Autenticación: cookie de sesión y, opcionalmente, access tokens firmados (Authorization: Bearer)
+app.config['AUTH_TOKENS_ENABLED'] = True
+app.config['AUTH_ACCESS_TTL'] = timedelta(minutes=15)
+app.config['AUTH_REFRESH_TTL'] = timedelta(days=14)
+init_auth_tokens(app)
+# /api/metrics es solo para platform_admin; un scraper de Prometheus puede usar este token fijo
+# (Authorization: Bearer <token>). None = sin acceso por token
+app.config['METRICS_TOKEN'] = None
 
 # Habilitar CORS para todas las rutas
 CORS(app, supports_credentials=True)
@@ -24,6 +94,7 @@ app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(products_bp, url_prefix='/api')
 app.register_blueprint(rewards_bp, url_prefix='/api')
 app.register_blueprint(dashboard_bp, url_prefix='/api')
+app.register_blueprint(user_profile_bp)
 
 # Configuración de base de datos
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
@@ -32,7 +103,20 @@ db.init_app(app)
 
 # Crear tablas y datos de prueba
 with app.app_context():
+    # WAL permite lecturas concurrentes mientras se escribe
+    @event.listens_for(db.engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.close()
+
+    init_metrics(app, db.engine)
+    init_slow_query_log(app, db.engine)
+    init_compression(app)
     db.create_all()
+    upgrade_schema(db.engine)
+    upgrade_data(db.engine)
+    app.config['PRODUCT_SEARCH_FTS'] = init_product_search(db.engine)
     
     # Crear datos de prueba si no existen
     from src.models.user import User, Marca, Producto, Recompensa
@@ -140,26 +224,76 @@ with app.app_context():
         
         db.session.commit()
 
+    # Retomar asignaciones retroactivas interrumpidas por un reinicio
+    resume_pending_backfills(app)
+    schedule_archival(app)
+    schedule_recommendations(app)
+
+start_workers(app, app.config['JOB_WORKERS'])
+if app.config['GROUP_COMMIT_ACTIVATIONS']:
+    activation_writer.start(app, app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_WAIT_MS'])
+
+# Índice en memoria de los archivos estáticos (precomprimidos y con huella de contenido)
+static_index = StaticIndex(app.static_folder).scan()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-        return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+    asset = static_index.get(path)
+    if asset:
+        return static_index.response(asset)
+
+    # Las fotos de perfil se crean en tiempo de ejecución y no están en el índice
+    if path.startswith('uploads/'):
+        return send_from_directory(app.static_folder, path)
+
+    if static_index.shell:
+        return static_index.response(static_index.shell)
+    return "index.html not found", 404
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return {'status': 'OK', 'message': 'Weev MVP API funcionando correctamente'}, 200
 
+registry.register(CallbackCounter(
+    'weev_rate_limit_rejected_total', 'Solicitudes rechazadas por el limitador',
+    ('budget', 'scope'), lambda: dict(limiter.rejected)))
+
+registry.register(CallbackCounter(
+    'weev_idempotent_replays_total', 'Reintentos respondidos con la respuesta guardada',
+    (), lambda: {(): idempotency_store.replayed}))
+
+registry.register(CallbackGauge(
+    'weev_job_queue_tasks', 'Tareas en la cola persistente por estado',
+    ('estado',), lambda: {(estado,): count for estado, count in queue_stats().items()}))
+
+registry.register(CallbackGauge(
+    'weev_sse_connections', 'Conexiones SSE abiertas por marca',
+    ('marca_id',), activation_feed.connections))
+
+registry.register(CallbackCounter(
+    'weev_sse_dropped_total', 'Conexiones SSE cortadas por no consumir a tiempo',
+    (), lambda: {(): activation_feed.dropped}))
+
+registry.register(CallbackCounter(
+    'weev_activation_anomalies_total', 'Activaciones que superaron un umbral de ráfaga',
+    ('alcance', 'accion'), lambda: dict(anomaly_detector.findings)))
+
+registry.register(CallbackGauge(
+    'weev_activation_anomaly_keys', 'Claves seguidas por el detector de ráfagas',
+    ('alcance',), anomaly_detector.tracked))
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    token = app.config.get('METRICS_TOKEN')
+    scraper = token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    if not scraper:
+        if 'user_id' not in session:
+            return jsonify({'error': 'No autenticado'}), 401
+        if session.get('user_type') != 'platform_admin':
+            return jsonify({'error': 'Acceso denegado'}), 403
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
 
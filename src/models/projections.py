@@ -0,0 +1,165 @@
+"""Lecturas de solo consulta que arman las respuestas directamente desde filas de Core.
+
+Devuelven los mismos diccionarios que los to_dict() de los modelos, pero seleccionan
+solo las columnas necesarias, resuelven la marca y los conteos en el mismo SQL y no
+cargan objetos ORM (sin identity map ni lazy loads por fila).
+"""
+from sqlalchemy import select, func
+from src.models.user import db, User, Marca, Producto, Activacion, Recompensa, RecomendacionProducto
+from src.services.activation_archive import activation_keys
+
+
+def _iso(fecha):
+    return fecha.isoformat() if fecha else None
+
+
+def _activation_count(column):
+    return select(func.count(Activacion.id))\
+        .where(Activacion.producto_id == column)\
+        .correlate_except(Activacion)\
+        .scalar_subquery()
+
+
+_PRODUCT_COLUMNS = (
+    Producto.id,
+    Producto.nombre,
+    Producto.descripcion,
+    Producto.codigo_activacion,
+    Producto.categoria,
+    Producto.precio,
+    Producto.imagen_url,
+    Marca.nombre.label('marca'),
+    Producto.fecha_creacion,
+    _activation_count(Producto.id).label('total_activaciones'),
+    Producto.activo,
+)
+
+
+def _product_dict(row, offset=0):
+    """Producto.to_dict() a partir de las columnas de _PRODUCT_COLUMNS (desde `offset`)"""
+    (id, nombre, descripcion, codigo_activacion, categoria, precio, imagen_url,
+     marca, fecha_creacion, total_activaciones, activo) = row[offset:offset + len(_PRODUCT_COLUMNS)]
+    return {
+        'id': id,
+        'nombre': nombre,
+        'descripcion': descripcion,
+        'codigo_activacion': codigo_activacion,
+        'categoria': categoria,
+        'precio': precio,
+        'imagen_url': imagen_url,
+        'marca': marca,
+        'fecha_creacion': _iso(fecha_creacion),
+        'total_activaciones': total_activaciones,
+        'activo': activo
+    }
+
+
+def product_dicts(*conditions):
+    rows = db.session.execute(
+        select(*_PRODUCT_COLUMNS)
+        .outerjoin(Marca, Marca.id == Producto.marca_id)
+        .where(*conditions)
+    ).all()
+    return [_product_dict(row) for row in rows]
+
+
+def user_activation_dicts(usuario_id):
+    """Activaciones del usuario (más recientes primero) como Activacion.to_dict()"""
+    rows = db.session.execute(
+        select(Activacion.id, Activacion.fecha_activacion, Activacion.puntos_ganados, *_PRODUCT_COLUMNS)
+        .join(Producto, Producto.id == Activacion.producto_id)
+        .outerjoin(Marca, Marca.id == Producto.marca_id)
+        .where(Activacion.usuario_id == usuario_id)
+        .order_by(Activacion.fecha_activacion.desc())
+    ).all()
+    return [
+        {
+            'id': row[0],
+            'producto': _product_dict(row, offset=3),
+            'fecha_activacion': _iso(row[1]),
+            'puntos_ganados': row[2]
+        } for row in rows
+    ]
+
+
+def recommended_product_dicts(producto_id, limit, usuario_id=None):
+    """Vecinos precalculados del producto (solo activos), omitiendo los que el usuario ya activó"""
+    conditions = [RecomendacionProducto.producto_id == producto_id, Producto.activo.is_(True)]
+    if usuario_id is not None:
+        keys = activation_keys()
+        conditions.append(Producto.id.notin_(select(keys.c.producto_id).where(keys.c.usuario_id == usuario_id)))
+    rows = db.session.execute(
+        select(RecomendacionProducto.puntuacion, *_PRODUCT_COLUMNS)
+        .join(Producto, Producto.id == RecomendacionProducto.vecino_id)
+        .outerjoin(Marca, Marca.id == Producto.marca_id)
+        .where(*conditions)
+        .order_by(RecomendacionProducto.rango)
+        .limit(limit)
+    ).all()
+    return [{**_product_dict(row, offset=1), 'similitud': round(row[0], 4)} for row in rows]
+
+
+def brand_reward_dicts(marca_id):
+    """Recompensas de los productos de la marca como Recompensa.to_dict()"""
+    rows = db.session.execute(
+        select(
+            Recompensa.id,
+            Recompensa.nombre,
+            Recompensa.descripcion,
+            Recompensa.tipo,
+            Recompensa.valor,
+            Recompensa.codigo_cupon,
+            Recompensa.fecha_expiracion,
+            Recompensa.activa
+        )
+        .join(Producto, Producto.id == Recompensa.producto_id)
+        .where(Producto.marca_id == marca_id)
+        .order_by(Recompensa.id.desc())
+    ).all()
+    return [
+        {
+            'id': id,
+            'nombre': nombre,
+            'descripcion': descripcion,
+            'tipo': tipo,
+            'valor': valor,
+            'codigo_cupon': codigo_cupon,
+            'fecha_expiracion': _iso(fecha_expiracion),
+            'activa': activa
+        } for id, nombre, descripcion, tipo, valor, codigo_cupon, fecha_expiracion, activa in rows
+    ]
+
+
+def user_dicts():
+    """Todos los usuarios como User.to_dict(), con el conteo de activaciones en SQL"""
+    total_activaciones = select(func.count(Activacion.id))\
+        .where(Activacion.usuario_id == User.id)\
+        .correlate_except(Activacion)\
+        .scalar_subquery()
+    rows = db.session.execute(
+        select(
+            User.id,
+            User.email,
+            User.nombre,
+            User.user_type,
+            User.fecha_registro,
+            User.puntos_totales,
+            User.nivel_actual,
+            User.foto_perfil_url,
+            total_activaciones
+        ).order_by(User.id)
+    ).all()
+    return [
+        {
+            'id': id,
+            'email': email,
+            'nombre': nombre,
+            'user_type': user_type,
+            'fecha_registro': _iso(fecha_registro),
+            'puntos_totales': puntos_totales,
+            'nivel_actual': nivel_actual,
+            'foto_perfil_url': foto_perfil_url,
+            'total_activaciones': total
+        } for id, email, nombre, user_type, fecha_registro, puntos_totales, nivel_actual, foto_perfil_url, total
+        in rows
+    ]
@@ -0,0 +1,41 @@
+from sqlalchemy import inspect, select, update
+from sqlalchemy.schema import CreateColumn
+from src.models.user import db, Recompensa, parse_reward_amount
+
+
+def upgrade_schema(engine):
+    """Completa columnas e índices nuevos en tablas que ya existían.
+
+    db.create_all() solo crea tablas faltantes; las columnas agregadas a un modelo
+    existente deben ser nullable o tener server_default para poder agregarse con ALTER TABLE.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+
+
+def upgrade_data(engine):
+    """Completa valores derivados en filas creadas antes de que existiera la columna"""
+    table = Recompensa.__table__
+    with engine.begin() as conn:
+        pendientes = conn.execute(
+            select(table.c.id, table.c.valor)
+            .where(table.c.valor_numerico.is_(None), table.c.valor.isnot(None))
+        ).all()
+        for recompensa_id, valor in pendientes:
+            amount = parse_reward_amount(valor)
+            if amount is not None:
+                conn.execute(update(table).where(table.c.id == recompensa_id).values(valor_numerico=amount))
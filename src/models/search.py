@@ -0,0 +1,80 @@
+import re
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Índice FTS5 de productos; rowid = producto.id. Incluye el nombre de la marca,
+# por eso no usa content= externo y se mantiene con triggers.
+_CREATE_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS producto_fts USING fts5(
+        nombre, descripcion, categoria, marca,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS producto_fts_insert AFTER INSERT ON producto BEGIN
+        INSERT INTO producto_fts(rowid, nombre, descripcion, categoria, marca)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria,
+                (SELECT nombre FROM marca WHERE id = new.marca_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS producto_fts_update
+    AFTER UPDATE OF nombre, descripcion, categoria, marca_id ON producto BEGIN
+        DELETE FROM producto_fts WHERE rowid = old.id;
+        INSERT INTO producto_fts(rowid, nombre, descripcion, categoria, marca)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria,
+                (SELECT nombre FROM marca WHERE id = new.marca_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS producto_fts_delete AFTER DELETE ON producto BEGIN
+        DELETE FROM producto_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS marca_fts_update AFTER UPDATE OF nombre ON marca BEGIN
+        UPDATE producto_fts SET marca = new.nombre
+        WHERE rowid IN (SELECT id FROM producto WHERE marca_id = new.id);
+    END
+    """,
+]
+
+_REBUILD = """
+    INSERT INTO producto_fts(rowid, nombre, descripcion, categoria, marca)
+    SELECT p.id, p.nombre, p.descripcion, p.categoria, m.nombre
+    FROM producto p LEFT JOIN marca m ON m.id = p.marca_id
+"""
+
+# Pesos BM25 por columna: nombre, descripcion, categoria, marca
+BM25_WEIGHTS = '10.0, 2.0, 4.0, 6.0'
+
+
+def init_product_search(engine):
+    """Crea el índice FTS5 y sus triggers; lo llena si es nuevo. Devuelve False si no hay FTS5."""
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            existed = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'producto_fts'")
+            ).first() is not None
+            conn.exec_driver_sql(_CREATE_TABLE)
+            for trigger in _TRIGGERS:
+                conn.exec_driver_sql(trigger)
+            if not existed:
+                conn.exec_driver_sql(_REBUILD)
+        return True
+    except OperationalError:
+        logger.warning('SQLite sin FTS5: /products/search usará LIKE')
+        return False
+
+
+def build_match_query(q):
+    """Convierte texto libre en una consulta FTS5 segura: cada palabra como prefijo, todas requeridas"""
+    terms = re.findall(r'\w+', q.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
@@ -1,9 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
+import re
 
 db = SQLAlchemy()
 
+def parse_reward_amount(valor):
+    """Cantidad numérica al inicio del valor: "10 puntos" -> 10, "15%" -> 15, "Video" -> None"""
+    match = re.match(r'\s*(\d+)', valor or '')
+    return int(match.group(1)) if match else None
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -14,6 +22,7 @@ class User(db.Model):
     activo = db.Column(db.Boolean, default=True)
     puntos_totales = db.Column(db.Integer, default=0)
     nivel_actual = db.Column(db.Integer, default=1)
+    foto_perfil_url = db.Column(db.String(255))  # miniatura de 128 px (ver src/utils/uploads.py)
     
     # Relaciones
     activaciones = db.relationship('Activacion', backref='usuario', lazy=True)
@@ -29,7 +38,8 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
 
-    def to_dict(self):
+    def to_dict(self, total_activaciones=None):
+        """total_activaciones evita cargar la relación cuando ya se conoce (p. ej. del resumen)"""
         return {
             'id': self.id,
             'email': self.email,
@@ -38,7 +48,8 @@ class User(db.Model):
             'fecha_registro': self.fecha_registro.isoformat() if self.fecha_registro else None,
             'puntos_totales': self.puntos_totales,
             'nivel_actual': self.nivel_actual,
-            'total_activaciones': len(self.activaciones)
+            'foto_perfil_url': self.foto_perfil_url,
+            'total_activaciones': len(self.activaciones) if total_activaciones is None else total_activaciones
         }
 
 class Marca(db.Model):
@@ -98,7 +109,7 @@ class Producto(db.Model):
 class Activacion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False, index=True)
     fecha_activacion = db.Column(db.DateTime, default=datetime.utcnow)
     puntos_ganados = db.Column(db.Integer, default=10)
     
@@ -120,6 +131,8 @@ class Recompensa(db.Model):
     tipo = db.Column(db.String(50), nullable=False)  # descuento, puntos, contenido, producto_gratis
     valor = db.Column(db.String(100))  # "15%", "100 puntos", "Video exclusivo", etc.
     codigo_cupon = db.Column(db.String(50))
+    usa_pool_cupones = db.Column(db.Boolean, default=False)  # cada otorgamiento toma un cupón único
+    valor_numerico = db.Column(db.Integer)  # se calcula desde `valor` al escribirlo
     producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
     fecha_expiracion = db.Column(db.DateTime)
     activa = db.Column(db.Boolean, default=True)
@@ -127,6 +140,11 @@ class Recompensa(db.Model):
     # Relaciones
     usuarios_recompensas = db.relationship('UsuarioRecompensa', backref='recompensa', lazy=True)
 
+    @validates('valor')
+    def validate_valor(self, key, valor):
+        self.valor_numerico = parse_reward_amount(valor)
+        return valor
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -146,13 +164,267 @@ class UsuarioRecompensa(db.Model):
     fecha_otorgada = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_reclamada = db.Column(db.DateTime)
     estado = db.Column(db.String(20), default='disponible')  # disponible, reclamada, expirada
+    codigo_cupon = db.Column(db.String(50))  # cupón único asignado desde el pool de la recompensa
+
+    __table_args__ = (db.Index('ix_usuario_recompensa_usuario_recompensa', 'usuario_id', 'recompensa_id'),)
 
     def to_dict(self):
         return {
             'id': self.id,
             'recompensa': self.recompensa.to_dict() if self.recompensa else None,
+            'codigo_cupon': self.codigo_cupon or (self.recompensa.codigo_cupon if self.recompensa else None),
             'fecha_otorgada': self.fecha_otorgada.isoformat() if self.fecha_otorgada else None,
             'fecha_reclamada': self.fecha_reclamada.isoformat() if self.fecha_reclamada else None,
             'estado': self.estado
         }
 
+
+class BackfillRecompensa(db.Model):
+    """Progreso de la asignación retroactiva de una recompensa a quienes ya activaron el producto"""
+    id = db.Column(db.Integer, primary_key=True)
+    recompensa_id = db.Column(db.Integer, db.ForeignKey('recompensa.id'), nullable=False, index=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    ultimo_activacion_id = db.Column(db.Integer, nullable=False, default=0)  # cursor keyset
+    total_activaciones = db.Column(db.Integer, default=0)
+    procesadas = db.Column(db.Integer, default=0)
+    otorgadas = db.Column(db.Integer, default=0)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, en_progreso, completado, error
+    error = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recompensa_id': self.recompensa_id,
+            'estado': self.estado,
+            'total_activaciones': self.total_activaciones,
+            'procesadas': self.procesadas,
+            'otorgadas': self.otorgadas,
+            'progreso': round((self.procesadas / max(self.total_activaciones, 1)) * 100, 2),
+            'error': self.error,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+            'fecha_actualizacion': self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None
+        }
+
+class Tarea(db.Model):
+    """Trabajo diferido de la cola persistente (ver src/services/jobs.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    prioridad = db.Column(db.Integer, nullable=False, default=0)  # mayor = antes
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, en_proceso, fallida
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    max_intentos = db.Column(db.Integer, nullable=False, default=5)
+    disponible_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # también vence la visibilidad
+    clave_unica = db.Column(db.String(100))  # evita encolar dos veces el mismo trabajo pendiente
+    ultimo_error = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_tarea_estado_disponible', 'estado', 'disponible_en'),
+        db.Index('ix_tarea_clave_unica', 'clave_unica'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'prioridad': self.prioridad,
+            'estado': self.estado,
+            'intentos': self.intentos,
+            'max_intentos': self.max_intentos,
+            'disponible_en': self.disponible_en.isoformat() if self.disponible_en else None,
+            'ultimo_error': self.ultimo_error
+        }
+
+class LoteCodigos(db.Model):
+    """Lote de códigos de activación únicos por unidad de un producto"""
+    id = db.Column(db.Integer, primary_key=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False, index=True)
+    cantidad = db.Column(db.Integer, nullable=False)
+    generados = db.Column(db.Integer, nullable=False, default=0)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, generando, completado
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'producto_id': self.producto_id,
+            'cantidad': self.cantidad,
+            'generados': self.generados,
+            'estado': self.estado,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None
+        }
+
+class CodigoUnidad(db.Model):
+    """Código de activación de una unidad física; se canjea una sola vez"""
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(20), unique=True, nullable=False)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    lote_id = db.Column(db.Integer, db.ForeignKey('lote_codigos.id'), nullable=False, index=True)
+    canjeado = db.Column(db.Boolean, nullable=False, default=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    fecha_canje = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'codigo': self.codigo,
+            'producto_id': self.producto_id,
+            'lote_id': self.lote_id,
+            'canjeado': self.canjeado,
+            'fecha_canje': self.fecha_canje.isoformat() if self.fecha_canje else None
+        }
+
+class CuponRecompensa(db.Model):
+    """Cupón único del pool de una recompensa; se asigna a un solo otorgamiento"""
+    id = db.Column(db.Integer, primary_key=True)
+    recompensa_id = db.Column(db.Integer, db.ForeignKey('recompensa.id'), nullable=False)
+    codigo = db.Column(db.String(50), nullable=False)
+    usuario_recompensa_id = db.Column(db.Integer, db.ForeignKey('usuario_recompensa.id'), unique=True)
+    fecha_asignacion = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('recompensa_id', 'codigo', name='unique_reward_coupon'),
+        # Índice parcial con solo los cupones libres: tomar el siguiente no recorre el pool
+        db.Index('ix_cupon_recompensa_libres', 'recompensa_id', 'id',
+                 sqlite_where=db.text('usuario_recompensa_id IS NULL')),
+    )
+
+class ResumenUsuario(db.Model):
+    """Contadores materializados del usuario para los dashboards (ver src/services/user_summary.py)"""
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_activaciones = db.Column(db.Integer, nullable=False, default=0)
+    recompensas_total = db.Column(db.Integer, nullable=False, default=0)
+    recompensas_disponibles = db.Column(db.Integer, nullable=False, default=0)
+    recompensas_reclamadas = db.Column(db.Integer, nullable=False, default=0)
+    marcas = db.Column(db.Text, nullable=False, default='{}')  # JSON {marca_id: {nombre, activaciones}}
+    meses = db.Column(db.Text, nullable=False, default='{}')  # JSON {"YYYY-MM": activaciones}
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def marcas_favoritas(self, limit=5):
+        marcas = sorted(json.loads(self.marcas).values(), key=lambda m: m['activaciones'], reverse=True)
+        return [{'nombre': m['nombre'], 'activaciones': m['activaciones']} for m in marcas[:limit]]
+
+    def activaciones_por_mes(self, desde=None):
+        """Buckets mensuales ordenados; `desde` es un mes 'YYYY-MM' inclusive"""
+        meses = json.loads(self.meses)
+        return [
+            {'mes': mes, 'activaciones': meses[mes]}
+            for mes in sorted(meses) if desde is None or mes >= desde
+        ]
+
+class ActivacionArchivada(db.Model):
+    """Clave de cada activación movida a un archivo mensual (ver src/services/activation_archive.py).
+
+    Mantiene la unicidad usuario-producto y permite contar sin abrir los archivos.
+    """
+    usuario_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    producto_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    periodo = db.Column(db.String(7), nullable=False)  # YYYY-MM
+
+    __table_args__ = (
+        db.Index('ix_activacion_archivada_producto_periodo', 'producto_id', 'periodo'),
+        {'sqlite_with_rowid': False},
+    )
+
+class ParticionActivacion(db.Model):
+    """Período mensual de activaciones archivado en su propio archivo SQLite"""
+    periodo = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    archivo = db.Column(db.String(255), nullable=False)
+    filas = db.Column(db.Integer, nullable=False, default=0)
+    fecha_archivado = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'periodo': self.periodo,
+            'archivo': self.archivo,
+            'filas': self.filas,
+            'fecha_archivado': self.fecha_archivado.isoformat() if self.fecha_archivado else None
+        }
+
+class ReporteMarca(db.Model):
+    """PDF mensual de una marca, guardado en disco (ver src/services/brand_reports.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    marca_id = db.Column(db.Integer, db.ForeignKey('marca.id'), nullable=False)
+    periodo = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, listo, error
+    huella = db.Column(db.String(64))  # resumen de los datos del período con que se generó (o se pidió)
+    archivo = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    fecha_generado = db.Column(db.DateTime)
+
+    __table_args__ = (db.UniqueConstraint('marca_id', 'periodo', name='unique_brand_report_period'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'marca_id': self.marca_id,
+            'periodo': self.periodo,
+            'estado': self.estado,
+            'error': self.error,
+            'fecha_generado': self.fecha_generado.isoformat() if self.fecha_generado else None
+        }
+
+class AlertaActivacion(db.Model):
+    """Ráfaga de activaciones detectada en vivo (ver src/services/activation_anomalies.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    marca_id = db.Column(db.Integer, db.ForeignKey('marca.id'), nullable=False)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    ip = db.Column(db.String(45))
+    alcance = db.Column(db.String(20), nullable=False)  # codigo, ip, usuario
+    clave = db.Column(db.String(100), nullable=False)
+    accion = db.Column(db.String(20), nullable=False)  # marcar, bloquear
+    conteo = db.Column(db.Integer, nullable=False)
+    ventana_segundos = db.Column(db.Integer, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, confirmada, descartada
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_revision = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_alerta_activacion_marca_estado', 'marca_id', 'estado', 'fecha'),)
+
+    producto = db.relationship('Producto')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'producto_id': self.producto_id,
+            'producto_nombre': self.producto.nombre if self.producto else None,
+            'usuario_id': self.usuario_id,
+            'ip': self.ip,
+            'alcance': self.alcance,
+            'clave': self.clave,
+            'accion': self.accion,
+            'conteo': self.conteo,
+            'ventana_segundos': self.ventana_segundos,
+            'estado': self.estado,
+            'fecha': self.fecha.isoformat() if self.fecha else None,
+            'fecha_revision': self.fecha_revision.isoformat() if self.fecha_revision else None
+        }
+
+class RespuestaIdempotente(db.Model):
+    """Respuesta guardada para un Idempotency-Key (ver src/utils/idempotency.py)"""
+    usuario_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    clave = db.Column(db.String(255), primary_key=True)
+    huella = db.Column(db.String(64), nullable=False)  # método, ruta y cuerpo del request original
+    estado_http = db.Column(db.Integer, nullable=False)
+    tipo_contenido = db.Column(db.String(100))
+    cuerpo = db.Column(db.LargeBinary, nullable=False)
+    expira = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+class RecomendacionProducto(db.Model):
+    """Producto activado por quienes activaron otro (ver src/services/recommendations.py).
+
+    La clave (producto_id, rango) deja los vecinos de un producto ya ordenados en el índice.
+    """
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), primary_key=True, autoincrement=False)
+    rango = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 1 = el más similar
+    vecino_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    puntuacion = db.Column(db.Float, nullable=False)  # similitud coseno entre las columnas de usuarios
+    coactivaciones = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = ({'sqlite_with_rowid': False},)
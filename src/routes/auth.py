@@ -1,5 +1,7 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from src.models.user import db, User, Marca
+from src.utils.rate_limit import rate_limit
+from src.utils.auth_tokens import TokenSession, REFRESH_SALT, issue_tokens, verify_token
 import re
 
 auth_bp = Blueprint('auth', __name__)
@@ -23,6 +25,7 @@ def validate_password(password):
     return True
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limit('register')
 def register():
     try:
         data = request.get_json()
@@ -61,9 +64,10 @@ def register():
         user.set_password(password)
         
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         
-        # Si es brand_admin, crear marca por defecto
+        # Si es brand_admin, crear marca por defecto en la misma transacción
+        # (se necesita de inmediato para crear productos, por eso no se difiere)
         if user_type == 'brand_admin':
             marca_nombre = data.get('marca_nombre', f'Marca de {nombre}')
             marca = Marca(
@@ -72,11 +76,13 @@ def register():
                 admin_id=user.id
             )
             db.session.add(marca)
-            db.session.commit()
+        
+        db.session.commit()
         
         # Iniciar sesión automáticamente
         session['user_id'] = user.id
         session['user_type'] = user.user_type
+        session['marca_id'] = marca.id if user_type == 'brand_admin' else None
         
         return jsonify({
             'message': 'Usuario registrado exitosamente',
@@ -88,6 +94,7 @@ def register():
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limit('login')
 def login():
     try:
         data = request.get_json()
@@ -109,6 +116,7 @@ def login():
         # Iniciar sesión
         session['user_id'] = user.id
         session['user_type'] = user.user_type
+        session['marca_id'] = get_brand_id(user)
         
         return jsonify({
             'message': 'Login exitoso',
@@ -141,8 +149,74 @@ def get_current_user():
 
 @auth_bp.route('/check-auth', methods=['GET'])
 def check_auth():
+    # Sin base de datos: en modo token los datos salen del token firmado
     if 'user_id' in session:
-        return jsonify({'authenticated': True, 'user_type': session.get('user_type')}), 200
+        return jsonify({
+            'authenticated': True,
+            'user_type': session.get('user_type'),
+            'marca_id': session.get('marca_id'),
+            'mode': 'token' if isinstance(session, TokenSession) else 'session'
+        }), 200
     else:
         return jsonify({'authenticated': False}), 200
 
+def get_brand_id(user):
+    if user.user_type != 'brand_admin':
+        return None
+    marca = Marca.query.filter_by(admin_id=user.id).first()
+    return marca.id if marca else None
+
+@auth_bp.route('/token', methods=['POST'])
+@rate_limit('login')
+def create_token():
+    """Login sin cookie: devuelve un access token corto y un refresh token"""
+    try:
+        if not current_app.config.get('AUTH_TOKENS_ENABLED'):
+            return jsonify({'error': 'Autenticación por token deshabilitada'}), 404
+        
+        data = request.get_json()
+        
+        if not data.get('email') or not data.get('password'):
+            return jsonify({'error': 'Email y contraseña son requeridos'}), 400
+        
+        user = User.query.filter_by(email=data['email'].lower().strip()).first()
+        
+        if not user or not user.check_password(data['password']):
+            return jsonify({'error': 'Credenciales inválidas'}), 401
+        
+        if not user.activo:
+            return jsonify({'error': 'Cuenta desactivada'}), 401
+        
+        return jsonify({
+            **issue_tokens(current_app, user, get_brand_id(user)),
+            'user': user.to_dict()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@auth_bp.route('/token/refresh', methods=['POST'])
+@rate_limit('login')
+def refresh_token():
+    """Canjea un refresh token por tokens nuevos; relee el usuario por si cambió su tipo o marca"""
+    try:
+        if not current_app.config.get('AUTH_TOKENS_ENABLED'):
+            return jsonify({'error': 'Autenticación por token deshabilitada'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        claims, error = verify_token(
+            current_app, data.get('refresh_token', ''), REFRESH_SALT, current_app.config['AUTH_REFRESH_TTL']
+        )
+        if claims is None:
+            mensaje = 'Refresh token expirado' if error == 'expired' else 'Refresh token inválido'
+            return jsonify({'error': mensaje}), 401
+        
+        user = User.query.get(claims['uid'])
+        if not user or not user.activo:
+            return jsonify({'error': 'Usuario no encontrado o desactivado'}), 401
+        
+        return jsonify(issue_tokens(current_app, user, get_brand_id(user))), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
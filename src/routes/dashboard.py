@@ -1,8 +1,21 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User, Marca, Producto, Activacion, UsuarioRecompensa
+import os
+import re
+from flask import Blueprint, Response, request, jsonify, session, current_app, send_file
+from src.models.user import db, User, Marca, Producto, Activacion, Recompensa, UsuarioRecompensa, ParticionActivacion, ReporteMarca
+from src.services.activation_archive import activation_keys, period_of
+from src.services.brand_reports import report_fingerprint, report_path
+from src.services.jobs import enqueue
+from src.services.activation_feed import FeedFull, RETRY_MS, feed, missed_events, event_stream
+from src.services.platform_analytics import SORT_COLUMNS, brand_analytics
+from src.services.user_summary import get_summary
+from src.utils.rate_limit import limiter
+from src.utils.idempotency import store as idempotency_store
+from src.utils.auth_tokens import current_brand_id
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 
+PERIODO_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
 dashboard_bp = Blueprint('dashboard', __name__)
 
 def require_auth(f):
@@ -23,6 +36,16 @@ def require_brand_admin(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def require_platform_admin(f):
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'No autenticado'}), 401
+        if session.get('user_type') != 'platform_admin':
+            return jsonify({'error': 'Acceso denegado'}), 403
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
 @dashboard_bp.route('/user-dashboard', methods=['GET'])
 @require_auth
 def get_user_dashboard():
@@ -33,12 +56,8 @@ def get_user_dashboard():
         if not user:
             return jsonify({'error': 'Usuario no encontrado'}), 404
         
-        # Métricas básicas
-        total_activaciones = Activacion.query.filter_by(usuario_id=user_id).count()
-        recompensas_disponibles = UsuarioRecompensa.query.filter_by(
-            usuario_id=user_id, 
-            estado='disponible'
-        ).count()
+        # Métricas, marcas y meses salen del resumen materializado (una lectura por PK)
+        resumen = get_summary(user_id)
         
         # Activaciones recientes (últimas 5)
         activaciones_recientes = Activacion.query.filter_by(usuario_id=user_id)\
@@ -52,38 +71,22 @@ def get_user_dashboard():
         ).order_by(desc(UsuarioRecompensa.fecha_otorgada))\
          .limit(3).all()
         
-        # Marcas activadas (únicas)
-        marcas_activadas = db.session.query(Marca.nombre, func.count(Activacion.id).label('count'))\
-            .join(Producto, Marca.id == Producto.marca_id)\
-            .join(Activacion, Producto.id == Activacion.producto_id)\
-            .filter(Activacion.usuario_id == user_id)\
-            .group_by(Marca.id, Marca.nombre)\
-            .order_by(desc('count'))\
-            .limit(5).all()
-        
         # Activaciones por mes (últimos 6 meses)
         six_months_ago = datetime.utcnow() - timedelta(days=180)
-        activaciones_por_mes = db.session.query(
-            func.strftime('%Y-%m', Activacion.fecha_activacion).label('mes'),
-            func.count(Activacion.id).label('count')
-        ).filter(
-            Activacion.usuario_id == user_id,
-            Activacion.fecha_activacion >= six_months_ago
-        ).group_by('mes').order_by('mes').all()
         
         return jsonify({
-            'usuario': user.to_dict(),
+            'usuario': user.to_dict(total_activaciones=resumen.total_activaciones),
             'metricas': {
-                'total_activaciones': total_activaciones,
-                'recompensas_disponibles': recompensas_disponibles,
+                'total_activaciones': resumen.total_activaciones,
+                'recompensas_disponibles': resumen.recompensas_disponibles,
                 'puntos_totales': user.puntos_totales,
                 'nivel_actual': user.nivel_actual,
                 'puntos_siguiente_nivel': max(0, (user.nivel_actual * 100) - user.puntos_totales)
             },
             'activaciones_recientes': [a.to_dict() for a in activaciones_recientes],
             'recompensas_recientes': [r.to_dict() for r in recompensas_recientes],
-            'marcas_favoritas': [{'nombre': m[0], 'activaciones': m[1]} for m in marcas_activadas],
-            'activaciones_por_mes': [{'mes': m[0], 'activaciones': m[1]} for m in activaciones_por_mes]
+            'marcas_favoritas': resumen.marcas_favoritas(),
+            'activaciones_por_mes': resumen.activaciones_por_mes(desde=six_months_ago.strftime('%Y-%m'))
         }), 200
         
     except Exception as e:
@@ -93,36 +96,37 @@ def get_user_dashboard():
 @require_brand_admin
 def get_brand_dashboard():
     try:
-        user_id = session['user_id']
-        
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Métricas básicas
-        total_productos = Producto.query.filter_by(marca_id=marca.id).count()
-        productos_activos = Producto.query.filter_by(marca_id=marca.id, activo=True).count()
+        total_productos = Producto.query.filter_by(marca_id=marca_id).count()
+        productos_activos = Producto.query.filter_by(marca_id=marca_id, activo=True).count()
+        
+        # Activaciones calientes y archivadas de toda la historia
+        activaciones = activation_keys()
         
         # Total de activaciones de todos los productos de la marca
-        total_activaciones = db.session.query(func.count(Activacion.id))\
-            .join(Producto)\
-            .filter(Producto.marca_id == marca.id)\
+        total_activaciones = db.session.query(func.count())\
+            .select_from(activaciones)\
+            .join(Producto, Producto.id == activaciones.c.producto_id)\
+            .filter(Producto.marca_id == marca_id)\
             .scalar()
         
         # Usuarios únicos que han activado productos de la marca
-        usuarios_unicos = db.session.query(func.count(func.distinct(Activacion.usuario_id)))\
-            .join(Producto)\
-            .filter(Producto.marca_id == marca.id)\
+        usuarios_unicos = db.session.query(func.count(func.distinct(activaciones.c.usuario_id)))\
+            .join(Producto, Producto.id == activaciones.c.producto_id)\
+            .filter(Producto.marca_id == marca_id)\
             .scalar()
         
         # Productos más activados
         productos_top = db.session.query(
             Producto.nombre,
             Producto.id,
-            func.count(Activacion.id).label('activaciones')
-        ).outerjoin(Activacion)\
-         .filter(Producto.marca_id == marca.id)\
+            func.count(activaciones.c.usuario_id).label('activaciones')
+        ).outerjoin(activaciones, Producto.id == activaciones.c.producto_id)\
+         .filter(Producto.marca_id == marca_id)\
          .group_by(Producto.id, Producto.nombre)\
          .order_by(desc('activaciones'))\
          .limit(5).all()
@@ -134,7 +138,7 @@ def get_brand_dashboard():
             func.count(Activacion.id).label('count')
         ).join(Producto)\
          .filter(
-             Producto.marca_id == marca.id,
+             Producto.marca_id == marca_id,
              Activacion.fecha_activacion >= thirty_days_ago
          ).group_by('fecha')\
           .order_by('fecha').all()
@@ -143,7 +147,7 @@ def get_brand_dashboard():
         activaciones_recientes = db.session.query(Activacion)\
             .join(Producto)\
             .join(User, Activacion.usuario_id == User.id)\
-            .filter(Producto.marca_id == marca.id)\
+            .filter(Producto.marca_id == marca_id)\
             .order_by(desc(Activacion.fecha_activacion))\
             .limit(10).all()
         
@@ -151,19 +155,19 @@ def get_brand_dashboard():
         total_recompensas = db.session.query(func.count(UsuarioRecompensa.id))\
             .join(Recompensa, UsuarioRecompensa.recompensa_id == Recompensa.id)\
             .join(Producto, Recompensa.producto_id == Producto.id)\
-            .filter(Producto.marca_id == marca.id)\
+            .filter(Producto.marca_id == marca_id)\
             .scalar()
         
         recompensas_reclamadas = db.session.query(func.count(UsuarioRecompensa.id))\
             .join(Recompensa, UsuarioRecompensa.recompensa_id == Recompensa.id)\
             .join(Producto, Recompensa.producto_id == Producto.id)\
             .filter(
-                Producto.marca_id == marca.id,
+                Producto.marca_id == marca_id,
                 UsuarioRecompensa.estado == 'reclamada'
             ).scalar()
         
         return jsonify({
-            'marca': marca.to_dict(),
+            'marca': db.session.get(Marca, marca_id).to_dict(),
             'metricas': {
                 'total_productos': total_productos,
                 'productos_activos': productos_activos,
@@ -182,7 +186,7 @@ def get_brand_dashboard():
             ],
             'activaciones_por_dia': [
                 {
-                    'fecha': a[0].strftime('%Y-%m-%d') if a[0] else '', 
+                    'fecha': a[0] or '',  # date() de SQLite ya devuelve 'YYYY-MM-DD'
                     'activaciones': a[1]
                 } for a in activaciones_por_dia
             ],
@@ -200,15 +204,113 @@ def get_brand_dashboard():
     except Exception as e:
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@dashboard_bp.route('/brand-dashboard/activations/stream', methods=['GET'])
+@require_brand_admin
+def stream_brand_activations():
+    """Server-Sent Events con las activaciones nuevas de la marca (reemplaza el polling)"""
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        last_event_id = request.headers.get('Last-Event-ID', type=int)
+        
+        try:
+            subscriber = feed.subscribe(
+                marca_id,
+                current_app.config['SSE_MAX_CONNECTIONS'],
+                current_app.config['SSE_MAX_CONNECTIONS_PER_BRAND']
+            )
+        except FeedFull:
+            response = jsonify({'error': 'Demasiadas conexiones en vivo, intenta más tarde'})
+            response.headers['Retry-After'] = str(RETRY_MS // 1000)
+            return response, 503
+        
+        # Suscribirse antes de leer lo perdido: lo que llegue en el medio no se pierde
+        # (event_stream descarta los ids repetidos)
+        try:
+            replay = missed_events(marca_id, last_event_id) if last_event_id is not None else []
+        except Exception:
+            feed.unsubscribe(subscriber)
+            raise
+        
+        response = Response(
+            event_stream(subscriber, replay),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        # El finally del generador no corre si nunca arranca (HEAD, cliente que corta antes
+        # del primer bloque): al cerrar la respuesta se libera el cupo igual
+        response.call_on_close(lambda: feed.unsubscribe(subscriber))
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@dashboard_bp.route('/reports/monthly', methods=['GET'])
+@require_brand_admin
+def get_monthly_report():
+    """PDF del mes: se sirve desde disco si los datos del período no cambiaron; si no, se encola"""
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        periodo = request.args.get('periodo', period_of(datetime.utcnow()))
+        if not PERIODO_RE.match(periodo):
+            return jsonify({'error': 'periodo debe tener el formato YYYY-MM'}), 400
+        if periodo > period_of(datetime.utcnow()):
+            return jsonify({'error': 'El período todavía no empezó'}), 400
+        
+        huella = report_fingerprint(marca_id, periodo)
+        reporte = ReporteMarca.query.filter_by(marca_id=marca_id, periodo=periodo).first()
+        
+        if reporte and reporte.huella == huella:
+            path = report_path(marca_id, periodo)
+            if reporte.estado == 'listo' and os.path.exists(path):
+                return send_file(path, mimetype='application/pdf', as_attachment=True,
+                                 download_name=f'reporte-{periodo}.pdf', max_age=0)
+            if reporte.estado == 'pendiente':
+                return jsonify({'reporte': reporte.to_dict()}), 202
+        
+        if not reporte:
+            reporte = ReporteMarca(marca_id=marca_id, periodo=periodo)
+            db.session.add(reporte)
+        reporte.estado = 'pendiente'
+        reporte.huella = huella
+        # Un solo trabajo por marca y período aunque se pida varias veces
+        enqueue('generar_reporte_marca', {'marca_id': marca_id, 'periodo': periodo},
+                clave_unica=f'reporte:{marca_id}:{periodo}')
+        db.session.commit()
+        
+        response = jsonify({'reporte': reporte.to_dict()})
+        response.headers['Retry-After'] = '5'
+        return response, 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@dashboard_bp.route('/reports', methods=['GET'])
+@require_brand_admin
+def get_brand_reports():
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        reportes = ReporteMarca.query.filter_by(marca_id=marca_id).order_by(ReporteMarca.periodo.desc()).all()
+        return jsonify({'reportes': [r.to_dict() for r in reportes]}), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @dashboard_bp.route('/analytics', methods=['GET'])
 @require_brand_admin
 def get_analytics():
     try:
-        user_id = session['user_id']
-        
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Parámetros de fecha
@@ -223,34 +325,29 @@ def get_analytics():
             fecha_inicio = datetime.fromisoformat(fecha_inicio)
             fecha_fin = datetime.fromisoformat(fecha_fin)
         
+        # Activaciones del período, incluidas las archivadas (por mes completo)
+        activaciones = activation_keys(fecha_inicio, fecha_fin)
+        
         # Activaciones en el período
-        activaciones_periodo = db.session.query(func.count(Activacion.id))\
-            .join(Producto)\
-            .filter(
-                Producto.marca_id == marca.id,
-                Activacion.fecha_activacion >= fecha_inicio,
-                Activacion.fecha_activacion <= fecha_fin
-            ).scalar()
+        activaciones_periodo = db.session.query(func.count())\
+            .select_from(activaciones)\
+            .join(Producto, Producto.id == activaciones.c.producto_id)\
+            .filter(Producto.marca_id == marca_id)\
+            .scalar()
         
         # Usuarios únicos en el período
-        usuarios_periodo = db.session.query(func.count(func.distinct(Activacion.usuario_id)))\
-            .join(Producto)\
-            .filter(
-                Producto.marca_id == marca.id,
-                Activacion.fecha_activacion >= fecha_inicio,
-                Activacion.fecha_activacion <= fecha_fin
-            ).scalar()
+        usuarios_periodo = db.session.query(func.count(func.distinct(activaciones.c.usuario_id)))\
+            .join(Producto, Producto.id == activaciones.c.producto_id)\
+            .filter(Producto.marca_id == marca_id)\
+            .scalar()
         
         # Distribución por categorías
         categorias = db.session.query(
             Producto.categoria,
-            func.count(Activacion.id).label('activaciones')
-        ).outerjoin(Activacion)\
-         .filter(
-             Producto.marca_id == marca.id,
-             Activacion.fecha_activacion >= fecha_inicio,
-             Activacion.fecha_activacion <= fecha_fin
-         ).group_by(Producto.categoria)\
+            func.count(activaciones.c.usuario_id).label('activaciones')
+        ).join(activaciones, Producto.id == activaciones.c.producto_id)\
+         .filter(Producto.marca_id == marca_id)\
+         .group_by(Producto.categoria)\
           .order_by(desc('activaciones')).all()
         
         return jsonify({
@@ -272,3 +369,70 @@ def get_analytics():
     except Exception as e:
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+
+@dashboard_bp.route('/platform/analytics', methods=['GET'])
+@require_platform_admin
+def get_platform_analytics():
+    try:
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        sort = request.args.get('sort', 'activaciones')
+        order = request.args.get('order', 'desc')
+        
+        if sort not in SORT_COLUMNS:
+            return jsonify({'error': f"sort debe ser uno de: {', '.join(SORT_COLUMNS)}"}), 400
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order debe ser asc o desc'}), 400
+        
+        # Parámetros de fecha (por defecto, todo el historial)
+        fecha_inicio = request.args.get('fecha_inicio')
+        fecha_fin = request.args.get('fecha_fin')
+        fecha_inicio = datetime.fromisoformat(fecha_inicio) if fecha_inicio else datetime.min
+        fecha_fin = datetime.fromisoformat(fecha_fin) if fecha_fin else datetime.utcnow()
+        
+        marcas, totales = brand_analytics(
+            db.session,
+            fecha_inicio,
+            fecha_fin,
+            sort=sort,
+            descending=order == 'desc',
+            limit=per_page,
+            offset=(page - 1) * per_page
+        )
+        
+        return jsonify({
+            'periodo': {
+                'fecha_inicio': fecha_inicio.isoformat() if fecha_inicio != datetime.min else None,
+                'fecha_fin': fecha_fin.isoformat()
+            },
+            'totales': totales,
+            'marcas': marcas,
+            'page': page,
+            'per_page': per_page,
+            'pages': (totales['marcas'] + per_page - 1) // per_page
+        }), 200
+        
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido (usa ISO 8601)'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@dashboard_bp.route('/platform/activation-archive', methods=['GET'])
+@require_platform_admin
+def get_activation_archive():
+    try:
+        particiones = ParticionActivacion.query.order_by(ParticionActivacion.periodo.desc()).all()
+        
+        return jsonify({
+            'meses_en_tabla_activa': current_app.config.get('ACTIVATION_ARCHIVE_MONTHS'),
+            'activaciones_activas': db.session.query(func.count(Activacion.id)).scalar(),
+            'particiones': [p.to_dict() for p in particiones]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@dashboard_bp.route('/rate-limits', methods=['GET'])
+@require_platform_admin
+def rate_limit_stats():
+    return jsonify({**limiter.stats(), 'idempotency': idempotency_store.stats()}), 200
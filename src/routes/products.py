@@ -1,8 +1,28 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User, Marca, Producto, Activacion, Recompensa, UsuarioRecompensa
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context, current_app
+from sqlalchemy import text
+from src.models.user import db, User, Producto, Activacion, Recompensa, UsuarioRecompensa, LoteCodigos, CodigoUnidad, AlertaActivacion
+from src.models.search import BM25_WEIGHTS, build_match_query
+from src.models.projections import product_dicts, user_activation_dicts, recommended_product_dicts
+from src.services.activation_codes import MAX_BATCH_SIZE, is_unit_code, redeem_unit_code
+from src.services.catalog_bulk import InvalidBulkUpdate, bulk_update_products
+from src.services.coupons import assign_coupon
+from src.services.group_commit import activation_writer
+from src.services.jobs import enqueue, task
+from src.services.user_summary import record_activation, recount_rewards_for_product
+from src.services.activation_archive import is_archived, archived_activations_for_user
+from src.services.activation_feed import feed, activation_event
+from src.services.activation_anomalies import DEFAULT_THRESHOLDS, detector, blocking, record_alerts
+from src.services.reward_backfill import grant_reward_statement
+from src.utils.rate_limit import rate_limit
+from src.utils.idempotency import idempotent
+from src.utils.auth_tokens import current_brand_id
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
 import random
 import string
+import logging
+
+logger = logging.getLogger(__name__)
 
 products_bp = Blueprint('products', __name__)
 
@@ -32,6 +52,94 @@ def generate_activation_code():
         if not Producto.query.filter_by(codigo_activacion=code).first():
             return code
 
+def resolve_activation_code(codigo):
+    """Devuelve (producto, codigo_unidad) para un código de producto o de unidad"""
+    if is_unit_code(codigo):
+        row = db.session.query(CodigoUnidad, Producto)\
+            .join(Producto, CodigoUnidad.producto_id == Producto.id)\
+            .filter(CodigoUnidad.codigo == codigo, Producto.activo == True)\
+            .first()
+        return (row[1], row[0]) if row else (None, None)
+    
+    producto = Producto.query.filter_by(codigo_activacion=codigo, activo=True).first()
+    return producto, None
+
+class ActivationRejected(Exception):
+    pass
+
+def write_activation(user_id, producto_id, codigo_unidad_id, hallazgos, ip):
+    """Escrituras de una activación en la transacción actual (sin commit).
+    
+    Corre en el request o en el hilo del escritor agrupado, así que recibe ids y solo
+    usa db.session; devuelve diccionarios para que la respuesta no dependa de la sesión.
+    """
+    producto = db.session.get(Producto, producto_id)
+    
+    # Repetido dentro de la transacción: con group-commit, otro request del mismo lote
+    # pudo haber activado el mismo producto después de la verificación del handler
+    if Activacion.query.filter_by(usuario_id=user_id, producto_id=producto_id).first():
+        raise ActivationRejected('Ya has activado este producto anteriormente')
+    
+    record_alerts(hallazgos, producto, user_id, ip)
+    
+    # Canjear el código de unidad (condicional, por si otro usuario lo canjea a la vez)
+    if codigo_unidad_id and not redeem_unit_code(codigo_unidad_id, user_id, datetime.utcnow()):
+        raise ActivationRejected('Este código ya fue utilizado')
+    
+    # Crear activación
+    puntos_ganados = 10  # Puntos base
+    activacion = Activacion(
+        usuario_id=user_id,
+        producto_id=producto.id,
+        puntos_ganados=puntos_ganados
+    )
+    
+    db.session.add(activacion)
+    
+    # Actualizar puntos del usuario
+    user = db.session.get(User, user_id)
+    user.puntos_totales += puntos_ganados
+    
+    # Calcular nuevo nivel (cada 100 puntos = 1 nivel)
+    nuevo_nivel = (user.puntos_totales // 100) + 1
+    user.nivel_actual = nuevo_nivel
+    
+    # Otorgar recompensas del producto
+    recompensas_producto = Recompensa.query.filter_by(
+        producto_id=producto.id, 
+        activa=True
+    ).all()
+    
+    recompensas_otorgadas = []
+    for recompensa in recompensas_producto:
+        usuario_recompensa = UsuarioRecompensa(
+            usuario_id=user_id,
+            recompensa_id=recompensa.id
+        )
+        db.session.add(usuario_recompensa)
+        recompensa_dict = recompensa.to_dict()
+        
+        # Cupón único del pool, si la recompensa lo usa
+        if recompensa.usa_pool_cupones:
+            db.session.flush()
+            codigo_cupon = assign_coupon(usuario_recompensa)
+            if codigo_cupon:
+                recompensa_dict['codigo_cupon'] = codigo_cupon
+        
+        recompensas_otorgadas.append(recompensa_dict)
+    
+    record_activation(user_id, producto.marca, datetime.utcnow(), otorgadas=len(recompensas_otorgadas))
+    db.session.flush()
+    
+    resultado = {
+        'activacion': activacion.to_dict(),
+        'puntos_ganados': puntos_ganados,
+        'puntos_totales': user.puntos_totales,
+        'nivel_actual': user.nivel_actual,
+        'recompensas_otorgadas': recompensas_otorgadas
+    }
+    return resultado, activation_event(activacion, producto, user)
+
 @products_bp.route('/products', methods=['GET'])
 def get_products():
     try:
@@ -40,19 +148,79 @@ def get_products():
         categoria = request.args.get('categoria')
         activo = request.args.get('activo', 'true').lower() == 'true'
         
-        query = Producto.query
+        conditions = []
         
         if marca_id:
-            query = query.filter_by(marca_id=marca_id)
+            conditions.append(Producto.marca_id == marca_id)
         if categoria:
-            query = query.filter_by(categoria=categoria)
+            conditions.append(Producto.categoria == categoria)
         if activo is not None:
-            query = query.filter_by(activo=activo)
+            conditions.append(Producto.activo == activo)
         
-        productos = query.all()
+        return jsonify({
+            'productos': product_dicts(*conditions)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@products_bp.route('/products/search', methods=['GET'])
+def search_products():
+    try:
+        q = request.args.get('q', '').strip()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        activo = request.args.get('activo', 'true').lower() == 'true'
+        
+        match = build_match_query(q)
+        if not match:
+            return jsonify({'error': 'Parámetro q requerido'}), 400
+        
+        params = {'match': match, 'activo': activo, 'limit': per_page, 'offset': (page - 1) * per_page}
+        if current_app.config.get('PRODUCT_SEARCH_FTS'):
+            # Índice FTS5 con ranking BM25 (menor = más relevante)
+            base = """
+                FROM producto_fts
+                JOIN producto p ON p.id = producto_fts.rowid
+                LEFT JOIN marca m ON m.id = p.marca_id
+                WHERE producto_fts MATCH :match AND p.activo = :activo
+            """
+            order = f'ORDER BY bm25(producto_fts, {BM25_WEIGHTS})'
+        else:
+            params['like'] = '%' + '%'.join(term.strip('"*') for term in match.split()) + '%'
+            base = """
+                FROM producto p
+                LEFT JOIN marca m ON m.id = p.marca_id
+                WHERE (p.nombre || ' ' || COALESCE(p.descripcion, '') || ' ' ||
+                       COALESCE(p.categoria, '') || ' ' || COALESCE(m.nombre, '')) LIKE :like
+                  AND p.activo = :activo
+            """
+            order = 'ORDER BY p.nombre'
+        
+        total = db.session.execute(text(f'SELECT COUNT(*) {base}'), params).scalar()
+        rows = db.session.execute(text(f"""
+            SELECT p.id, p.nombre, p.descripcion, p.categoria, p.precio, p.imagen_url,
+                   m.nombre AS marca, p.activo
+            {base} {order}
+            LIMIT :limit OFFSET :offset
+        """), params).mappings().all()
         
         return jsonify({
-            'productos': [p.to_dict() for p in productos]
+            'productos': [
+                {
+                    'id': r['id'],
+                    'nombre': r['nombre'],
+                    'descripcion': r['descripcion'],
+                    'categoria': r['categoria'],
+                    'precio': r['precio'],
+                    'imagen_url': r['imagen_url'],
+                    'marca': r['marca'],
+                    'activo': bool(r['activo'])
+                } for r in rows
+            ],
+            'total': total,
+            'page': page,
+            'per_page': per_page
         }), 200
         
     except Exception as e:
@@ -63,7 +231,6 @@ def get_products():
 def create_product():
     try:
         data = request.get_json()
-        user_id = session['user_id']
         
         # Validar datos requeridos
         required_fields = ['nombre', 'descripcion', 'categoria']
@@ -71,9 +238,8 @@ def create_product():
             if field not in data or not data[field]:
                 return jsonify({'error': f'Campo {field} es requerido'}), 400
         
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Generar código de activación si no se proporciona
@@ -93,23 +259,14 @@ def create_product():
             categoria=data['categoria'],
             precio=data.get('precio'),
             imagen_url=data.get('imagen_url'),
-            marca_id=marca.id
+            marca_id=marca_id
         )
         
         db.session.add(producto)
-        db.session.commit()
-        
-        # Crear recompensa por defecto
-        recompensa = Recompensa(
-            nombre=f"Recompensa por activar {producto.nombre}",
-            descripcion="¡Gracias por activar este producto!",
-            tipo="puntos",
-            valor="10 puntos",
-            producto_id=producto.id,
-            fecha_expiracion=datetime.utcnow() + timedelta(days=365)
-        )
+        db.session.flush()
         
-        db.session.add(recompensa)
+        # La recompensa por defecto se crea en segundo plano; la tarea se confirma junto al producto
+        enqueue('crear_recompensa_por_defecto', {'producto_id': producto.id}, prioridad=10)
         db.session.commit()
         
         return jsonify({
@@ -121,19 +278,68 @@ def create_product():
         db.session.rollback()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@task('crear_recompensa_por_defecto')
+def create_default_reward(payload):
+    producto = Producto.query.get(payload['producto_id'])
+    if not producto:
+        return
+    
+    nombre = f"Recompensa por activar {producto.nombre}"
+    # Idempotente ante reintentos
+    if Recompensa.query.filter_by(producto_id=producto.id, nombre=nombre).first():
+        return
+    
+    recompensa = Recompensa(
+        nombre=nombre,
+        descripcion="¡Gracias por activar este producto!",
+        tipo="puntos",
+        valor="10 puntos",
+        producto_id=producto.id,
+        fecha_expiracion=datetime.utcnow() + timedelta(days=365)
+    )
+    db.session.add(recompensa)
+    db.session.flush()
+    
+    # Quienes activaron antes de que corriera la tarea también la reciben
+    db.session.execute(grant_reward_statement(recompensa.id, producto.id))
+    recount_rewards_for_product(db.session, producto.id)
+
+@products_bp.route('/products/bulk', methods=['PUT'])
+@require_brand_admin
+def bulk_update_products_route():
+    """Cambios de temporada sobre muchos productos: un UPDATE por tabla y un solo commit"""
+    try:
+        data = request.get_json() or {}
+        
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        resultado = bulk_update_products(marca_id, data)
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Productos actualizados exitosamente',
+            **resultado
+        }), 200
+        
+    except InvalidBulkUpdate as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @products_bp.route('/products/<int:product_id>', methods=['PUT'])
 @require_brand_admin
 def update_product(product_id):
     try:
-        user_id = session['user_id']
-        
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Obtener el producto
-        producto = Producto.query.filter_by(id=product_id, marca_id=marca.id).first()
+        producto = Producto.query.filter_by(id=product_id, marca_id=marca_id).first()
         if not producto:
             return jsonify({'error': 'Producto no encontrado'}), 404
         
@@ -164,7 +370,21 @@ def update_product(product_id):
         db.session.rollback()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@products_bp.route('/products/<int:product_id>/recommendations', methods=['GET'])
+def get_product_recommendations(product_id):
+    try:
+        limit = min(max(request.args.get('limit', current_app.config.get('RECOMMENDATIONS_LIMIT', 5), type=int), 1), 20)
+        
+        # Con sesión se omiten los productos que el usuario ya activó
+        return jsonify({
+            'recomendaciones': recommended_product_dicts(product_id, limit, usuario_id=session.get('user_id'))
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @products_bp.route('/validate-code', methods=['POST'])
+@rate_limit('validate_code')
 def validate_code():
     try:
         data = request.get_json()
@@ -173,7 +393,7 @@ def validate_code():
         if not codigo:
             return jsonify({'error': 'Código de activación requerido'}), 400
         
-        producto = Producto.query.filter_by(codigo_activacion=codigo, activo=True).first()
+        producto, codigo_unidad = resolve_activation_code(codigo)
         
         if not producto:
             return jsonify({
@@ -181,6 +401,12 @@ def validate_code():
                 'mensaje': 'Código de activación inválido o producto inactivo'
             }), 200
         
+        if codigo_unidad and codigo_unidad.canjeado:
+            return jsonify({
+                'valido': False,
+                'mensaje': 'Este código ya fue utilizado'
+            }), 200
+        
         return jsonify({
             'valido': True,
             'producto': producto.to_dict(),
@@ -191,6 +417,8 @@ def validate_code():
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
 @products_bp.route('/activate', methods=['POST'])
+@idempotent
+@rate_limit('activate')
 @require_auth
 def activate_product():
     try:
@@ -202,61 +430,87 @@ def activate_product():
             return jsonify({'error': 'Código de activación requerido'}), 400
         
         # Validar código
-        producto = Producto.query.filter_by(codigo_activacion=codigo, activo=True).first()
+        producto, codigo_unidad = resolve_activation_code(codigo)
         if not producto:
             return jsonify({'error': 'Código de activación inválido o producto inactivo'}), 400
         
+        if codigo_unidad and codigo_unidad.canjeado:
+            return jsonify({'error': 'Este código ya fue utilizado'}), 400
+        
         # Verificar si ya fue activado por este usuario
         activacion_existente = Activacion.query.filter_by(
             usuario_id=user_id, 
             producto_id=producto.id
         ).first()
         
-        if activacion_existente:
+        if activacion_existente or is_archived(user_id, producto.id):
             return jsonify({'error': 'Ya has activado este producto anteriormente'}), 400
         
-        # Crear activación
-        puntos_ganados = 10  # Puntos base
-        activacion = Activacion(
-            usuario_id=user_id,
-            producto_id=producto.id,
-            puntos_ganados=puntos_ganados
+        # Ráfagas por código, IP y usuario: un código filtrado recibe miles de activaciones en minutos
+        ip = request.remote_addr or 'unknown'
+        hallazgos = detector.observe(
+            [('codigo', codigo), ('ip', ip), ('usuario', str(user_id))],
+            current_app.config.get('ANOMALY_THRESHOLDS', DEFAULT_THRESHOLDS)
         )
-        
-        db.session.add(activacion)
-        
-        # Actualizar puntos del usuario
-        user = User.query.get(user_id)
-        user.puntos_totales += puntos_ganados
-        
-        # Calcular nuevo nivel (cada 100 puntos = 1 nivel)
-        nuevo_nivel = (user.puntos_totales // 100) + 1
-        user.nivel_actual = nuevo_nivel
-        
-        # Otorgar recompensas del producto
-        recompensas_producto = Recompensa.query.filter_by(
-            producto_id=producto.id, 
-            activa=True
-        ).all()
-        
-        recompensas_otorgadas = []
-        for recompensa in recompensas_producto:
-            usuario_recompensa = UsuarioRecompensa(
-                usuario_id=user_id,
-                recompensa_id=recompensa.id
+        bloqueo = blocking(hallazgos)
+        if bloqueo:
+            record_alerts(hallazgos, producto, user_id, ip)
+            db.session.commit()
+            response = jsonify({'error': 'Detectamos actividad inusual, intenta nuevamente más tarde'})
+            response.headers['Retry-After'] = str(bloqueo.ventana)
+            return response, 429
+        
+        args = (user_id, producto.id, codigo_unidad.id if codigo_unidad else None, hallazgos, ip)
+        try:
+            if activation_writer.running:
+                # Modo group-commit: la escritura se confirma junto con las de otros requests.
+                # Se libera la conexión del request mientras espera, para que no se la quite al escritor
+                db.session.close()
+                future = activation_writer.submit(write_activation, *args)
+                try:
+                    resultado, evento = future.result(
+                        timeout=current_app.config.get('GROUP_COMMIT_TIMEOUT_SECONDS', 10)
+                    )
+                except FutureTimeout:
+                    if future.cancel():
+                        # No llegó a escribirse: el cliente puede reintentar tal cual
+                        response = jsonify({'error': 'El servidor está ocupado, intenta nuevamente'})
+                        response.headers['Retry-After'] = '1'
+                        return response, 503
+                    # Ya se está escribiendo y puede confirmarse en cualquier momento: no es un error
+                    marca_id = producto.marca_id
+                    future.add_done_callback(
+                        lambda f: f.exception() is None and feed.publish(marca_id, f.result()[1])
+                    )
+                    return jsonify({
+                        'message': 'Activación en proceso, revisa tus activaciones en unos segundos',
+                        'estado': 'pendiente'
+                    }), 202
+            else:
+                resultado, evento = write_activation(*args)
+                db.session.commit()
+        except ActivationRejected as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        
+        # Aviso en vivo a los dashboards de la marca (solo lo ya confirmado)
+        feed.publish(producto.marca_id, evento)
+        
+        # Quienes activaron este producto también activaron... La activación ya está
+        # confirmada: si las sugerencias fallan se responde sin ellas, nunca con un 500
+        try:
+            recomendaciones = recommended_product_dicts(
+                producto.id, current_app.config.get('RECOMMENDATIONS_LIMIT', 5), usuario_id=user_id
             )
-            db.session.add(usuario_recompensa)
-            recompensas_otorgadas.append(recompensa.to_dict())
-        
-        db.session.commit()
+        except Exception:
+            logger.exception('No se pudieron calcular las recomendaciones del producto %s', producto.id)
+            db.session.rollback()
+            recomendaciones = []
         
         return jsonify({
             'message': '¡Producto activado exitosamente!',
-            'activacion': activacion.to_dict(),
-            'puntos_ganados': puntos_ganados,
-            'puntos_totales': user.puntos_totales,
-            'nivel_actual': user.nivel_actual,
-            'recompensas_otorgadas': recompensas_otorgadas
+            **resultado,
+            'recomendaciones': recomendaciones
         }), 200
         
     except Exception as e:
@@ -269,11 +523,29 @@ def get_my_activations():
     try:
         user_id = session['user_id']
         
-        activaciones = Activacion.query.filter_by(usuario_id=user_id)\
-            .order_by(Activacion.fecha_activacion.desc()).all()
+        resultado = user_activation_dicts(user_id)
+        
+        # Las activaciones viejas están en los archivos mensuales
+        archivadas = archived_activations_for_user(user_id)
+        if archivadas:
+            vistos = {a['id'] for a in resultado}
+            productos = {
+                p['id']: p for p in product_dicts(Producto.id.in_({a['producto_id'] for a in archivadas}))
+            }
+            for a in archivadas:
+                if a['id'] in vistos:
+                    continue
+                vistos.add(a['id'])
+                resultado.append({
+                    'id': a['id'],
+                    'producto': productos.get(a['producto_id']),
+                    'fecha_activacion': datetime.fromisoformat(a['fecha_activacion']).isoformat() if a['fecha_activacion'] else None,
+                    'puntos_ganados': a['puntos_ganados']
+                })
+            resultado.sort(key=lambda a: a['fecha_activacion'] or '', reverse=True)
         
         return jsonify({
-            'activaciones': [a.to_dict() for a in activaciones]
+            'activaciones': resultado
         }), 200
         
     except Exception as e:
@@ -296,3 +568,162 @@ def get_categories():
     except Exception as e:
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+
+@products_bp.route('/activation-alerts', methods=['GET'])
+@require_brand_admin
+def get_activation_alerts():
+    try:
+        estado = request.args.get('estado', 'pendiente')
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        query = AlertaActivacion.query.filter_by(marca_id=marca_id)
+        if estado != 'todas':
+            query = query.filter_by(estado=estado)
+        alertas = query.order_by(AlertaActivacion.fecha.desc()).limit(limit).all()
+        
+        resultado = []
+        for alerta in alertas:
+            alerta_dict = alerta.to_dict()
+            # Activaciones en la ventana actual: muestra si la ráfaga sigue en curso
+            alerta_dict['conteo_actual'] = detector.current(alerta.alcance, alerta.clave)
+            resultado.append(alerta_dict)
+        
+        return jsonify({
+            'alertas': resultado
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@products_bp.route('/activation-alerts/<int:alert_id>', methods=['PUT'])
+@require_brand_admin
+def review_activation_alert(alert_id):
+    try:
+        data = request.get_json() or {}
+        
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        alerta = AlertaActivacion.query.filter_by(id=alert_id, marca_id=marca_id).first()
+        if not alerta:
+            return jsonify({'error': 'Alerta no encontrada'}), 404
+        
+        if data.get('estado') not in ('confirmada', 'descartada'):
+            return jsonify({'error': 'estado debe ser confirmada o descartada'}), 400
+        
+        alerta.estado = data['estado']
+        alerta.fecha_revision = datetime.utcnow()
+        
+        # Confirmar un código filtrado puede desactivar el producto de inmediato
+        if alerta.estado == 'confirmada' and alerta.alcance == 'codigo' and data.get('desactivar_producto'):
+            alerta.producto.activo = False
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Alerta revisada',
+            'alerta': alerta.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@products_bp.route('/products/<int:product_id>/code-batches', methods=['POST'])
+@require_brand_admin
+def create_code_batch(product_id):
+    try:
+        data = request.get_json()
+        
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        producto = Producto.query.filter_by(id=product_id, marca_id=marca_id).first()
+        if not producto:
+            return jsonify({'error': 'Producto no encontrado'}), 404
+        
+        cantidad = data.get('cantidad')
+        if not isinstance(cantidad, int) or cantidad < 1 or cantidad > MAX_BATCH_SIZE:
+            return jsonify({'error': f'La cantidad debe ser un entero entre 1 y {MAX_BATCH_SIZE}'}), 400
+        
+        lote = LoteCodigos(producto_id=producto.id, cantidad=cantidad)
+        db.session.add(lote)
+        db.session.flush()
+        
+        # La generación corre en la cola de tareas; el lote y su tarea se confirman juntos
+        enqueue('generar_lote_codigos', {'lote_id': lote.id})
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Generación de códigos en curso',
+            'lote': lote.to_dict()
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@products_bp.route('/products/<int:product_id>/code-batches', methods=['GET'])
+@require_brand_admin
+def get_code_batches(product_id):
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        lotes = db.session.query(LoteCodigos)\
+            .join(Producto, LoteCodigos.producto_id == Producto.id)\
+            .filter(LoteCodigos.producto_id == product_id, Producto.marca_id == marca_id)\
+            .order_by(LoteCodigos.id.desc())\
+            .all()
+        
+        return jsonify({
+            'lotes': [l.to_dict() for l in lotes]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@products_bp.route('/code-batches/<int:batch_id>/export', methods=['GET'])
+@require_brand_admin
+def export_code_batch(batch_id):
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        lote = db.session.query(LoteCodigos)\
+            .join(Producto, LoteCodigos.producto_id == Producto.id)\
+            .filter(LoteCodigos.id == batch_id, Producto.marca_id == marca_id)\
+            .first()
+        if not lote:
+            return jsonify({'error': 'Lote no encontrado'}), 404
+        
+        def generate():
+            # Recorrido keyset por id para no cargar millones de filas en memoria
+            yield 'codigo,canjeado\n'
+            last_id = 0
+            while True:
+                rows = db.session.query(CodigoUnidad.id, CodigoUnidad.codigo, CodigoUnidad.canjeado)\
+                    .filter(CodigoUnidad.lote_id == batch_id, CodigoUnidad.id > last_id)\
+                    .order_by(CodigoUnidad.id)\
+                    .limit(10000).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                yield ''.join(f'{r[1]},{int(r[2])}\n' for r in rows)
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=lote-{batch_id}.csv'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
@@ -1,5 +1,14 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import db, User, Recompensa, UsuarioRecompensa, Marca, Producto
+from flask import Blueprint, request, jsonify, session, current_app
+from src.models.user import db, User, Recompensa, UsuarioRecompensa, Producto, BackfillRecompensa
+from src.models.projections import brand_reward_dicts
+from src.services.catalog_bulk import InvalidBulkUpdate, bulk_update_rewards
+from src.services.coupons import MAX_GENERATED_COUPONS, insert_coupons, pool_stats
+from src.services.jobs import enqueue, task
+from src.services.reward_backfill import start_backfill
+from src.services.user_summary import get_summary, record_rewards
+from src.utils.idempotency import idempotent
+from src.utils.auth_tokens import current_brand_id
+from sqlalchemy import select, update, func
 from datetime import datetime, timedelta
 
 rewards_bp = Blueprint('rewards', __name__)
@@ -36,24 +45,42 @@ def get_my_rewards():
         
         usuario_recompensas = query.order_by(UsuarioRecompensa.fecha_otorgada.desc()).all()
         
-        # Verificar recompensas expiradas
+        # Verificar recompensas expiradas: se muestran como tales y la escritura se difiere
         now = datetime.utcnow()
+        recompensas = []
+        hay_expiradas = False
         for ur in usuario_recompensas:
+            item = ur.to_dict()
             if (ur.estado == 'disponible' and 
                 ur.recompensa.fecha_expiracion and 
                 ur.recompensa.fecha_expiracion < now):
-                ur.estado = 'expirada'
+                item['estado'] = 'expirada'
+                hay_expiradas = True
+            recompensas.append(item)
         
-        db.session.commit()
+        if hay_expiradas:
+            enqueue('expirar_recompensas', {'usuario_id': user_id}, clave_unica=f'expirar_recompensas:{user_id}')
+            db.session.commit()
         
         return jsonify({
-            'recompensas': [ur.to_dict() for ur in usuario_recompensas]
+            'recompensas': recompensas
         }), 200
         
     except Exception as e:
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@task('expirar_recompensas')
+def expire_user_rewards(payload):
+    vencidas = db.session.query(Recompensa.id).filter(Recompensa.fecha_expiracion < datetime.utcnow())
+    expiradas = UsuarioRecompensa.query.filter(
+        UsuarioRecompensa.usuario_id == payload['usuario_id'],
+        UsuarioRecompensa.estado == 'disponible',
+        UsuarioRecompensa.recompensa_id.in_(vencidas)
+    ).update({'estado': 'expirada'}, synchronize_session=False)
+    record_rewards(payload['usuario_id'], expiradas=expiradas)
+
 @rewards_bp.route('/claim/<int:usuario_recompensa_id>', methods=['POST'])
+@idempotent
 @require_auth
 def claim_reward(usuario_recompensa_id):
     try:
@@ -74,28 +101,24 @@ def claim_reward(usuario_recompensa_id):
         if (usuario_recompensa.recompensa.fecha_expiracion and 
             usuario_recompensa.recompensa.fecha_expiracion < datetime.utcnow()):
             usuario_recompensa.estado = 'expirada'
+            record_rewards(user_id, expiradas=1)
             db.session.commit()
             return jsonify({'error': 'Esta recompensa ha expirado'}), 400
         
         # Reclamar recompensa
         usuario_recompensa.estado = 'reclamada'
         usuario_recompensa.fecha_reclamada = datetime.utcnow()
+        record_rewards(user_id, reclamadas=1)
         
         # Si es recompensa de puntos, agregar puntos al usuario
-        if usuario_recompensa.recompensa.tipo == 'puntos':
-            try:
-                puntos_str = usuario_recompensa.recompensa.valor
-                puntos = int(puntos_str.split()[0])  # Extraer número de "10 puntos"
-                
-                user = User.query.get(user_id)
-                user.puntos_totales += puntos
-                
-                # Recalcular nivel
-                nuevo_nivel = (user.puntos_totales // 100) + 1
-                user.nivel_actual = nuevo_nivel
-                
-            except (ValueError, IndexError):
-                pass  # Si no se puede parsear, continuar sin agregar puntos
+        puntos = usuario_recompensa.recompensa.valor_numerico
+        if usuario_recompensa.recompensa.tipo == 'puntos' and puntos:
+            user = User.query.get(user_id)
+            user.puntos_totales += puntos
+            
+            # Recalcular nivel
+            nuevo_nivel = (user.puntos_totales // 100) + 1
+            user.nivel_actual = nuevo_nivel
         
         db.session.commit()
         
@@ -108,12 +131,75 @@ def claim_reward(usuario_recompensa_id):
         db.session.rollback()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@rewards_bp.route('/claim-all', methods=['POST'])
+@idempotent
+@require_auth
+def claim_all_rewards():
+    """Reclama todas las recompensas disponibles (o las indicadas en `ids`) en una transacción"""
+    try:
+        user_id = session['user_id']
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids') if isinstance(data, dict) else None
+        if not isinstance(data, dict) or (ids is not None and (
+                not isinstance(ids, list) or not ids
+                or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids))):
+            return jsonify({'error': 'ids debe ser una lista de ids de recompensas'}), 400
+        now = datetime.utcnow()
+        ur_table = UsuarioRecompensa.__table__
+        
+        vencidas = select(Recompensa.id).where(Recompensa.fecha_expiracion < now)
+        condiciones = [ur_table.c.usuario_id == user_id, ur_table.c.estado == 'disponible']
+        if ids:
+            condiciones.append(ur_table.c.id.in_(ids))
+        
+        # Las vencidas se marcan como expiradas en el mismo paso
+        expiradas = db.session.execute(
+            update(ur_table)
+            .where(*condiciones, ur_table.c.recompensa_id.in_(vencidas))
+            .values(estado='expirada')
+        ).rowcount
+        
+        # RETURNING devuelve exactamente las filas que este request reclamó,
+        # así dos reclamos concurrentes nunca acreditan los mismos puntos
+        reclamadas = db.session.execute(
+            update(ur_table)
+            .where(*condiciones)
+            .values(estado='reclamada', fecha_reclamada=now)
+            .returning(ur_table.c.id)
+        ).scalars().all()
+        
+        puntos = 0
+        if reclamadas:
+            puntos = db.session.query(func.coalesce(func.sum(Recompensa.valor_numerico), 0))\
+                .join(UsuarioRecompensa, UsuarioRecompensa.recompensa_id == Recompensa.id)\
+                .filter(UsuarioRecompensa.id.in_(reclamadas), Recompensa.tipo == 'puntos')\
+                .scalar()
+        
+        user = User.query.get(user_id)
+        if puntos:
+            user.puntos_totales += puntos
+            user.nivel_actual = (user.puntos_totales // 100) + 1
+        
+        record_rewards(user_id, reclamadas=len(reclamadas), expiradas=expiradas)
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'{len(reclamadas)} recompensas reclamadas',
+            'reclamadas': reclamadas,
+            'puntos_acreditados': puntos,
+            'puntos_totales': user.puntos_totales,
+            'nivel_actual': user.nivel_actual
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @rewards_bp.route('/rewards', methods=['POST'])
 @require_brand_admin
 def create_reward():
     try:
         data = request.get_json()
-        user_id = session['user_id']
         
         # Validar datos requeridos
         required_fields = ['nombre', 'descripcion', 'tipo', 'valor', 'producto_id']
@@ -122,13 +208,13 @@ def create_reward():
                 return jsonify({'error': f'Campo {field} es requerido'}), 400
         
         # Verificar que el producto pertenece a la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         producto = Producto.query.filter_by(
             id=data['producto_id'],
-            marca_id=marca.id
+            marca_id=marca_id
         ).first()
         
         if not producto:
@@ -152,10 +238,17 @@ def create_reward():
         db.session.add(recompensa)
         db.session.commit()
         
-        return jsonify({
+        response = {
             'message': 'Recompensa creada exitosamente',
             'recompensa': recompensa.to_dict()
-        }), 201
+        }
+        
+        # Asignación retroactiva (opcional) a quienes ya activaron el producto
+        if data.get('retroactiva'):
+            backfill = start_backfill(current_app._get_current_object(), recompensa)
+            response['backfill'] = backfill.to_dict()
+        
+        return jsonify(response), 201
         
     except Exception as e:
         db.session.rollback()
@@ -165,42 +258,56 @@ def create_reward():
 @require_brand_admin
 def get_brand_rewards():
     try:
-        user_id = session['user_id']
-        
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Obtener recompensas de productos de la marca
-        recompensas = db.session.query(Recompensa)\
-            .join(Producto)\
-            .filter(Producto.marca_id == marca.id)\
-            .order_by(Recompensa.id.desc())\
-            .all()
+        return jsonify({
+            'recompensas': brand_reward_dicts(marca_id)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@rewards_bp.route('/rewards/bulk', methods=['PUT'])
+@require_brand_admin
+def bulk_update_rewards_route():
+    """Activa, desactiva o cambia valor y vencimiento de muchas recompensas con un solo UPDATE"""
+    try:
+        data = request.get_json() or {}
+        
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        resultado = bulk_update_rewards(marca_id, data)
+        db.session.commit()
         
         return jsonify({
-            'recompensas': [r.to_dict() for r in recompensas]
+            'message': 'Recompensas actualizadas exitosamente',
+            **resultado
         }), 200
         
+    except InvalidBulkUpdate as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
 @rewards_bp.route('/rewards/<int:reward_id>', methods=['PUT'])
 @require_brand_admin
 def update_reward(reward_id):
     try:
-        user_id = session['user_id']
-        
-        # Obtener la marca del usuario
-        marca = Marca.query.filter_by(admin_id=user_id).first()
-        if not marca:
+        marca_id = current_brand_id()
+        if not marca_id:
             return jsonify({'error': 'No tienes una marca asociada'}), 400
         
         # Verificar que la recompensa pertenece a un producto de la marca
         recompensa = db.session.query(Recompensa)\
             .join(Producto)\
-            .filter(Recompensa.id == reward_id, Producto.marca_id == marca.id)\
+            .filter(Recompensa.id == reward_id, Producto.marca_id == marca_id)\
             .first()
         
         if not recompensa:
@@ -238,30 +345,129 @@ def update_reward(reward_id):
         db.session.rollback()
         return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@rewards_bp.route('/rewards/<int:reward_id>/backfill', methods=['POST'])
+@require_brand_admin
+def backfill_reward(reward_id):
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        recompensa = db.session.query(Recompensa)\
+            .join(Producto)\
+            .filter(Recompensa.id == reward_id, Producto.marca_id == marca_id)\
+            .first()
+        
+        if not recompensa:
+            return jsonify({'error': 'Recompensa no encontrada'}), 404
+        
+        backfill = start_backfill(current_app._get_current_object(), recompensa)
+        
+        return jsonify({
+            'message': 'Asignación retroactiva en curso',
+            'backfill': backfill.to_dict()
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@rewards_bp.route('/rewards/<int:reward_id>/backfill', methods=['GET'])
+@require_brand_admin
+def get_backfill_status(reward_id):
+    try:
+        marca_id = current_brand_id()
+        if not marca_id:
+            return jsonify({'error': 'No tienes una marca asociada'}), 400
+        
+        backfill = db.session.query(BackfillRecompensa)\
+            .join(Producto, BackfillRecompensa.producto_id == Producto.id)\
+            .filter(BackfillRecompensa.recompensa_id == reward_id, Producto.marca_id == marca_id)\
+            .order_by(BackfillRecompensa.id.desc())\
+            .first()
+        
+        if not backfill:
+            return jsonify({'error': 'No hay asignación retroactiva para esta recompensa'}), 404
+        
+        return jsonify({'backfill': backfill.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+def get_brand_reward(reward_id):
+    """Recompensa de un producto de la marca del usuario, o None"""
+    return db.session.query(Recompensa)\
+        .join(Producto)\
+        .filter(Recompensa.id == reward_id, Producto.marca_id == current_brand_id())\
+        .first()
+
+@rewards_bp.route('/rewards/<int:reward_id>/coupons', methods=['POST'])
+@require_brand_admin
+def add_coupons(reward_id):
+    try:
+        recompensa = get_brand_reward(reward_id)
+        if not recompensa:
+            return jsonify({'error': 'Recompensa no encontrada'}), 404
+        
+        # Archivo de texto/CSV con un código por línea, leído en streaming
+        if 'file' in request.files:
+            lineas = (linea.decode('utf-8', 'ignore').split(',')[0] for linea in request.files['file'].stream)
+            insertados = insert_coupons(recompensa.id, lineas)
+            return jsonify({'message': 'Cupones cargados', 'insertados': insertados, 'pool': pool_stats(recompensa.id)}), 201
+        
+        data = request.get_json()
+        
+        if data.get('codigos'):
+            insertados = insert_coupons(recompensa.id, data['codigos'])
+            return jsonify({'message': 'Cupones cargados', 'insertados': insertados, 'pool': pool_stats(recompensa.id)}), 201
+        
+        cantidad = data.get('generar')
+        if not isinstance(cantidad, int) or cantidad < 1 or cantidad > MAX_GENERATED_COUPONS:
+            return jsonify({'error': f'Envía "codigos" o "generar" (entre 1 y {MAX_GENERATED_COUPONS})'}), 400
+        
+        # La generación corre en la cola de tareas
+        enqueue('generar_cupones', {
+            'recompensa_id': recompensa.id,
+            'prefijo': data.get('prefijo'),
+            'total_objetivo': pool_stats(recompensa.id)['total'] + cantidad
+        })
+        db.session.commit()
+        
+        return jsonify({'message': 'Generación de cupones en curso', 'pool': pool_stats(recompensa.id)}), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
+@rewards_bp.route('/rewards/<int:reward_id>/coupons', methods=['GET'])
+@require_brand_admin
+def get_coupon_pool(reward_id):
+    try:
+        recompensa = get_brand_reward(reward_id)
+        if not recompensa:
+            return jsonify({'error': 'Recompensa no encontrada'}), 404
+        
+        return jsonify({'pool': pool_stats(recompensa.id)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+
 @rewards_bp.route('/stats', methods=['GET'])
 @require_auth
 def get_reward_stats():
     try:
         user_id = session['user_id']
         
-        # Estadísticas de recompensas del usuario
-        total_recompensas = UsuarioRecompensa.query.filter_by(usuario_id=user_id).count()
-        recompensas_disponibles = UsuarioRecompensa.query.filter_by(
-            usuario_id=user_id, 
-            estado='disponible'
-        ).count()
-        recompensas_reclamadas = UsuarioRecompensa.query.filter_by(
-            usuario_id=user_id, 
-            estado='reclamada'
-        ).count()
+        # Estadísticas de recompensas del usuario (resumen materializado)
+        resumen = get_summary(user_id)
         
         # Obtener información del usuario
         user = User.query.get(user_id)
         
         return jsonify({
-            'total_recompensas': total_recompensas,
-            'recompensas_disponibles': recompensas_disponibles,
-            'recompensas_reclamadas': recompensas_reclamadas,
+            'total_recompensas': resumen.recompensas_total,
+            'recompensas_disponibles': resumen.recompensas_disponibles,
+            'recompensas_reclamadas': resumen.recompensas_reclamadas,
             'puntos_totales': user.puntos_totales,
             'nivel_actual': user.nivel_actual,
             'puntos_siguiente_nivel': ((user.nivel_actual * 100) - user.puntos_totales)
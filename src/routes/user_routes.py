@@ -1,26 +1,60 @@
 
 import os
-from flask import Blueprint, request, jsonify
-from werkzeug.utils import secure_filename
-from datetime import datetime
-from src.models.user import User
-from src.database.db import db
+import logging
+from flask import Blueprint, request, jsonify, session, current_app
+from sqlalchemy import update
+from src.models.user import db, User
+from src.utils.uploads import (
+    UPLOAD_FOLDER, UPLOAD_URL_PREFIX, MAX_UPLOAD_BYTES, UploadTooLarge, InvalidImage,
+    save_stream, schedule_thumbnails, thumbnail_urls
+)
 
-user_bp = Blueprint('user_bp', __name__, url_prefix='/api/user')
+logger = logging.getLogger(__name__)
 
-UPLOAD_FOLDER = 'src/static/uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+user_bp = Blueprint('user_bp', __name__, url_prefix='/api/user')
 
 # Asegurar carpeta
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def require_auth(f):
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'No autenticado'}), 401
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+
+def require_owner(f):
+    """Solo el propio usuario puede ver o modificar su perfil"""
+    def decorated_function(user_id, *args, **kwargs):
+        if session['user_id'] != user_id:
+            return jsonify({'error': 'Acceso denegado'}), 403
+        return f(user_id, *args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+
+def fallback_to_original(app, thumbnail_url, original_url):
+    """Si las miniaturas fallan, los perfiles que apuntan a la miniatura pasan a usar el original"""
+    def on_error(error):
+        try:
+            with app.app_context(), db.engine.begin() as conn:
+                conn.execute(
+                    update(User.__table__)
+                    .where(User.__table__.c.foto_perfil_url == thumbnail_url)
+                    .values(foto_perfil_url=original_url)
+                )
+        except Exception:
+            logger.exception('No se pudo reemplazar la foto de perfil %s', thumbnail_url)
+    return on_error
 
 
 # 🧑‍💻 Obtener perfil
 @user_bp.route('/<int:user_id>', methods=['GET'])
+@require_auth
+@require_owner
 def get_user(user_id):
     user = User.query.get(user_id)
     if user:
@@ -30,48 +64,76 @@ def get_user(user_id):
 
 # ✏️ Editar perfil
 @user_bp.route('/<int:user_id>', methods=['PUT'])
+@require_auth
+@require_owner
 def update_user(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"error": "Usuario no encontrado"}), 404
-
-    data = request.json
-
-    user.full_name = data.get('full_name', user.full_name)
-    user.bio = data.get('bio', user.bio)
-    user.profile_picture_url = data.get('profile_picture_url', user.profile_picture_url)
-    user.location = data.get('location', user.location)
-
-    birth_date = data.get('birth_date')
-    if birth_date:
-        try:
-            user.birth_date = datetime.strptime(birth_date, "%Y-%m-%d")
-        except ValueError:
-            return jsonify({"error": "Fecha inválida. Usá formato YYYY-MM-DD"}), 400
+    try:
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({"error": "Usuario no encontrado"}), 404
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Se esperaba un objeto JSON"}), 400
+
+        # La foto se cambia solo con /upload: así siempre apunta a una miniatura generada acá
+        if 'nombre' in data:
+            nombre = data['nombre'].strip() if isinstance(data['nombre'], str) else ''
+            if not nombre or len(nombre) > 100:
+                return jsonify({"error": "El nombre debe tener entre 1 y 100 caracteres"}), 400
+            user.nombre = nombre
+
+        db.session.commit()
+        return jsonify(user.to_dict()), 200
 
-    db.session.commit()
-    return jsonify(user.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
 
 # 📷 Subida de foto de perfil local
 @user_bp.route('/<int:user_id>/upload', methods=['POST'])
+@require_auth
+@require_owner
 def upload_profile_picture(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"error": "Usuario no encontrado"}), 404
-
-    if 'file' not in request.files:
-        return jsonify({"error": "No se encontró ningún archivo"}), 400
+    try:
+        user = User.query.get(user_id)
+        if not user:
+            return jsonify({"error": "Usuario no encontrado"}), 404
 
-    file = request.files['file']
-    if file.filename == '' or not allowed_file(file.filename):
-        return jsonify({"error": "Archivo inválido"}), 400
+        if 'file' not in request.files:
+            return jsonify({"error": "No se encontró ningún archivo"}), 400
 
-    filename = secure_filename(file.filename)
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(path)
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({"error": "Archivo inválido"}), 400
 
-    user.profile_picture_url = f"/static/uploads/{filename}"
-    db.session.commit()
-
-    return jsonify({"message": "Imagen subida correctamente", "url": user.profile_picture_url}), 200
+        # El formato (y la extensión guardada) sale del contenido, no del nombre del archivo
+        try:
+            content_hash, extension = save_stream(file.stream)
+        except UploadTooLarge:
+            return jsonify({"error": f"La imagen supera el máximo de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"}), 413
+        except InvalidImage:
+            return jsonify({"error": "Archivo inválido (PNG, JPEG o GIF de hasta 8000 px por lado)"}), 400
+
+        variantes = thumbnail_urls(content_hash)
+        original = f"{UPLOAD_URL_PREFIX}/{content_hash}.{extension}"
+        user.foto_perfil_url = variantes['128']['webp']
+        db.session.commit()
+
+        # Las miniaturas se generan en segundo plano (las URLs son deterministas); se encolan
+        # después del commit para que, si fallan, el reemplazo por el original encuentre la fila
+        schedule_thumbnails(content_hash, extension, on_error=fallback_to_original(
+            current_app._get_current_object(), user.foto_perfil_url, original
+        ))
+
+        return jsonify({
+            "message": "Imagen subida correctamente",
+            "url": user.foto_perfil_url,
+            "variantes": variantes,
+            "original": original
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
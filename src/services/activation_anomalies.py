@@ -0,0 +1,154 @@
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from src.models.user import db, AlertaActivacion
+
+# Umbrales por alcance: (ventana en segundos, activaciones para marcar, activaciones para
+# bloquear o None). Se pueden sobreescribir con app.config['ANOMALY_THRESHOLDS'];
+# un alcance ausente no se sigue.
+DEFAULT_THRESHOLDS = {
+    'codigo': (300, 100, 1000),
+    'ip': (300, 30, 100),
+    'usuario': (60, 10, 30),
+}
+
+BUCKETS = 12
+MAX_TRACKED_KEYS = 20_000
+
+
+class SlidingWindowCounter:
+    """Conteo aproximado en una ventana deslizante con un ring buffer de BUCKETS slots.
+
+    Cada slot cubre ventana / BUCKETS segundos y guarda a qué tramo pertenece su conteo,
+    así que los slots vencidos se ignoran al sumar y se pisan al volver a usarse.
+    """
+    __slots__ = ('width', 'counts', 'slots', 'alerted')
+
+    def __init__(self, window):
+        self.width = window / BUCKETS
+        self.counts = array('l', [0] * BUCKETS)
+        self.slots = array('q', [-1] * BUCKETS)
+        # Último tramo en que se emitió una alerta de cada acción (una por ventana)
+        self.alerted = {}
+
+    def add(self, now):
+        slot = int(now // self.width)
+        index = slot % BUCKETS
+        if self.slots[index] != slot:
+            self.slots[index] = slot
+            self.counts[index] = 0
+        self.counts[index] += 1
+        return slot
+
+    def total(self, now):
+        oldest = int(now // self.width) - BUCKETS
+        return sum(count for count, slot in zip(self.counts, self.slots) if slot > oldest)
+
+
+class Finding:
+    __slots__ = ('alcance', 'clave', 'accion', 'conteo', 'ventana', 'nueva')
+
+    def __init__(self, alcance, clave, accion, conteo, ventana, nueva):
+        self.alcance = alcance
+        self.clave = clave
+        self.accion = accion
+        self.conteo = conteo
+        self.ventana = ventana
+        self.nueva = nueva
+
+
+class AnomalyDetector:
+    """Detector en memoria de ráfagas de activaciones por código, IP y usuario.
+
+    Como el limitador, guarda un LRU acotado de contadores por alcance: la memoria no
+    depende del tráfico y una inundación de claves nuevas solo desplaza las más viejas.
+    Es por proceso; con varios nodos cada uno ve su parte del tráfico.
+    """
+
+    def __init__(self, max_keys=MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.findings = {}
+
+    def _counter(self, alcance, clave, window):
+        counters = self._counters.setdefault(alcance, OrderedDict())
+        counter = counters.get(clave)
+        if counter is None or counter.width != window / BUCKETS:
+            counter = SlidingWindowCounter(window)
+            counters[clave] = counter
+            if len(counters) > self.max_keys:
+                counters.popitem(last=False)
+        else:
+            counters.move_to_end(clave)
+        return counter
+
+    def observe(self, keys, thresholds, now=None):
+        """Registra una activación en cada (alcance, clave) y devuelve los umbrales superados.
+
+        `nueva` es True solo la primera vez que se supera cada acción dentro de una ventana,
+        para persistir una alerta por ráfaga y no una por activación.
+        """
+        now = time.monotonic() if now is None else now
+        findings = []
+        with self._lock:
+            for alcance, clave in keys:
+                if alcance not in thresholds:
+                    continue
+                window, flag_at, block_at = thresholds[alcance]
+                counter = self._counter(alcance, clave, window)
+                slot = counter.add(now)
+                count = counter.total(now)
+
+                if block_at is not None and count > block_at:
+                    accion = 'bloquear'
+                elif flag_at is not None and count > flag_at:
+                    accion = 'marcar'
+                else:
+                    continue
+
+                last = counter.alerted.get(accion)
+                nueva = last is None or slot - last >= BUCKETS
+                if nueva:
+                    counter.alerted[accion] = slot
+                stat = (alcance, accion)
+                self.findings[stat] = self.findings.get(stat, 0) + 1
+                findings.append(Finding(alcance, clave, accion, count, window, nueva))
+        return findings
+
+    def current(self, alcance, clave, now=None):
+        """Activaciones de la clave en su ventana actual (0 si no se sigue)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            counter = self._counters.get(alcance, {}).get(clave)
+            return counter.total(now) if counter else 0
+
+    def tracked(self):
+        with self._lock:
+            return {(alcance,): len(counters) for alcance, counters in self._counters.items()}
+
+
+detector = AnomalyDetector()
+
+
+def blocking(findings):
+    return next((f for f in findings if f.accion == 'bloquear'), None)
+
+
+def record_alerts(findings, producto, usuario_id, ip):
+    """Agrega a la sesión una AlertaActivacion por cada ráfaga nueva (no hace commit)"""
+    for finding in findings:
+        if not finding.nueva:
+            continue
+        db.session.add(AlertaActivacion(
+            marca_id=producto.marca_id,
+            producto_id=producto.id,
+            usuario_id=usuario_id,
+            ip=ip,
+            alcance=finding.alcance,
+            clave=str(finding.clave),
+            accion=finding.accion,
+            conteo=finding.conteo,
+            ventana_segundos=finding.ventana
+        ))
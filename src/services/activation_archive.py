@@ -0,0 +1,219 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, union_all, text, bindparam, DateTime
+from src.models.user import db, Activacion, ActivacionArchivada, ParticionActivacion
+from src.services.jobs import enqueue, task
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+# SQLite admite 10 bases adjuntas por conexión; se leen los archivos en grupos de este tamaño
+MAX_ATTACHED = 8
+ARCHIVE_INTERVAL = timedelta(days=1)
+
+_ARCHIVE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS archivo.activacion (
+        id INTEGER PRIMARY KEY,
+        usuario_id INTEGER NOT NULL,
+        producto_id INTEGER NOT NULL,
+        fecha_activacion DATETIME,
+        puntos_ganados INTEGER
+    )
+"""
+_ARCHIVE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS archivo.ix_activacion_usuario ON activacion (usuario_id)'
+
+_CHUNK_IDS_SQL = text("""
+    SELECT id FROM main.activacion
+    WHERE fecha_activacion >= :desde AND fecha_activacion < :hasta
+    ORDER BY id
+    LIMIT :limit
+""").bindparams(bindparam('desde', type_=DateTime), bindparam('hasta', type_=DateTime))
+
+_COPY_SQL = text("""
+    INSERT OR IGNORE INTO archivo.activacion (id, usuario_id, producto_id, fecha_activacion, puntos_ganados)
+    SELECT id, usuario_id, producto_id, fecha_activacion, puntos_ganados
+    FROM main.activacion WHERE id IN :ids
+""").bindparams(bindparam('ids', expanding=True))
+
+_KEYS_SQL = text("""
+    INSERT OR IGNORE INTO main.activacion_archivada (usuario_id, producto_id, periodo)
+    SELECT usuario_id, producto_id, :periodo FROM main.activacion WHERE id IN :ids
+""").bindparams(bindparam('ids', expanding=True))
+
+_DELETE_SQL = text('DELETE FROM main.activacion WHERE id IN :ids').bindparams(bindparam('ids', expanding=True))
+
+_CATALOG_SQL = text("""
+    INSERT INTO main.particion_activacion (periodo, archivo, filas, fecha_archivado)
+    VALUES (:periodo, :archivo, :filas, :now)
+    ON CONFLICT (periodo) DO UPDATE SET filas = filas + excluded.filas, fecha_archivado = excluded.fecha_archivado
+""").bindparams(bindparam('now', type_=DateTime))
+
+
+def period_of(fecha):
+    return f'{fecha.year:04d}-{fecha.month:02d}'
+
+
+def period_bounds(periodo):
+    """[inicio, fin) del mes 'YYYY-MM'"""
+    year, month = (int(part) for part in periodo.split('-'))
+    inicio = datetime(year, month, 1)
+    fin = datetime(year + month // 12, month % 12 + 1, 1)
+    return inicio, fin
+
+
+def archive_cutoff(months, now=None):
+    """Primer día del mes que queda `months` meses atrás: lo anterior se archiva"""
+    now = now or datetime.utcnow()
+    total = now.year * 12 + (now.month - 1) - months
+    return datetime(total // 12, total % 12 + 1, 1)
+
+
+def archive_file(periodo):
+    return f'activaciones_{periodo}.db'
+
+
+def archive_path(archivo):
+    return os.path.join(current_app.config['ACTIVATION_ARCHIVE_DIR'], archivo)
+
+
+def archive_old_activations(months):
+    """Mueve las activaciones anteriores al horizonte a un archivo SQLite por mes.
+
+    Cada lote se copia primero al archivo (commit) y después se borra de la tabla
+    caliente junto con su clave en activacion_archivada (commit). En WAL una
+    transacción no es atómica entre dos archivos, así que si el proceso cae entre
+    ambos pasos el lote queda en los dos lados; el reintento lo vuelve a copiar
+    (INSERT OR IGNORE) y lo borra, y las lecturas descartan ids repetidos.
+    Devuelve la cantidad de filas movidas.
+    """
+    cutoff = archive_cutoff(months)
+    os.makedirs(current_app.config['ACTIVATION_ARCHIVE_DIR'], exist_ok=True)
+    moved = 0
+    with db.engine.connect() as conn:
+        while True:
+            # Las activaciones viejas tienen ids bajos: recorrer por id las encuentra enseguida
+            fecha = conn.execute(
+                select(Activacion.fecha_activacion)
+                .where(Activacion.fecha_activacion < cutoff)
+                .order_by(Activacion.id)
+                .limit(1)
+            ).scalar()
+            conn.commit()
+            if fecha is None:
+                return moved
+            moved += _archive_period(conn, period_of(fecha))
+
+
+def _archive_period(conn, periodo):
+    desde, hasta = period_bounds(periodo)
+    archivo = archive_file(periodo)
+    moved = 0
+    # ATTACH no se permite dentro de una transacción
+    conn.exec_driver_sql('ATTACH DATABASE ? AS archivo', (archive_path(archivo),))
+    try:
+        conn.exec_driver_sql(_ARCHIVE_TABLE_SQL)
+        conn.exec_driver_sql(_ARCHIVE_INDEX_SQL)
+        conn.commit()
+        while True:
+            ids = conn.execute(_CHUNK_IDS_SQL, {'desde': desde, 'hasta': hasta, 'limit': CHUNK_SIZE}).scalars().all()
+            if not ids:
+                conn.commit()
+                break
+
+            conn.execute(_COPY_SQL, {'ids': ids})
+            conn.commit()
+
+            conn.execute(_KEYS_SQL, {'ids': ids, 'periodo': periodo})
+            conn.execute(_DELETE_SQL, {'ids': ids})
+            conn.execute(_CATALOG_SQL, {
+                'periodo': periodo, 'archivo': archivo, 'filas': len(ids), 'now': datetime.utcnow()
+            })
+            conn.commit()
+            moved += len(ids)
+    finally:
+        conn.rollback()
+        conn.exec_driver_sql('DETACH DATABASE archivo')
+    logger.info('Archivadas %s activaciones de %s en %s', moved, periodo, archivo)
+    return moved
+
+
+@task('archivar_activaciones')
+def archive_activations_task(payload):
+    months = current_app.config.get('ACTIVATION_ARCHIVE_MONTHS')
+    if not months:
+        return
+    archive_old_activations(months)
+    # Se vuelve a programar a sí misma
+    enqueue('archivar_activaciones', delay=ARCHIVE_INTERVAL, clave_unica='archivar_activaciones')
+
+
+def schedule_archival(app):
+    """Programa la tarea periódica de archivado si está habilitada"""
+    if app.config.get('ACTIVATION_ARCHIVE_MONTHS'):
+        enqueue('archivar_activaciones', clave_unica='archivar_activaciones')
+        db.session.commit()
+
+
+def activation_keys(desde=None, hasta=None):
+    """Subconsulta (usuario_id, producto_id) con las activaciones calientes y las archivadas.
+
+    Sirve para contar sin abrir los archivos; lo archivado se filtra por período,
+    así que en los extremos del rango cuenta meses completos.
+    """
+    hot = select(Activacion.usuario_id.label('usuario_id'), Activacion.producto_id.label('producto_id'))
+    archived = select(ActivacionArchivada.usuario_id, ActivacionArchivada.producto_id)
+    if desde is not None:
+        hot = hot.where(Activacion.fecha_activacion >= desde)
+        archived = archived.where(ActivacionArchivada.periodo >= period_of(desde))
+    if hasta is not None:
+        hot = hot.where(Activacion.fecha_activacion <= hasta)
+        archived = archived.where(ActivacionArchivada.periodo <= period_of(hasta))
+    return union_all(hot, archived).subquery('activaciones')
+
+
+def is_archived(usuario_id, producto_id):
+    return db.session.get(ActivacionArchivada, (usuario_id, producto_id)) is not None
+
+
+def read_archived(periodos, where, params):
+    """Filas completas de los archivos de esos períodos que cumplen `where`.
+
+    Adjunta los archivos bajo demanda, de a MAX_ATTACHED, en una conexión propia.
+    """
+    archivos = {p.periodo: p.archivo for p in ParticionActivacion.query.filter(
+        ParticionActivacion.periodo.in_(periodos)
+    )}
+    paths = [archive_path(archivos[p]) for p in sorted(archivos) if os.path.exists(archive_path(archivos[p]))]
+    rows = []
+    with db.engine.connect() as conn:
+        for start in range(0, len(paths), MAX_ATTACHED):
+            group = paths[start:start + MAX_ATTACHED]
+            aliases = [f'archivo_{i}' for i in range(len(group))]
+            for alias, path in zip(aliases, group):
+                conn.exec_driver_sql(f'ATTACH DATABASE ? AS {alias}', (path,))
+            try:
+                union = ' UNION ALL '.join(
+                    f'SELECT id, usuario_id, producto_id, fecha_activacion, puntos_ganados '
+                    f'FROM {alias}.activacion WHERE {where}'
+                    for alias in aliases
+                )
+                rows.extend(conn.execute(text(union), params).mappings().all())
+            finally:
+                conn.rollback()
+                for alias in aliases:
+                    conn.exec_driver_sql(f'DETACH DATABASE {alias}')
+    return rows
+
+
+def archived_activations_for_user(usuario_id):
+    """Activaciones archivadas del usuario; solo abre los períodos donde tiene alguna"""
+    periodos = db.session.execute(
+        select(ActivacionArchivada.periodo)
+        .where(ActivacionArchivada.usuario_id == usuario_id)
+        .distinct()
+    ).scalars().all()
+    if not periodos:
+        return []
+    return read_archived(periodos, 'usuario_id = :usuario_id', {'usuario_id': usuario_id})
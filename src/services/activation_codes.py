@@ -0,0 +1,76 @@
+import re
+import secrets
+from sqlalchemy import select, insert, update
+from src.models.user import db, LoteCodigos, CodigoUnidad
+from src.services.jobs import task
+
+# 32 símbolos sin 0/O ni 1/I para evitar errores al tipear; 256 % 32 == 0, así que
+# mapear cada byte aleatorio con `b & 31` mantiene la distribución uniforme
+ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+CODE_CHARS = 12
+UNIT_CODE_RE = re.compile(r'^WEEV-[2-9A-HJ-NP-Z]{4}-[2-9A-HJ-NP-Z]{4}-[2-9A-HJ-NP-Z]{4}$')
+
+MAX_BATCH_SIZE = 5_000_000
+INSERT_CHUNK_SIZE = 10_000
+
+_BYTE_TO_SYMBOL = bytes(ord(ALPHABET[b & 31]) for b in range(256))
+
+
+def is_unit_code(codigo):
+    """Los códigos por unidad tienen formato propio, así se resuelven con una sola búsqueda"""
+    return UNIT_CODE_RE.match(codigo) is not None
+
+
+def random_codes(count, length):
+    """Genera `count` cadenas distintas de `length` símbolos con el CSPRNG del sistema"""
+    codes = set()
+    while len(codes) < count:
+        missing = count - len(codes)
+        symbols = secrets.token_bytes(missing * length).translate(_BYTE_TO_SYMBOL).decode('ascii')
+        codes.update(symbols[i:i + length] for i in range(0, len(symbols), length))
+    return codes
+
+
+def generate_unit_codes(count):
+    return {f'WEEV-{s[0:4]}-{s[4:8]}-{s[8:12]}' for s in random_codes(count, CODE_CHARS)}
+
+
+@task('generar_lote_codigos')
+def generate_batch(payload):
+    """Completa un lote en transacciones cortas de INSERT_CHUNK_SIZE filas.
+
+    El avance se guarda junto a cada bloque, así que un reintento continúa donde quedó.
+    Las colisiones con códigos ya existentes se descartan (INSERT OR IGNORE) y se reponen.
+    """
+    lote_table = LoteCodigos.__table__
+    lote_id = payload['lote_id']
+    while True:
+        with db.engine.begin() as conn:
+            lote = conn.execute(select(lote_table).where(lote_table.c.id == lote_id)).mappings().first()
+            if not lote or lote['generados'] >= lote['cantidad']:
+                if lote:
+                    conn.execute(update(lote_table).where(lote_table.c.id == lote_id).values(estado='completado'))
+                return
+
+            count = min(INSERT_CHUNK_SIZE, lote['cantidad'] - lote['generados'])
+            rows = [
+                {'codigo': codigo, 'producto_id': lote['producto_id'], 'lote_id': lote_id, 'canjeado': False}
+                for codigo in generate_unit_codes(count)
+            ]
+            result = conn.execute(insert(CodigoUnidad.__table__).prefix_with('OR IGNORE'), rows)
+            conn.execute(
+                update(lote_table)
+                .where(lote_table.c.id == lote_id)
+                .values(estado='generando', generados=lote_table.c.generados + result.rowcount)
+            )
+
+
+def redeem_unit_code(codigo_unidad_id, usuario_id, now):
+    """Marca el código como canjeado si todavía no lo estaba; devuelve False si otro lo ganó"""
+    table = CodigoUnidad.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.id == codigo_unidad_id, table.c.canjeado.is_(False))
+        .values(canjeado=True, usuario_id=usuario_id, fecha_canje=now)
+    )
+    return result.rowcount == 1
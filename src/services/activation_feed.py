@@ -0,0 +1,147 @@
+import json
+import queue
+import threading
+from sqlalchemy import select, func
+from src.models.user import db, User, Producto, Activacion
+
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+REPLAY_LIMIT = 200
+RETRY_MS = 3000
+
+
+class FeedFull(Exception):
+    pass
+
+
+class Subscriber:
+    def __init__(self, marca_id):
+        self.marca_id = marca_id
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        # Se activa si el cliente no consume a tiempo: la conexión se corta y el
+        # cliente se reconecta con Last-Event-ID, que repone lo perdido desde la base
+        self.overflowed = False
+
+
+class ActivationFeed:
+    """Pub/sub en memoria de activaciones por marca.
+
+    Solo alcanza a los suscriptores de este proceso; el id de cada evento es el id de
+    la activación, así que una reconexión (a este u otro nodo) se retoma desde la base.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self.dropped = 0
+
+    def subscribe(self, marca_id, max_total, max_per_brand):
+        with self._lock:
+            total = sum(len(subs) for subs in self._subscribers.values())
+            if total >= max_total or len(self._subscribers.get(marca_id, ())) >= max_per_brand:
+                raise FeedFull()
+            subscriber = Subscriber(marca_id)
+            self._subscribers.setdefault(marca_id, set()).add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subs = self._subscribers.get(subscriber.marca_id)
+            if subs:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[subscriber.marca_id]
+
+    def publish(self, marca_id, event):
+        with self._lock:
+            subs = list(self._subscribers.get(marca_id, ()))
+        for subscriber in subs:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                if not subscriber.overflowed:
+                    subscriber.overflowed = True
+                    self.dropped += 1
+
+    def connections(self):
+        with self._lock:
+            return {(str(marca_id),): len(subs) for marca_id, subs in self._subscribers.items()}
+
+
+feed = ActivationFeed()
+
+
+def activation_event(activacion, producto, usuario):
+    """Mismo formato que activaciones_recientes de /brand-dashboard"""
+    return {
+        'id': activacion.id,
+        'producto_nombre': producto.nombre,
+        'usuario_nombre': usuario.nombre,
+        'fecha_activacion': activacion.fecha_activacion.isoformat(),
+        'puntos_ganados': activacion.puntos_ganados
+    }
+
+
+def reset_event(marca_id):
+    """Evento `reset`: el cliente debe recargar /brand-dashboard y seguir desde la última activación"""
+    latest = db.session.scalar(
+        select(func.max(Activacion.id))
+        .join(Producto, Producto.id == Activacion.producto_id)
+        .where(Producto.marca_id == marca_id)
+    )
+    return {'id': latest or 0, 'reset': True}
+
+
+def missed_events(marca_id, last_event_id):
+    """Activaciones de la marca posteriores a last_event_id (para retomar tras reconectar).
+
+    Si faltan más de REPLAY_LIMIT no se repone una parte en silencio: se devuelve solo
+    un evento `reset`.
+    """
+    rows = db.session.execute(
+        select(Activacion.id, Producto.nombre, User.nombre, Activacion.fecha_activacion, Activacion.puntos_ganados)
+        .join(Producto, Producto.id == Activacion.producto_id)
+        .join(User, User.id == Activacion.usuario_id)
+        .where(Producto.marca_id == marca_id, Activacion.id > last_event_id)
+        .order_by(Activacion.id)
+        .limit(REPLAY_LIMIT + 1)
+    ).all()
+    if len(rows) > REPLAY_LIMIT:
+        return [reset_event(marca_id)]
+    return [
+        {
+            'id': id,
+            'producto_nombre': producto_nombre,
+            'usuario_nombre': usuario_nombre,
+            'fecha_activacion': fecha.isoformat() if fecha else None,
+            'puntos_ganados': puntos
+        } for id, producto_nombre, usuario_nombre, fecha, puntos in rows
+    ]
+
+
+def format_event(event):
+    if event.get('reset'):
+        return f"id: {event['id']}\nevent: reset\ndata: {{}}\n\n"
+    return f"id: {event['id']}\nevent: activacion\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def event_stream(subscriber, replay, heartbeat=HEARTBEAT_SECONDS):
+    """Generador SSE: primero lo perdido, después lo nuevo, sin repetir ids"""
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        last_id = 0
+        for event in replay:
+            last_id = event['id']
+            yield format_event(event)
+        while not subscriber.overflowed:
+            try:
+                event = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event['id'] <= last_id:
+                continue
+            last_id = event['id']
+            yield format_event(event)
+    finally:
+        feed.unsubscribe(subscriber)
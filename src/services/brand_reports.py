@@ -0,0 +1,234 @@
+import io
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, func, case
+from matplotlib.figure import Figure
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from src.models.user import (db, Marca, Producto, Activacion, Recompensa, UsuarioRecompensa,
+                             ParticionActivacion, ReporteMarca)
+from src.services.activation_archive import activation_keys, period_bounds, read_archived
+from src.services.jobs import task
+
+TOP_ROWS = 10
+
+
+def report_path(marca_id, periodo):
+    return os.path.join(current_app.config['REPORTS_DIR'], f'marca-{marca_id}', f'{periodo}.pdf')
+
+
+def _period_range(periodo):
+    inicio, fin = period_bounds(periodo)
+    return inicio, fin - timedelta(microseconds=1)
+
+
+def _rewards_in_period(marca_id, desde, hasta):
+    return [
+        Producto.marca_id == marca_id,
+        UsuarioRecompensa.fecha_otorgada >= desde,
+        UsuarioRecompensa.fecha_otorgada <= hasta
+    ]
+
+
+def report_fingerprint(marca_id, periodo):
+    """Resumen barato de los datos del período: si no cambia, el PDF guardado sigue vigente"""
+    desde, hasta = _period_range(periodo)
+    activaciones = activation_keys(desde, hasta)
+    total_activaciones = db.session.execute(
+        select(func.count())
+        .select_from(activaciones)
+        .join(Producto, Producto.id == activaciones.c.producto_id)
+        .where(Producto.marca_id == marca_id)
+    ).scalar()
+    ultima_activacion = db.session.execute(
+        select(func.max(Activacion.id))
+        .join(Producto, Producto.id == Activacion.producto_id)
+        .where(Producto.marca_id == marca_id,
+               Activacion.fecha_activacion >= desde,
+               Activacion.fecha_activacion <= hasta)
+    ).scalar()
+    recompensas = db.session.execute(
+        select(
+            func.count(UsuarioRecompensa.id),
+            func.max(UsuarioRecompensa.id),
+            func.sum(case((UsuarioRecompensa.estado == 'reclamada', 1), else_=0)),
+            func.sum(case((UsuarioRecompensa.estado == 'expirada', 1), else_=0))
+        )
+        .join(Recompensa, Recompensa.id == UsuarioRecompensa.recompensa_id)
+        .join(Producto, Producto.id == Recompensa.producto_id)
+        .where(*_rewards_in_period(marca_id, desde, hasta))
+    ).one()
+    marca_nombre = db.session.execute(select(Marca.nombre).where(Marca.id == marca_id)).scalar()
+    data = [marca_nombre, total_activaciones, ultima_activacion, *recompensas]
+    return hashlib.sha256(json.dumps(data, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+def _daily_activations(marca_id, periodo, desde, hasta):
+    """Activaciones por día del período, tanto de la tabla activa como del archivo mensual"""
+    por_dia = dict(db.session.execute(
+        select(func.date(Activacion.fecha_activacion), func.count(Activacion.id))
+        .join(Producto, Producto.id == Activacion.producto_id)
+        .where(Producto.marca_id == marca_id,
+               Activacion.fecha_activacion >= desde,
+               Activacion.fecha_activacion <= hasta)
+        .group_by(func.date(Activacion.fecha_activacion))
+    ).all())
+
+    if db.session.get(ParticionActivacion, periodo):
+        producto_ids = db.session.execute(select(Producto.id).where(Producto.marca_id == marca_id)).scalars().all()
+        if producto_ids:
+            where = f"producto_id IN ({','.join(str(int(i)) for i in producto_ids)})"
+            for row in read_archived([periodo], where, {}):
+                dia = str(row['fecha_activacion'])[:10]
+                por_dia[dia] = por_dia.get(dia, 0) + 1
+    return por_dia
+
+
+def period_report_data(marca_id, periodo):
+    """Los agregados del dashboard de marca acotados al mes"""
+    desde, hasta = _period_range(periodo)
+    marca = db.session.get(Marca, marca_id)
+    activaciones = activation_keys(desde, hasta)
+
+    total_activaciones, usuarios_unicos = db.session.execute(
+        select(func.count(), func.count(func.distinct(activaciones.c.usuario_id)))
+        .select_from(activaciones)
+        .join(Producto, Producto.id == activaciones.c.producto_id)
+        .where(Producto.marca_id == marca_id)
+    ).one()
+
+    productos_top = db.session.execute(
+        select(Producto.nombre, func.count().label('activaciones'))
+        .select_from(activaciones)
+        .join(Producto, Producto.id == activaciones.c.producto_id)
+        .where(Producto.marca_id == marca_id)
+        .group_by(Producto.id, Producto.nombre)
+        .order_by(func.count().desc())
+        .limit(TOP_ROWS)
+    ).all()
+
+    reclamada = func.sum(case((UsuarioRecompensa.estado == 'reclamada', 1), else_=0))
+    recompensas = db.session.execute(
+        select(Recompensa.nombre, func.count(UsuarioRecompensa.id), reclamada)
+        .join(UsuarioRecompensa, UsuarioRecompensa.recompensa_id == Recompensa.id)
+        .join(Producto, Producto.id == Recompensa.producto_id)
+        .where(*_rewards_in_period(marca_id, desde, hasta))
+        .group_by(Recompensa.id, Recompensa.nombre)
+        .order_by(func.count(UsuarioRecompensa.id).desc())
+    ).all()
+    otorgadas = sum(r[1] for r in recompensas)
+    reclamadas = sum(r[2] or 0 for r in recompensas)
+
+    return {
+        'marca': marca.nombre,
+        'periodo': periodo,
+        'total_activaciones': total_activaciones,
+        'usuarios_unicos': usuarios_unicos,
+        'recompensas_otorgadas': otorgadas,
+        'recompensas_reclamadas': reclamadas,
+        'tasa_reclamacion': round((reclamadas / max(otorgadas, 1)) * 100, 2),
+        'activaciones_por_dia': _daily_activations(marca_id, periodo, desde, hasta),
+        'productos_top': [(nombre, count) for nombre, count in productos_top],
+        'recompensas': [(nombre, count, reclamadas or 0) for nombre, count, reclamadas in recompensas[:TOP_ROWS]],
+        'dias_del_mes': (period_bounds(periodo)[1] - period_bounds(periodo)[0]).days
+    }
+
+
+def _daily_chart(data):
+    """PNG en memoria; Figure + Agg sin pyplot, que no es seguro entre hilos"""
+    dias = list(range(1, data['dias_del_mes'] + 1))
+    valores = [data['activaciones_por_dia'].get(f"{data['periodo']}-{dia:02d}", 0) for dia in dias]
+    figure = Figure(figsize=(7, 2.6), dpi=120)
+    ax = figure.subplots()
+    ax.bar(dias, valores, color='#6c5ce7')
+    ax.set_xlabel('Día')
+    ax.set_ylabel('Activaciones')
+    ax.set_xlim(0.5, len(dias) + 0.5)
+    ax.spines[['top', 'right']].set_visible(False)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    buffer.seek(0)
+    return buffer
+
+
+def _table(rows, widths):
+    table = Table(rows, colWidths=widths, hAlign='LEFT')
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6c5ce7')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f1f0fb')]),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#dcdde1')),
+    ]))
+    return table
+
+
+def render_report_pdf(data, path):
+    """Escribe el PDF en un temporal y lo renombra: nunca se sirve un archivo a medio escribir"""
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph(f"Reporte mensual · {data['marca']}", styles['Title']),
+        Paragraph(f"Período {data['periodo']}", styles['Heading3']),
+        Spacer(1, 0.4 * cm),
+        _table([
+            ['Métrica', 'Valor'],
+            ['Activaciones', data['total_activaciones']],
+            ['Usuarios únicos', data['usuarios_unicos']],
+            ['Recompensas otorgadas', data['recompensas_otorgadas']],
+            ['Recompensas reclamadas', data['recompensas_reclamadas']],
+            ['Tasa de reclamación', f"{data['tasa_reclamacion']}%"],
+        ], [9 * cm, 4 * cm]),
+        Spacer(1, 0.6 * cm),
+        Paragraph('Activaciones por día', styles['Heading2']),
+        Image(_daily_chart(data), width=17 * cm, height=6.3 * cm),
+        Spacer(1, 0.4 * cm),
+        Paragraph('Productos más activados', styles['Heading2']),
+        _table([['Producto', 'Activaciones']] + [list(p) for p in data['productos_top']], [11 * cm, 4 * cm]),
+        Spacer(1, 0.4 * cm),
+        Paragraph('Recompensas', styles['Heading2']),
+        _table([['Recompensa', 'Otorgadas', 'Reclamadas']] + [list(r) for r in data['recompensas']],
+               [9 * cm, 3 * cm, 3 * cm]),
+    ]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    SimpleDocTemplate(tmp_path, pagesize=A4, title=f"Reporte {data['marca']} {data['periodo']}").build(story)
+    os.replace(tmp_path, path)
+
+
+@task('generar_reporte_marca')
+def generate_brand_report(payload):
+    marca_id, periodo = payload['marca_id'], payload['periodo']
+    reporte = ReporteMarca.query.filter_by(marca_id=marca_id, periodo=periodo).first()
+    if not reporte:
+        return
+
+    # La huella se toma antes de leer los datos: si algo cambia mientras se genera,
+    # el próximo pedido verá otra huella y lo volverá a generar
+    huella = report_fingerprint(marca_id, periodo)
+    if reporte.estado == 'listo' and reporte.huella == huella and os.path.exists(report_path(marca_id, periodo)):
+        return
+
+    path = report_path(marca_id, periodo)
+    try:
+        render_report_pdf(period_report_data(marca_id, periodo), path)
+    except Exception as e:
+        # Fuera de la sesión: run_one hace rollback y reintenta la tarea con backoff
+        with db.engine.begin() as conn:
+            conn.execute(update(ReporteMarca.__table__)
+                         .where(ReporteMarca.__table__.c.id == reporte.id)
+                         .values(estado='error', error=str(e)))
+        raise
+    reporte.estado = 'listo'
+    reporte.huella = huella
+    reporte.archivo = os.path.relpath(path, current_app.config['REPORTS_DIR'])
+    reporte.error = None
+    reporte.fecha_generado = datetime.utcnow()
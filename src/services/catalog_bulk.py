@@ -0,0 +1,160 @@
+"""Actualizaciones masivas del catálogo de una marca.
+
+Cada tabla se actualiza con un único UPDATE por lote (sin cargar filas al ORM) y todo
+se confirma en una sola transacción. El índice de búsqueda se mantiene con triggers
+dentro del mismo UPDATE, así que no hace falta invalidar nada fila por fila.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from src.models.user import db, Producto, Recompensa, parse_reward_amount
+
+MAX_IDS = 1000
+# Largo de las columnas de texto que se filtran o actualizan
+MAX_CATEGORIA_LENGTH = 50
+MAX_TIPO_LENGTH = 50
+MAX_VALOR_LENGTH = 100
+
+PRODUCT_FILTERS = {'categoria', 'activo'}
+REWARD_FILTERS = {'producto_ids', 'categoria', 'tipo', 'activa'}
+
+
+class InvalidBulkUpdate(Exception):
+    pass
+
+
+def _ids(value, field):
+    if not isinstance(value, list) or not value or len(value) > MAX_IDS \
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in value):
+        raise InvalidBulkUpdate(f'{field} debe ser una lista de 1 a {MAX_IDS} ids')
+    return value
+
+
+def _text(value, field, max_length):
+    if not isinstance(value, str) or not value.strip() or len(value) > max_length:
+        raise InvalidBulkUpdate(f'{field} debe ser un texto de 1 a {max_length} caracteres')
+    return value
+
+
+def _filter(data, allowed):
+    filtro = data.get('filtro')
+    if filtro is None:
+        return {}
+    if not isinstance(filtro, dict) or set(filtro) - allowed:
+        raise InvalidBulkUpdate(f"filtro admite solo: {', '.join(sorted(allowed))}")
+    return filtro
+
+
+def _require_selection(data):
+    # Sin ids ni filtro no se actualiza todo el catálogo por accidente: se pide "filtro": {}
+    if 'ids' not in data and 'filtro' not in data:
+        raise InvalidBulkUpdate('Indica ids o filtro')
+
+
+def product_conditions(marca_id, data):
+    _require_selection(data)
+    conditions = [Producto.marca_id == marca_id]
+    if 'ids' in data:
+        conditions.append(Producto.id.in_(_ids(data['ids'], 'ids')))
+    filtro = _filter(data, PRODUCT_FILTERS)
+    if 'categoria' in filtro:
+        conditions.append(Producto.categoria == _text(filtro['categoria'], 'categoria', MAX_CATEGORIA_LENGTH))
+    if 'activo' in filtro:
+        conditions.append(Producto.activo == bool(filtro['activo']))
+    return conditions
+
+
+def reward_conditions(marca_id, data):
+    _require_selection(data)
+    filtro = _filter(data, REWARD_FILTERS)
+
+    productos = [Producto.marca_id == marca_id]
+    if 'producto_ids' in filtro:
+        productos.append(Producto.id.in_(_ids(filtro['producto_ids'], 'producto_ids')))
+    if 'categoria' in filtro:
+        productos.append(Producto.categoria == _text(filtro['categoria'], 'categoria', MAX_CATEGORIA_LENGTH))
+
+    conditions = [Recompensa.producto_id.in_(select(Producto.id).where(*productos))]
+    if 'ids' in data:
+        conditions.append(Recompensa.id.in_(_ids(data['ids'], 'ids')))
+    if 'tipo' in filtro:
+        conditions.append(Recompensa.tipo == _text(filtro['tipo'], 'tipo', MAX_TIPO_LENGTH))
+    if 'activa' in filtro:
+        conditions.append(Recompensa.activa == bool(filtro['activa']))
+    return conditions
+
+
+def product_values(cambios):
+    values = {}
+    if 'activo' in cambios:
+        values['activo'] = bool(cambios['activo'])
+    if 'precio' in cambios:
+        precio = cambios['precio']
+        if precio is not None and (isinstance(precio, bool) or not isinstance(precio, (int, float)) or precio < 0):
+            raise InvalidBulkUpdate('precio debe ser un número mayor o igual a 0')
+        values['precio'] = precio
+    if 'categoria' in cambios:
+        values['categoria'] = _text(cambios['categoria'], 'categoria', MAX_CATEGORIA_LENGTH)
+    return values
+
+
+def reward_values(cambios):
+    values = {}
+    if 'activa' in cambios:
+        values['activa'] = bool(cambios['activa'])
+    if 'valor' in cambios:
+        # El UPDATE no pasa por @validates: valor_numerico se calcula acá, una vez por lote
+        values['valor'] = _text(cambios['valor'], 'valor', MAX_VALOR_LENGTH)
+        values['valor_numerico'] = parse_reward_amount(values['valor'])
+    if 'dias_expiracion' in cambios:
+        dias = cambios['dias_expiracion']
+        if dias and (isinstance(dias, bool) or not isinstance(dias, int) or dias < 0):
+            raise InvalidBulkUpdate('dias_expiracion debe ser un entero positivo')
+        values['fecha_expiracion'] = datetime.utcnow() + timedelta(days=dias) if dias else None
+    return values
+
+
+def _execute(statement):
+    return db.session.execute(statement, execution_options={'synchronize_session': False}).rowcount
+
+
+def _cambios(data):
+    if not isinstance(data, dict):
+        raise InvalidBulkUpdate('Se esperaba un objeto JSON')
+    cambios = data.get('cambios') or {}
+    if not isinstance(cambios, dict):
+        raise InvalidBulkUpdate('cambios debe ser un objeto')
+    return cambios
+
+
+def bulk_update_products(marca_id, data):
+    """Aplica data['cambios'] a los productos seleccionados; con desactivar_recompensas también
+    desactiva sus recompensas. Devuelve los conteos afectados (sin commit)."""
+    cambios = _cambios(data)
+    values = product_values(cambios)
+    desactivar_recompensas = bool(data.get('desactivar_recompensas'))
+    if not values and not desactivar_recompensas:
+        raise InvalidBulkUpdate('cambios admite: activo, precio, categoria')
+
+    conditions = product_conditions(marca_id, data)
+    resultado = {'productos_actualizados': 0, 'recompensas_actualizadas': 0}
+
+    # Las recompensas primero: el filtro puede depender de columnas que el UPDATE de productos cambia
+    if desactivar_recompensas:
+        resultado['recompensas_actualizadas'] = _execute(
+            update(Recompensa)
+            .where(Recompensa.producto_id.in_(select(Producto.id).where(*conditions)),
+                   Recompensa.activa.is_(True))
+            .values(activa=False)
+        )
+    if values:
+        resultado['productos_actualizados'] = _execute(update(Producto).where(*conditions).values(**values))
+    return resultado
+
+
+def bulk_update_rewards(marca_id, data):
+    values = reward_values(_cambios(data))
+    if not values:
+        raise InvalidBulkUpdate('cambios admite: activa, valor, dias_expiracion')
+
+    conditions = reward_conditions(marca_id, data)
+    return {'recompensas_actualizadas': _execute(update(Recompensa).where(*conditions).values(**values))}
@@ -0,0 +1,130 @@
+from datetime import datetime
+from sqlalchemy import select, insert, update, func, text, bindparam, DateTime
+from src.models.user import db, Recompensa, CuponRecompensa
+from src.services.activation_codes import random_codes
+from src.services.jobs import task
+
+INSERT_CHUNK_SIZE = 10_000
+MAX_GENERATED_COUPONS = 1_000_000
+COUPON_CHARS = 8
+
+
+def insert_coupons(recompensa_id, codigos):
+    """Inserta códigos en el pool por bloques, ignorando duplicados; devuelve cuántos entraron"""
+    inserted = 0
+    chunk = []
+
+    def flush():
+        nonlocal inserted
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                insert(CuponRecompensa.__table__).prefix_with('OR IGNORE'),
+                [{'recompensa_id': recompensa_id, 'codigo': codigo} for codigo in chunk]
+            )
+            inserted += result.rowcount
+        chunk.clear()
+
+    for codigo in codigos:
+        codigo = codigo.strip().upper()
+        if codigo:
+            chunk.append(codigo)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+
+    if inserted:
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(Recompensa.__table__)
+                .where(Recompensa.__table__.c.id == recompensa_id)
+                .values(usa_pool_cupones=True)
+            )
+    return inserted
+
+
+@task('generar_cupones')
+def generate_coupons(payload):
+    """Genera cupones aleatorios hasta completar la cantidad pedida (reintentable)"""
+    recompensa_id = payload['recompensa_id']
+    prefijo = payload.get('prefijo') or 'WEEV'
+    objetivo = payload['total_objetivo']
+    while True:
+        actuales = db.session.query(func.count(CuponRecompensa.id))\
+            .filter(CuponRecompensa.recompensa_id == recompensa_id)\
+            .scalar()
+        db.session.rollback()
+        if actuales >= objetivo:
+            return
+        count = min(INSERT_CHUNK_SIZE, objetivo - actuales)
+        insert_coupons(recompensa_id, (f'{prefijo}-{s}' for s in random_codes(count, COUPON_CHARS)))
+
+
+def assign_coupon(usuario_recompensa):
+    """Toma atómicamente el siguiente cupón libre para un otorgamiento recién creado (ya con id).
+
+    Es un único UPDATE con subconsulta sobre el índice parcial de cupones libres; como
+    SQLite serializa las escrituras, dos activaciones concurrentes nunca toman el mismo.
+    Devuelve el código asignado o None si el pool se agotó.
+    """
+    table = CuponRecompensa.__table__
+    siguiente_libre = select(table.c.id)\
+        .where(table.c.recompensa_id == usuario_recompensa.recompensa_id,
+               table.c.usuario_recompensa_id.is_(None))\
+        .order_by(table.c.id)\
+        .limit(1)\
+        .scalar_subquery()
+    codigo = db.session.execute(
+        update(table)
+        .where(table.c.id == siguiente_libre)
+        .values(usuario_recompensa_id=usuario_recompensa.id, fecha_asignacion=datetime.utcnow())
+        .returning(table.c.codigo)
+    ).scalar()
+    usuario_recompensa.codigo_cupon = codigo
+    return codigo
+
+
+# Empareja por orden los otorgamientos sin cupón (desde un id) con los cupones libres
+_ASSIGN_BULK_SQL = text("""
+    WITH pendientes AS (
+        SELECT ur.id, ROW_NUMBER() OVER (ORDER BY ur.id) AS rn
+        FROM usuario_recompensa ur
+        WHERE ur.recompensa_id = :recompensa_id AND ur.id >= :desde_id AND ur.codigo_cupon IS NULL
+    ),
+    libres AS (
+        SELECT c.id, ROW_NUMBER() OVER (ORDER BY c.id) AS rn
+        FROM cupon_recompensa c
+        WHERE c.recompensa_id = :recompensa_id AND c.usuario_recompensa_id IS NULL
+        LIMIT (SELECT COUNT(*) FROM pendientes)
+    )
+    UPDATE cupon_recompensa
+    SET usuario_recompensa_id = (
+            SELECT p.id FROM libres l JOIN pendientes p ON p.rn = l.rn WHERE l.id = cupon_recompensa.id
+        ),
+        fecha_asignacion = :now
+    WHERE id IN (SELECT l.id FROM libres l JOIN pendientes p ON p.rn = l.rn)
+""").bindparams(bindparam('now', type_=DateTime))
+
+_COPY_CODES_SQL = text("""
+    UPDATE usuario_recompensa
+    SET codigo_cupon = (
+        SELECT c.codigo FROM cupon_recompensa c WHERE c.usuario_recompensa_id = usuario_recompensa.id
+    )
+    WHERE recompensa_id = :recompensa_id AND id >= :desde_id AND codigo_cupon IS NULL
+""")
+
+
+def assign_coupons_bulk(conn, recompensa_id, desde_id):
+    """Asigna cupones en bloque a los otorgamientos con id >= desde_id (p. ej. un lote de backfill)"""
+    params = {'recompensa_id': recompensa_id, 'desde_id': desde_id, 'now': datetime.utcnow()}
+    conn.execute(_ASSIGN_BULK_SQL, params)
+    conn.execute(_COPY_CODES_SQL, params)
+
+
+def pool_stats(recompensa_id):
+    table = CuponRecompensa.__table__
+    total, asignados = db.session.execute(
+        select(func.count(table.c.id), func.count(table.c.usuario_recompensa_id))
+        .where(table.c.recompensa_id == recompensa_id)
+    ).one()
+    return {'total': total, 'asignados': asignados, 'libres': total - asignados}
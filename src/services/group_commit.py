@@ -0,0 +1,121 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from sqlalchemy import text
+from src.models.user import db
+from src.utils.metrics import registry, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_TIMEOUT_SECONDS = 10
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+batch_size = registry.register(Histogram(
+    'weev_group_commit_batch_size', 'Escrituras confirmadas por cada commit del escritor agrupado',
+    BATCH_BUCKETS, ('writer',)))
+
+
+class _Write:
+    __slots__ = ('fn', 'args', 'future')
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """Un único hilo escritor que confirma varias escrituras con un solo COMMIT.
+
+    Cada request encola una función que escribe con db.session (la sesión del hilo
+    escritor) y espera su Future. El escritor junta hasta max_batch escrituras o las que
+    lleguen en max_wait_ms, corre cada una dentro de un SAVEPOINT (si una falla, solo se
+    descarta esa) y hace un COMMIT para todo el lote: un fsync en vez de uno por request.
+    Los Future se resuelven después del COMMIT, así que lo respondido ya es durable.
+    Un Future cancelado antes de que el escritor lo tome (el request se cansó de esperar)
+    no se escribe; una vez tomado ya no se puede cancelar.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self.app = None
+        self.max_batch = DEFAULT_MAX_BATCH
+        self.max_wait = DEFAULT_MAX_WAIT_MS / 1000
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, app, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._thread = threading.Thread(target=self._run, name=f'group-commit-{self.name}', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        write = _Write(fn, args)
+        self._queue.put(write)
+        return write.future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.exception('Error en el escritor agrupado %s', self.name)
+                for write in batch:
+                    # Las que no llegaron a empezar pudieron cancelarse: no hay a quién avisar
+                    if write.future.done():
+                        continue
+                    if write.future.running() or write.future.set_running_or_notify_cancel():
+                        write.future.set_exception(e)
+
+    def _write(self, batch):
+        results = []
+        with self.app.app_context():
+            try:
+                # Toma el lock de escritura al empezar: el lote no puede quedar a medias por SQLITE_BUSY
+                db.session.execute(text('BEGIN IMMEDIATE'))
+                for write in batch:
+                    if not write.future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with db.session.begin_nested():
+                            results.append((write, write.fn(*write.args), None))
+                    except Exception as e:
+                        results.append((write, None, e))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+        batch_size.observe((self.name,), len(results))
+        for write, result, error in results:
+            if error is not None:
+                write.future.set_exception(error)
+            else:
+                write.future.set_result(result)
+
+
+activation_writer = GroupCommitWriter('activaciones')
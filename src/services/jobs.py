@@ -0,0 +1,193 @@
+import json
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from src.models.user import db, Tarea
+
+logger = logging.getLogger(__name__)
+
+VISIBILITY_TIMEOUT = timedelta(minutes=5)
+# Mientras el handler corre se extiende la reserva: una tarea larga no vuelve a quedar visible
+HEARTBEAT_INTERVAL = VISIBILITY_TIMEOUT / 3
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 600
+POLL_INTERVAL_SECONDS = 0.5
+
+_handlers = {}
+_wakeup = threading.Event()
+_workers = []
+
+
+def task(tipo):
+    """Registra la función que procesa las tareas de un tipo; recibe el payload como dict"""
+    def decorator(f):
+        _handlers[tipo] = f
+        return f
+    return decorator
+
+
+def enqueue(tipo, payload=None, prioridad=0, delay=None, max_intentos=5, clave_unica=None):
+    """Agrega una tarea a la sesión actual.
+
+    No hace commit: la tarea se confirma en la misma transacción que el cambio que la
+    originó, así que nunca queda un producto sin su tarea ni una tarea sin su producto.
+    Con clave_unica, no se encola si ya hay una tarea pendiente con la misma clave.
+    """
+    if clave_unica and Tarea.query.filter_by(clave_unica=clave_unica, estado='pendiente').first():
+        return None
+
+    tarea = Tarea(
+        tipo=tipo,
+        payload=json.dumps(payload or {}),
+        prioridad=prioridad,
+        max_intentos=max_intentos,
+        disponible_en=datetime.utcnow() + (delay or timedelta(0)),
+        clave_unica=clave_unica
+    )
+    db.session.add(tarea)
+    _wakeup.set()
+    return tarea
+
+
+def claim_next(conn, now=None):
+    """Toma la siguiente tarea visible y la oculta durante VISIBILITY_TIMEOUT.
+
+    Una tarea 'en_proceso' cuyo plazo venció (worker caído, sin latidos) vuelve a ser visible.
+    """
+    now = now or datetime.utcnow()
+    tarea_table = Tarea.__table__
+    while True:
+        row = conn.execute(
+            select(tarea_table.c.id, tarea_table.c.disponible_en)
+            .where(tarea_table.c.estado.in_(['pendiente', 'en_proceso']),
+                   tarea_table.c.disponible_en <= now)
+            .order_by(tarea_table.c.prioridad.desc(), tarea_table.c.id)
+            .limit(1)
+        ).first()
+        if not row:
+            return None
+
+        # Update condicional: si otro worker la tomó primero, disponible_en ya cambió
+        claimed = conn.execute(
+            update(tarea_table)
+            .where(tarea_table.c.id == row.id, tarea_table.c.disponible_en == row.disponible_en)
+            .values(estado='en_proceso',
+                    intentos=tarea_table.c.intentos + 1,
+                    disponible_en=now + VISIBILITY_TIMEOUT)
+        )
+        if claimed.rowcount == 1:
+            return conn.execute(select(tarea_table).where(tarea_table.c.id == row.id)).mappings().first()
+
+
+def _extend_visibility(app, tarea_id, reserva, done):
+    tarea_table = Tarea.__table__
+    while not done.wait(HEARTBEAT_INTERVAL.total_seconds()):
+        nueva = datetime.utcnow() + VISIBILITY_TIMEOUT
+        try:
+            with app.app_context(), db.engine.begin() as conn:
+                # Condicional, igual que claim_next: si la reserva cambió, la tarea ya no es de este worker
+                extended = conn.execute(
+                    update(tarea_table)
+                    .where(tarea_table.c.id == tarea_id, tarea_table.c.disponible_en == reserva)
+                    .values(disponible_en=nueva)
+                ).rowcount
+        except Exception:
+            logger.warning('No se pudo extender la reserva de la tarea %s', tarea_id, exc_info=True)
+            continue
+        if not extended:
+            logger.warning('La tarea %s perdió su reserva mientras se procesaba', tarea_id)
+            return
+        reserva = nueva
+
+
+@contextmanager
+def keep_visible(app, tarea):
+    """Extiende disponible_en cada HEARTBEAT_INTERVAL desde otro hilo mientras dura el bloque"""
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_extend_visibility, args=(app, tarea['id'], tarea['disponible_en'], done),
+                                 name=f"job-heartbeat-{tarea['id']}", daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        done.set()
+        heartbeat.join()
+
+
+def backoff(intentos):
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (intentos - 1)))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run_one(app):
+    """Procesa una tarea; devuelve False si no había ninguna disponible"""
+    tarea_table = Tarea.__table__
+    with app.app_context():
+        with db.engine.begin() as conn:
+            tarea = claim_next(conn)
+        if tarea is None:
+            return False
+
+        try:
+            handler = _handlers.get(tarea['tipo'])
+            if handler is None:
+                raise LookupError(f"No hay handler para la tarea {tarea['tipo']}")
+            with keep_visible(app, tarea):
+                handler(json.loads(tarea['payload']))
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('Tarea %s (%s) falló', tarea['id'], tarea['tipo'])
+            if tarea['intentos'] >= tarea['max_intentos']:
+                values = {'estado': 'fallida', 'ultimo_error': str(e)}
+            else:
+                values = {'estado': 'pendiente', 'ultimo_error': str(e),
+                          'disponible_en': datetime.utcnow() + backoff(tarea['intentos'])}
+            with db.engine.begin() as conn:
+                conn.execute(update(tarea_table).where(tarea_table.c.id == tarea['id']).values(**values))
+        else:
+            with db.engine.begin() as conn:
+                conn.execute(delete(tarea_table).where(tarea_table.c.id == tarea['id']))
+        finally:
+            db.session.remove()
+        return True
+
+
+def drain(app, max_tasks=None):
+    """Procesa en el hilo actual todas las tareas disponibles (útil en scripts y pruebas)"""
+    processed = 0
+    while (max_tasks is None or processed < max_tasks) and run_one(app):
+        processed += 1
+    return processed
+
+
+def _worker_loop(app, stop):
+    while not stop.is_set():
+        try:
+            if run_one(app):
+                continue
+        except Exception:
+            logger.exception('Error en el worker de tareas')
+        _wakeup.wait(POLL_INTERVAL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers(app, count):
+    """Arranca `count` hilos daemon que consumen la cola; devuelve el evento para detenerlos"""
+    stop = threading.Event()
+    for i in range(count):
+        worker = threading.Thread(target=_worker_loop, args=(app, stop), name=f'job-worker-{i}', daemon=True)
+        worker.start()
+        _workers.append(worker)
+    return stop
+
+
+def queue_stats():
+    tarea_table = Tarea.__table__
+    rows = db.session.execute(
+        select(tarea_table.c.estado, func.count()).group_by(tarea_table.c.estado)
+    ).all()
+    return {estado: count for estado, count in rows}
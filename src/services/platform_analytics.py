@@ -0,0 +1,147 @@
+from sqlalchemy import text, bindparam, DateTime
+from src.services.activation_archive import period_of
+
+# Columnas por las que se puede ordenar el listado de marcas
+SORT_COLUMNS = {
+    'nombre': 'm.nombre',
+    'productos': 'productos',
+    'activaciones': 'activaciones',
+    'usuarios_unicos': 'usuarios_unicos',
+    'recompensas_otorgadas': 'recompensas_otorgadas',
+    'recompensas_reclamadas': 'recompensas_reclamadas',
+    'tasa_reclamacion': 'tasa_reclamacion',
+}
+
+# Activaciones calientes del rango más las archivadas de sus meses
+_ACTIVATIONS_SQL = """
+    SELECT usuario_id, producto_id FROM activacion
+    WHERE fecha_activacion >= :desde AND fecha_activacion <= :hasta
+    UNION ALL
+    SELECT usuario_id, producto_id FROM activacion_archivada
+    WHERE periodo >= :periodo_desde AND periodo <= :periodo_hasta
+"""
+
+# Una sola pasada: cada CTE agrupa su tabla por marca y el SELECT final las une a marca.
+# Los totales de la plataforma y el total de marcas salen de funciones ventana sobre
+# el mismo resultado, así que la cantidad de consultas no depende de cuántas marcas haya.
+_BRANDS_SQL = """
+    WITH activaciones AS (""" + _ACTIVATIONS_SQL + """),
+    prod AS (
+        SELECT marca_id, COUNT(*) AS productos, SUM(activo) AS productos_activos
+        FROM producto
+        GROUP BY marca_id
+    ),
+    act AS (
+        SELECT p.marca_id, COUNT(*) AS activaciones, COUNT(DISTINCT a.usuario_id) AS usuarios_unicos
+        FROM activaciones a
+        JOIN producto p ON p.id = a.producto_id
+        GROUP BY p.marca_id
+    ),
+    rec AS (
+        SELECT p.marca_id,
+               COUNT(*) AS recompensas_otorgadas,
+               SUM(ur.estado = 'reclamada') AS recompensas_reclamadas
+        FROM usuario_recompensa ur
+        JOIN recompensa r ON r.id = ur.recompensa_id
+        JOIN producto p ON p.id = r.producto_id
+        WHERE ur.fecha_otorgada >= :desde AND ur.fecha_otorgada <= :hasta
+        GROUP BY p.marca_id
+    ),
+    marcas AS (
+        SELECT m.id, m.nombre, m.activa,
+               COALESCE(prod.productos, 0) AS productos,
+               COALESCE(prod.productos_activos, 0) AS productos_activos,
+               COALESCE(act.activaciones, 0) AS activaciones,
+               COALESCE(act.usuarios_unicos, 0) AS usuarios_unicos,
+               COALESCE(rec.recompensas_otorgadas, 0) AS recompensas_otorgadas,
+               COALESCE(rec.recompensas_reclamadas, 0) AS recompensas_reclamadas,
+               ROUND(COALESCE(rec.recompensas_reclamadas, 0) * 100.0
+                     / MAX(COALESCE(rec.recompensas_otorgadas, 0), 1), 2) AS tasa_reclamacion
+        FROM marca m
+        LEFT JOIN prod ON prod.marca_id = m.id
+        LEFT JOIN act ON act.marca_id = m.id
+        LEFT JOIN rec ON rec.marca_id = m.id
+    )
+    SELECT m.*,
+           COUNT(*) OVER () AS total_marcas,
+           SUM(m.activaciones) OVER () AS total_activaciones,
+           SUM(m.recompensas_otorgadas) OVER () AS total_recompensas_otorgadas,
+           SUM(m.recompensas_reclamadas) OVER () AS total_recompensas_reclamadas
+    FROM marcas m
+    ORDER BY {order} {direction}, m.id
+    LIMIT :limit OFFSET :offset
+"""
+
+# Top de productos para todas las marcas de la página, en una consulta
+_TOP_PRODUCTS_SQL = text("""
+    WITH activaciones AS (""" + _ACTIVATIONS_SQL + """)
+    SELECT marca_id, id, nombre, activaciones FROM (
+        SELECT p.marca_id, p.id, p.nombre, COUNT(*) AS activaciones,
+               ROW_NUMBER() OVER (PARTITION BY p.marca_id ORDER BY COUNT(*) DESC, p.id) AS puesto
+        FROM producto p
+        JOIN activaciones a ON a.producto_id = p.id
+        WHERE p.marca_id IN :marca_ids
+        GROUP BY p.marca_id, p.id, p.nombre
+    )
+    WHERE puesto <= :top
+    ORDER BY marca_id, puesto
+""").bindparams(
+    bindparam('marca_ids', expanding=True),
+    bindparam('desde', type_=DateTime),
+    bindparam('hasta', type_=DateTime)
+)
+
+
+def brand_analytics(session, desde, hasta, sort='activaciones', descending=True,
+                    limit=20, offset=0, top_productos=3):
+    """Métricas por marca de una página del listado, con totales de plataforma.
+
+    La cantidad de consultas (agregados + top de productos) no depende de cuántas marcas haya.
+    """
+    statement = text(_BRANDS_SQL.format(
+        order=SORT_COLUMNS[sort],
+        direction='DESC' if descending else 'ASC'
+    )).bindparams(bindparam('desde', type_=DateTime), bindparam('hasta', type_=DateTime))
+    periodos = {'periodo_desde': period_of(desde), 'periodo_hasta': period_of(hasta)}
+    params = {'desde': desde, 'hasta': hasta, 'limit': limit, 'offset': offset, **periodos}
+    rows = session.execute(statement, params).mappings().all()
+    # Página fuera de rango: los totales igual se informan
+    first = rows[0] if rows or not offset else \
+        session.execute(statement, {**params, 'limit': 1, 'offset': 0}).mappings().first()
+
+    marcas = []
+    for row in rows:
+        marcas.append({
+            'id': row['id'],
+            'nombre': row['nombre'],
+            'activa': bool(row['activa']),
+            'productos': row['productos'],
+            'productos_activos': row['productos_activos'],
+            'activaciones': row['activaciones'],
+            'usuarios_unicos': row['usuarios_unicos'],
+            'recompensas_otorgadas': row['recompensas_otorgadas'],
+            'recompensas_reclamadas': row['recompensas_reclamadas'],
+            'tasa_reclamacion': row['tasa_reclamacion'],
+            'productos_top': []
+        })
+
+    if marcas and top_productos:
+        by_id = {m['id']: m for m in marcas}
+        top = session.execute(_TOP_PRODUCTS_SQL, {
+            'marca_ids': list(by_id), 'desde': desde, 'hasta': hasta, 'top': top_productos, **periodos
+        }).all()
+        for marca_id, producto_id, nombre, activaciones in top:
+            by_id[marca_id]['productos_top'].append(
+                {'id': producto_id, 'nombre': nombre, 'activaciones': activaciones}
+            )
+
+    otorgadas = first['total_recompensas_otorgadas'] if first else 0
+    reclamadas = first['total_recompensas_reclamadas'] if first else 0
+    totales = {
+        'marcas': first['total_marcas'] if first else 0,
+        'activaciones': first['total_activaciones'] if first else 0,
+        'recompensas_otorgadas': otorgadas,
+        'recompensas_reclamadas': reclamadas,
+        'tasa_reclamacion': round((reclamadas / max(otorgadas, 1)) * 100, 2)
+    }
+    return marcas, totales
@@ -0,0 +1,207 @@
+"""Recomendaciones por co-activación: "quienes activaron esto también activaron...".
+
+La matriz usuario × producto se arma en formato CSR con NumPy (indptr/indices, sin
+scipy) solo con los usuarios que activaron los productos a recalcular. Para cada uno
+de esos productos se cuentan las co-activaciones con todos los demás y se normalizan
+como similitud coseno:
+
+    sim(i, j) = C[i, j] / sqrt(n[i] * n[j])
+
+donde C[i, j] es la cantidad de usuarios que activaron ambos y n[i] los que activaron i.
+Se guardan los TOP_K vecinos de cada producto en recomendacion_producto.
+"""
+from datetime import timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, delete, insert, func
+from src.models.user import db, Activacion, RecomendacionProducto
+from src.services.activation_archive import activation_keys
+from src.services.jobs import enqueue, task
+
+DEFAULT_TOP_K = 20
+DEFAULT_INTERVAL = timedelta(minutes=15)
+# Productos por bloque: cada bloque arma una matriz densa de CHUNK_ROWS × productos
+CHUNK_ROWS = 128
+
+
+def _csr_by_user(usuarios, productos):
+    """Índices compactos y matriz usuario × producto en CSR (las filas son usuarios)"""
+    producto_ids, p_idx = np.unique(productos, return_inverse=True)
+    _, u_idx = np.unique(usuarios, return_inverse=True)
+    order = np.argsort(u_idx, kind='stable')
+    indptr = np.zeros(u_idx.max() + 2, dtype=np.int64)
+    np.cumsum(np.bincount(u_idx, minlength=len(indptr) - 1), out=indptr[1:])
+    return producto_ids, u_idx, p_idx, indptr, p_idx[order]
+
+
+def _gather_rows(indptr, indices, rows):
+    """Concatena las filas CSR pedidas; devuelve (columnas, largo de cada fila)"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return indices[offsets], lengths
+
+
+def _activation_counts(producto_ids):
+    keys = activation_keys()
+    producto_ids = producto_ids.tolist()  # sqlite3 no acepta enteros de NumPy como parámetros
+    counts = dict(db.session.execute(
+        select(keys.c.producto_id, func.count())
+        .where(keys.c.producto_id.in_(producto_ids))
+        .group_by(keys.c.producto_id)
+    ).all())
+    return np.array([counts[p] for p in producto_ids], dtype=np.float64)
+
+
+def similar_products(producto_ids):
+    """{producto_id: [(vecino_id, puntuacion, coactivaciones), ...]} para los productos pedidos,
+    con todos los vecinos con al menos una co-activación, del más al menos similar.
+
+    Lee solo las activaciones de los usuarios que activaron alguno de esos productos.
+    """
+    keys = activation_keys()
+    usuarios = select(keys.c.usuario_id).where(keys.c.producto_id.in_(producto_ids))
+    pares = activation_keys()
+    rows = db.session.execute(
+        select(pares.c.usuario_id, pares.c.producto_id).where(pares.c.usuario_id.in_(usuarios))
+    ).all()
+    if not rows:
+        return {}
+
+    data = np.array(rows, dtype=np.int64)
+    todos, u_idx, p_idx, indptr, indices = _csr_by_user(data[:, 0], data[:, 1])
+    n = _activation_counts(todos)
+    objetivos = np.flatnonzero(np.isin(todos, producto_ids))
+
+    resultado = {}
+    for start in range(0, len(objetivos), CHUNK_ROWS):
+        bloque = objetivos[start:start + CHUNK_ROWS]
+        local = np.full(len(todos), -1, dtype=np.int64)
+        local[bloque] = np.arange(len(bloque))
+
+        # Cada activación (usuario, objetivo) aporta la fila completa del usuario
+        mask = local[p_idx] >= 0
+        columnas, largos = _gather_rows(indptr, indices, u_idx[mask])
+        filas = np.repeat(local[p_idx[mask]], largos)
+        coocurrencias = np.bincount(
+            filas * len(todos) + columnas, minlength=len(bloque) * len(todos)
+        ).reshape(len(bloque), len(todos))
+
+        coocurrencias[np.arange(len(bloque)), bloque] = 0
+        similitud = coocurrencias / np.sqrt(np.outer(n[bloque], n))
+
+        for fila, producto in enumerate(bloque):
+            vecinos = np.flatnonzero(coocurrencias[fila])
+            vecinos = vecinos[np.lexsort((todos[vecinos], -similitud[fila, vecinos]))]
+            resultado[int(todos[producto])] = [
+                (int(todos[j]), float(similitud[fila, j]), int(coocurrencias[fila, j])) for j in vecinos
+            ]
+    return resultado
+
+
+def _stored_neighbors(producto_ids):
+    rows = db.session.execute(
+        select(RecomendacionProducto.producto_id, RecomendacionProducto.vecino_id,
+               RecomendacionProducto.puntuacion, RecomendacionProducto.coactivaciones)
+        .where(RecomendacionProducto.producto_id.in_(producto_ids))
+        .order_by(RecomendacionProducto.producto_id, RecomendacionProducto.rango)
+    ).all()
+    vecinos = {}
+    for producto_id, vecino_id, puntuacion, coactivaciones in rows:
+        vecinos.setdefault(producto_id, []).append((vecino_id, puntuacion, coactivaciones))
+    return vecinos
+
+
+def _save(vecinos_por_producto):
+    table = RecomendacionProducto.__table__
+    db.session.execute(delete(table).where(table.c.producto_id.in_(list(vecinos_por_producto))))
+    rows = [
+        {'producto_id': producto_id, 'rango': rango, 'vecino_id': vecino_id,
+         'puntuacion': puntuacion, 'coactivaciones': coactivaciones}
+        for producto_id, vecinos in vecinos_por_producto.items()
+        for rango, (vecino_id, puntuacion, coactivaciones) in enumerate(vecinos, start=1)
+    ]
+    if rows:
+        db.session.execute(insert(table), rows)
+
+
+def refresh_recommendations(producto_ids, top_k):
+    """Recalcula los vecinos de `producto_ids` y corrige su puntuación en las listas ajenas.
+
+    sim(i, j) es simétrica: con la fila de i ya calculada, las listas de los vecinos j
+    que no se recalculan reciben el puntaje nuevo de i y se vuelven a ordenar. Solo se
+    recalcula la fila de j cuando el puntaje de i baja de lo que j tenía guardado como
+    último vecino, porque ahí puede entrar un candidato que no estaba en la lista.
+    """
+    producto_ids = sorted(set(producto_ids))
+    calculados = {}
+    for start in range(0, len(producto_ids), CHUNK_ROWS):
+        calculados.update(similar_products(producto_ids[start:start + CHUNK_ROWS]))
+
+    # Todos los vecinos (no solo el top-K) para corregir también las listas que incluyen a i
+    # aunque la de i no los incluya
+    afectados = {}
+    for producto_id, vecinos in calculados.items():
+        for vecino_id, puntuacion, coactivaciones in vecinos:
+            if vecino_id not in calculados:
+                afectados.setdefault(vecino_id, {})[producto_id] = (puntuacion, coactivaciones)
+
+    actualizados = {producto_id: vecinos[:top_k] for producto_id, vecinos in calculados.items()}
+    guardados = _stored_neighbors(list(afectados))
+    recalcular = []
+    for vecino_id, nuevos in afectados.items():
+        anteriores = guardados.get(vecino_id, [])
+        # Con la lista llena, fuera de ella puede haber candidatos con puntaje hasta el último
+        # guardado: si un puntaje nuevo queda por debajo, la fila se recalcula entera
+        if len(anteriores) >= top_k and min(p for p, _ in nuevos.values()) < anteriores[-1][1]:
+            recalcular.append(vecino_id)
+            continue
+        lista = {v: (p, c) for v, p, c in anteriores}
+        lista.update(nuevos)
+        ordenados = sorted(lista.items(), key=lambda item: (-item[1][0], item[0]))[:top_k]
+        actualizados[vecino_id] = [(v, p, c) for v, (p, c) in ordenados]
+
+    for start in range(0, len(recalcular), CHUNK_ROWS):
+        for producto_id, vecinos in similar_products(recalcular[start:start + CHUNK_ROWS]).items():
+            actualizados[producto_id] = vecinos[:top_k]
+
+    # Los productos sin co-activaciones quedan sin vecinos (se borran los viejos)
+    for producto_id in producto_ids:
+        actualizados.setdefault(producto_id, [])
+    _save(actualizados)
+    return len(actualizados)
+
+
+@task('recalcular_recomendaciones')
+def refresh_recommendations_task(payload):
+    """Incremental: solo los productos con activaciones nuevas desde la última corrida.
+
+    Sin `ultima_activacion_id` (primera corrida o después de un reinicio sin tarea
+    pendiente) reconstruye todo.
+    """
+    top_k = current_app.config.get('RECOMMENDATIONS_TOP_K', DEFAULT_TOP_K)
+    interval = current_app.config.get('RECOMMENDATIONS_INTERVAL', DEFAULT_INTERVAL)
+    desde = payload.get('ultima_activacion_id')
+    hasta = db.session.execute(select(func.max(Activacion.id))).scalar() or 0
+
+    if desde is None:
+        keys = activation_keys()
+        producto_ids = db.session.execute(select(keys.c.producto_id).distinct()).scalars().all()
+    else:
+        producto_ids = db.session.execute(
+            select(Activacion.producto_id).distinct()
+            .where(Activacion.id > desde, Activacion.id <= hasta)
+        ).scalars().all()
+
+    if producto_ids:
+        refresh_recommendations(producto_ids, top_k)
+    if interval:
+        enqueue('recalcular_recomendaciones', {'ultima_activacion_id': hasta}, delay=interval,
+                clave_unica='recalcular_recomendaciones')
+
+
+def schedule_recommendations(app):
+    """Programa el recálculo periódico si está habilitado"""
+    if app.config.get('RECOMMENDATIONS_INTERVAL'):
+        enqueue('recalcular_recomendaciones', clave_unica='recalcular_recomendaciones')
+        db.session.commit()
@@ -0,0 +1,184 @@
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, insert, update, exists, literal, func
+from src.models.user import db, Activacion, ActivacionArchivada, Recompensa, UsuarioRecompensa, BackfillRecompensa
+from src.services.coupons import assign_coupons_bulk
+from src.services.user_summary import recount_rewards_for_product
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+# Pausa entre lotes para que las activaciones concurrentes tomen el lock de escritura
+CHUNK_PAUSE_SECONDS = 0.01
+
+# Un solo worker: los backfills compiten por el mismo lock de escritura de SQLite
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reward-backfill')
+
+
+def start_backfill(app, recompensa):
+    """Crea (o reutiliza) el backfill de la recompensa y lo encola en segundo plano"""
+    backfill = BackfillRecompensa.query.filter(
+        BackfillRecompensa.recompensa_id == recompensa.id,
+        BackfillRecompensa.estado.in_(['pendiente', 'en_progreso'])
+    ).first()
+    if backfill:
+        return backfill
+
+    total = db.session.query(func.count(Activacion.id))\
+        .filter(Activacion.producto_id == recompensa.producto_id)\
+        .scalar()
+    total += db.session.query(func.count())\
+        .select_from(ActivacionArchivada)\
+        .filter(ActivacionArchivada.producto_id == recompensa.producto_id)\
+        .scalar()
+    backfill = BackfillRecompensa(
+        recompensa_id=recompensa.id,
+        producto_id=recompensa.producto_id,
+        total_activaciones=total or 0
+    )
+    db.session.add(backfill)
+    db.session.commit()
+
+    _executor.submit(run_backfill, app, backfill.id)
+    return backfill
+
+
+def resume_pending_backfills(app):
+    """Reanuda, desde su cursor, los backfills que quedaron a medias al reiniciar"""
+    pending = db.session.query(BackfillRecompensa.id)\
+        .filter(BackfillRecompensa.estado.in_(['pendiente', 'en_progreso']))\
+        .all()
+    for (backfill_id,) in pending:
+        _executor.submit(run_backfill, app, backfill_id)
+
+
+def run_backfill(app, backfill_id):
+    with app.app_context():
+        try:
+            while process_chunk(backfill_id):
+                time.sleep(CHUNK_PAUSE_SECONDS)
+        except Exception as e:
+            logger.exception('Backfill %s falló', backfill_id)
+            db.session.rollback()
+            with db.engine.begin() as conn:
+                conn.execute(
+                    update(BackfillRecompensa.__table__)
+                    .where(BackfillRecompensa.id == backfill_id)
+                    .values(estado='error', error=str(e), fecha_actualizacion=datetime.utcnow())
+                )
+        finally:
+            db.session.remove()
+
+
+def grant_reward_statement(recompensa_id, producto_id, after_id=0, upto_id=None, now=None):
+    """INSERT ... SELECT que otorga la recompensa a quienes activaron el producto y aún no la tienen"""
+    ya_otorgada = exists().where(
+        UsuarioRecompensa.usuario_id == Activacion.usuario_id,
+        UsuarioRecompensa.recompensa_id == recompensa_id
+    )
+    conditions = [Activacion.producto_id == producto_id, Activacion.id > after_id, ~ya_otorgada]
+    if upto_id is not None:
+        conditions.append(Activacion.id <= upto_id)
+    return insert(UsuarioRecompensa.__table__).from_select(
+        ['usuario_id', 'recompensa_id', 'fecha_otorgada', 'estado'],
+        select(
+            Activacion.usuario_id,
+            literal(recompensa_id),
+            literal(now or datetime.utcnow()),
+            literal('disponible')
+        ).where(*conditions)
+    )
+
+
+def grant_archived_statement(recompensa_id, producto_id, now=None):
+    """Como grant_reward_statement, para quienes tienen la activación en el archivo"""
+    ya_otorgada = exists().where(
+        UsuarioRecompensa.usuario_id == ActivacionArchivada.usuario_id,
+        UsuarioRecompensa.recompensa_id == recompensa_id
+    )
+    return insert(UsuarioRecompensa.__table__).from_select(
+        ['usuario_id', 'recompensa_id', 'fecha_otorgada', 'estado'],
+        select(
+            ActivacionArchivada.usuario_id,
+            literal(recompensa_id),
+            literal(now or datetime.utcnow()),
+            literal('disponible')
+        ).where(ActivacionArchivada.producto_id == producto_id, ~ya_otorgada)
+    )
+
+
+def process_chunk(backfill_id):
+    """Procesa un lote keyset de activaciones en una transacción corta.
+
+    El cursor se guarda en la misma transacción que los inserts, así que un reinicio
+    continúa exactamente donde quedó. Devuelve False cuando ya no quedan activaciones.
+    """
+    backfill_table = BackfillRecompensa.__table__
+    with db.engine.begin() as conn:
+        backfill = conn.execute(
+            select(backfill_table).where(backfill_table.c.id == backfill_id)
+        ).mappings().first()
+        if not backfill or backfill['estado'] in ('completado', 'error'):
+            return False
+
+        ids = conn.execute(
+            select(Activacion.id)
+            .where(Activacion.producto_id == backfill['producto_id'],
+                   Activacion.id > backfill['ultimo_activacion_id'])
+            .order_by(Activacion.id)
+            .limit(CHUNK_SIZE)
+        ).scalars().all()
+
+        now = datetime.utcnow()
+        usa_pool_cupones = conn.execute(
+            select(Recompensa.usa_pool_cupones).where(Recompensa.id == backfill['recompensa_id'])
+        ).scalar()
+        desde_id = (conn.execute(select(func.max(UsuarioRecompensa.id))).scalar() or 0) + 1
+        
+        if not ids:
+            # Último paso: quienes tienen la activación archivada, en un solo INSERT ... SELECT
+            result = conn.execute(grant_archived_statement(backfill['recompensa_id'], backfill['producto_id'], now=now))
+            if usa_pool_cupones and result.rowcount:
+                assign_coupons_bulk(conn, backfill['recompensa_id'], desde_id)
+            if result.rowcount:
+                recount_rewards_for_product(conn, backfill['producto_id'], archived=True)
+            conn.execute(
+                update(backfill_table)
+                .where(backfill_table.c.id == backfill_id)
+                .values(
+                    estado='completado',
+                    procesadas=backfill_table.c.total_activaciones,
+                    otorgadas=backfill_table.c.otorgadas + result.rowcount,
+                    fecha_actualizacion=now
+                )
+            )
+            return False
+
+        result = conn.execute(grant_reward_statement(
+            backfill['recompensa_id'],
+            backfill['producto_id'],
+            after_id=backfill['ultimo_activacion_id'],
+            upto_id=ids[-1],
+            now=now
+        ))
+        if usa_pool_cupones and result.rowcount:
+            assign_coupons_bulk(conn, backfill['recompensa_id'], desde_id)
+        if result.rowcount:
+            recount_rewards_for_product(
+                conn, backfill['producto_id'], after_id=backfill['ultimo_activacion_id'], upto_id=ids[-1]
+            )
+
+        conn.execute(
+            update(backfill_table)
+            .where(backfill_table.c.id == backfill_id)
+            .values(
+                estado='en_progreso',
+                ultimo_activacion_id=ids[-1],
+                procesadas=backfill_table.c.procesadas + len(ids),
+                otorgadas=backfill_table.c.otorgadas + result.rowcount,
+                fecha_actualizacion=now
+            )
+        )
+        return True
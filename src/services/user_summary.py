@@ -0,0 +1,133 @@
+from datetime import datetime
+from sqlalchemy import text, bindparam, DateTime
+from src.models.user import db, ResumenUsuario
+
+# Todas las escrituras son UPDATE de una sola sentencia sobre la fila del usuario:
+# SQLite las serializa, así que dos activaciones concurrentes nunca pierden un incremento.
+# Si la fila todavía no existe el UPDATE no hace nada; se construye completa en la
+# primera lectura (get_summary), que ya incluye ese cambio.
+
+_BUILD_SQL = text("""
+    INSERT OR IGNORE INTO resumen_usuario (
+        usuario_id, total_activaciones, recompensas_total, recompensas_disponibles,
+        recompensas_reclamadas, marcas, meses, fecha_actualizacion
+    )
+    WITH activaciones AS (
+        SELECT producto_id, strftime('%Y-%m', fecha_activacion) AS mes
+        FROM activacion WHERE usuario_id = :usuario_id
+        UNION ALL
+        SELECT producto_id, periodo FROM activacion_archivada WHERE usuario_id = :usuario_id
+    )
+    SELECT
+        :usuario_id,
+        (SELECT COUNT(*) FROM activaciones),
+        (SELECT COUNT(*) FROM usuario_recompensa WHERE usuario_id = :usuario_id),
+        (SELECT COUNT(*) FROM usuario_recompensa WHERE usuario_id = :usuario_id AND estado = 'disponible'),
+        (SELECT COUNT(*) FROM usuario_recompensa WHERE usuario_id = :usuario_id AND estado = 'reclamada'),
+        (SELECT COALESCE(json_group_object(marca_id, json(marca)), '{}') FROM (
+            SELECT m.id AS marca_id, json_object('nombre', m.nombre, 'activaciones', COUNT(*)) AS marca
+            FROM activaciones a
+            JOIN producto p ON p.id = a.producto_id
+            JOIN marca m ON m.id = p.marca_id
+            GROUP BY m.id
+        )),
+        (SELECT COALESCE(json_group_object(mes, activaciones), '{}') FROM (
+            SELECT mes, COUNT(*) AS activaciones FROM activaciones GROUP BY mes
+        )),
+        :now
+""").bindparams(bindparam('now', type_=DateTime))
+
+_ACTIVATION_SQL = text("""
+    UPDATE resumen_usuario SET
+        total_activaciones = total_activaciones + 1,
+        marcas = json_set(marcas, :marca_path, json_object(
+            'nombre', :marca_nombre,
+            'activaciones', COALESCE(json_extract(marcas, :marca_path || '.activaciones'), 0) + 1
+        )),
+        meses = json_set(meses, :mes_path, COALESCE(json_extract(meses, :mes_path), 0) + 1),
+        recompensas_total = recompensas_total + :otorgadas,
+        recompensas_disponibles = recompensas_disponibles + :otorgadas,
+        fecha_actualizacion = :now
+    WHERE usuario_id = :usuario_id
+""").bindparams(bindparam('now', type_=DateTime))
+
+_REWARDS_SQL = text("""
+    UPDATE resumen_usuario SET
+        recompensas_total = recompensas_total + :otorgadas,
+        recompensas_disponibles = recompensas_disponibles + :otorgadas - :reclamadas - :expiradas,
+        recompensas_reclamadas = recompensas_reclamadas + :reclamadas,
+        fecha_actualizacion = :now
+    WHERE usuario_id = :usuario_id
+""").bindparams(bindparam('now', type_=DateTime))
+
+# Recuento por usuario para escrituras masivas (INSERT ... SELECT de otorgamientos),
+# donde no se sabe cuántas filas recibió cada uno; usa el índice por usuario_id
+_RECOUNT_REWARDS_SQL = """
+    UPDATE resumen_usuario SET
+        recompensas_total = (
+            SELECT COUNT(*) FROM usuario_recompensa ur WHERE ur.usuario_id = resumen_usuario.usuario_id),
+        recompensas_disponibles = (
+            SELECT COUNT(*) FROM usuario_recompensa ur
+            WHERE ur.usuario_id = resumen_usuario.usuario_id AND ur.estado = 'disponible'),
+        recompensas_reclamadas = (
+            SELECT COUNT(*) FROM usuario_recompensa ur
+            WHERE ur.usuario_id = resumen_usuario.usuario_id AND ur.estado = 'reclamada'),
+        fecha_actualizacion = :now
+    WHERE usuario_id IN (SELECT usuario_id FROM {source} WHERE {where})
+"""
+
+
+def get_summary(usuario_id):
+    """Resumen del usuario con una lectura por clave primaria; lo construye la primera vez"""
+    resumen = db.session.get(ResumenUsuario, usuario_id)
+    if resumen is None:
+        db.session.execute(_BUILD_SQL, {'usuario_id': usuario_id, 'now': datetime.utcnow()})
+        db.session.commit()
+        resumen = db.session.get(ResumenUsuario, usuario_id)
+    return resumen
+
+
+def record_activation(usuario_id, marca, fecha, otorgadas=0):
+    """Suma una activación (y las recompensas otorgadas con ella) en la transacción actual"""
+    db.session.execute(_ACTIVATION_SQL, {
+        'usuario_id': usuario_id,
+        'marca_path': f'$."{marca.id}"',
+        'marca_nombre': marca.nombre,
+        'mes_path': f'$."{fecha:%Y-%m}"',
+        'otorgadas': otorgadas,
+        'now': datetime.utcnow()
+    })
+
+
+def record_rewards(usuario_id, otorgadas=0, reclamadas=0, expiradas=0):
+    """Aplica cambios de estado de recompensas (deltas) en la transacción actual"""
+    if not (otorgadas or reclamadas or expiradas):
+        return
+    db.session.execute(_REWARDS_SQL, {
+        'usuario_id': usuario_id,
+        'otorgadas': otorgadas,
+        'reclamadas': reclamadas,
+        'expiradas': expiradas,
+        'now': datetime.utcnow()
+    })
+
+
+def recount_rewards_for_product(conn, producto_id, after_id=0, upto_id=None, archived=False):
+    """Recalcula los contadores de recompensas de quienes activaron el producto.
+
+    Sobre la tabla caliente acepta un rango keyset de ids; con archived=True recorre
+    en cambio a quienes tienen la activación archivada.
+    """
+    params = {'producto_id': producto_id, 'now': datetime.utcnow()}
+    if archived:
+        source, where = 'activacion_archivada', 'producto_id = :producto_id'
+    else:
+        source, where = 'activacion', 'producto_id = :producto_id AND id > :after_id'
+        params['after_id'] = after_id
+        if upto_id is not None:
+            where += ' AND id <= :upto_id'
+            params['upto_id'] = upto_id
+    conn.execute(
+        text(_RECOUNT_REWARDS_SQL.format(source=source, where=where)).bindparams(bindparam('now', type_=DateTime)),
+        params
+    )
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from flask import session
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from src.models.user import Marca
+
+ACCESS_SALT = 'weev-access-token'
+REFRESH_SALT = 'weev-refresh-token'
+DEFAULT_ACCESS_TTL = timedelta(minutes=15)
+DEFAULT_REFRESH_TTL = timedelta(days=14)
+
+
+class TokenSession(SecureCookieSession):
+    """Sesión armada desde un access token: vive solo durante el request y nunca se guarda"""
+
+    def __init__(self, initial=None, token_error=None):
+        super().__init__(initial)
+        self.token_error = token_error
+
+
+class TokenAwareSessionInterface(SecureCookieSessionInterface):
+    """Acepta `Authorization: Bearer <token>` además de la cookie de sesión.
+
+    Con un token válido, session['user_id'], session['user_type'] y session['marca_id']
+    salen de sus claims sin consultar la base, así que require_auth, el rate limiter y
+    los handlers funcionan igual en los dos modos y cualquier nodo puede verificarlo.
+    """
+
+    def open_session(self, app, request):
+        header = request.headers.get('Authorization', '')
+        if app.config.get('AUTH_TOKENS_ENABLED') and header.startswith('Bearer '):
+            claims, error = verify_token(app, header[len('Bearer '):].strip(), ACCESS_SALT, app.config['AUTH_ACCESS_TTL'])
+            if claims is None:
+                return TokenSession(token_error=error)
+            return TokenSession({
+                'user_id': claims['uid'],
+                'user_type': claims['typ'],
+                'marca_id': claims.get('mid')
+            })
+        return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if isinstance(session, TokenSession):
+            return
+        super().save_session(app, session, response)
+
+
+def current_brand_id():
+    """Marca del brand_admin autenticado: sale de la sesión (cookie o token) y, si no está, de la base"""
+    marca_id = session.get('marca_id')
+    if marca_id:
+        return marca_id
+    marca = Marca.query.filter_by(admin_id=session['user_id']).first()
+    return marca.id if marca else None
+
+
+def _serializer(app, salt):
+    return URLSafeTimedSerializer(app.secret_key, salt=salt)
+
+
+def verify_token(app, token, salt, ttl):
+    """Devuelve (claims, None) o (None, 'expired' | 'invalid')"""
+    try:
+        return _serializer(app, salt).loads(token, max_age=ttl.total_seconds()), None
+    except SignatureExpired:
+        return None, 'expired'
+    except BadSignature:
+        return None, 'invalid'
+
+
+def issue_tokens(app, user, marca_id=None):
+    access_ttl = app.config['AUTH_ACCESS_TTL']
+    return {
+        'access_token': _serializer(app, ACCESS_SALT).dumps({'uid': user.id, 'typ': user.user_type, 'mid': marca_id}),
+        'refresh_token': _serializer(app, REFRESH_SALT).dumps({'uid': user.id}),
+        'token_type': 'Bearer',
+        'expires_in': int(access_ttl.total_seconds())
+    }
+
+
+def _add_token_challenge(response):
+    """En un 401 por token vencido o inválido, indica al cliente que debe refrescarlo"""
+    error = getattr(session, 'token_error', None)
+    if response.status_code == 401 and error:
+        description = 'Token expirado' if error == 'expired' else 'Token invalido'  # solo ASCII en headers
+        response.headers['WWW-Authenticate'] = f'Bearer error="invalid_token", error_description="{description}"'
+    return response
+
+
+def init_auth_tokens(app):
+    app.config.setdefault('AUTH_TOKENS_ENABLED', True)
+    app.config.setdefault('AUTH_ACCESS_TTL', DEFAULT_ACCESS_TTL)
+    app.config.setdefault('AUTH_REFRESH_TTL', DEFAULT_REFRESH_TTL)
+    app.session_interface = TokenAwareSessionInterface()
+    app.after_request(_add_token_challenge)
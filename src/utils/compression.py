@@ -0,0 +1,73 @@
+import gzip
+import brotli
+from flask import current_app
+from src.utils.metrics import registry, Counter, Histogram, current_endpoint
+from src.utils.static_assets import negotiate_encoding
+
+# Solo respuestas de la API; los estáticos ya se sirven precomprimidos (StaticIndex)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain'}
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.7, 0.9)
+
+DEFAULT_MIN_BYTES = 1024
+# Niveles pensados para comprimir en cada request, no los máximos de los estáticos
+DEFAULT_LEVELS = {'br': 4, 'gzip': 6}
+
+_ENCODERS = {
+    'br': lambda data, level: brotli.compress(data, quality=level, mode=brotli.MODE_TEXT),
+    'gzip': lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+}
+
+response_bytes = registry.register(Counter(
+    'weev_http_response_bytes_total', 'Bytes de respuestas comprimibles, antes y después de comprimir',
+    ('endpoint', 'encoding', 'stage')))
+compression_ratio = registry.register(Histogram(
+    'weev_http_compression_ratio', 'Tamaño comprimido / original por endpoint',
+    RATIO_BUCKETS, ('endpoint', 'encoding')))
+
+
+def _compress_response(response):
+    if (response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    # El contenido depende de Accept-Encoding aunque esta vez no se comprima
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESSION_MIN_BYTES', DEFAULT_MIN_BYTES):
+        return response
+
+    endpoint = current_endpoint()
+    encoding = negotiate_encoding(_ENCODERS)
+    if encoding == 'identity':
+        response_bytes.inc((endpoint, 'identity', 'original'), len(data))
+        response_bytes.inc((endpoint, 'identity', 'sent'), len(data))
+        return response
+
+    level = current_app.config.get('COMPRESSION_LEVELS', DEFAULT_LEVELS)[encoding]
+    compressed = _ENCODERS[encoding](data, level)
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+
+    response_bytes.inc((endpoint, encoding, 'original'), len(data))
+    response_bytes.inc((endpoint, encoding, 'sent'), len(compressed))
+    compression_ratio.observe((endpoint, encoding), len(compressed) / len(data))
+    return response
+
+
+def init_compression(app):
+    """Comprime en after_request las respuestas JSON según Accept-Encoding.
+
+    Se registra después de init_metrics: Flask ejecuta los after_request en orden
+    inverso, así que la latencia medida incluye la compresión.
+    """
+    app.after_request(_compress_response)
@@ -0,0 +1,197 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, jsonify, make_response, request, session
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+from src.models.user import db, RespuestaIdempotente
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = timedelta(hours=24)
+DEFAULT_MAX_KEYS = 10_000
+PURGE_INTERVAL_SECONDS = 300
+
+# 202 (activación pendiente en el group-commit), 409 y 429 son transitorios: el cliente tiene
+# que poder reintentar con la misma clave
+NOT_STORED_STATUSES = {202, 409, 429}
+
+
+class StoredResponse:
+    __slots__ = ('huella', 'status', 'mimetype', 'body', 'expires_at')
+
+    def __init__(self, huella, status, mimetype, body, expires_at):
+        self.huella = huella
+        self.status = status
+        self.mimetype = mimetype
+        self.body = body
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """Respuestas recientes por (usuario, Idempotency-Key) en un LRU con vencimiento.
+
+    Con persist=True también se escriben en la tabla respuesta_idempotente, así que un
+    reintento que llega después de un reinicio o a otro proceso se repite igual.
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._next_purge = 0
+        self.replayed = 0
+        self.conflicts = 0
+        self.persist_errors = 0
+
+    def begin(self, key):
+        """Marca la clave como en curso; False si otro request con la misma clave no terminó"""
+        with self._lock:
+            if key in self._in_flight:
+                self.conflicts += 1
+                return False
+            self._in_flight.add(key)
+            return True
+
+    def finish(self, key):
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def get(self, key, persist):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    return entry
+                del self._entries[key]
+
+        if not persist:
+            return None
+        row = db.session.execute(
+            select(RespuestaIdempotente)
+            .where(RespuestaIdempotente.usuario_id == key[0],
+                   RespuestaIdempotente.clave == key[1],
+                   RespuestaIdempotente.expira > datetime.utcnow())
+        ).scalar()
+        if row is None:
+            return None
+        entry = StoredResponse(row.huella, row.estado_http, row.tipo_contenido, row.cuerpo,
+                               now + (row.expira - datetime.utcnow()).total_seconds())
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def put(self, key, entry, persist):
+        self._remember(key, entry)
+        if not persist:
+            return
+
+        table = RespuestaIdempotente.__table__
+        values = {
+            'usuario_id': key[0],
+            'clave': key[1],
+            'huella': entry.huella,
+            'estado_http': entry.status,
+            'tipo_contenido': entry.mimetype,
+            'cuerpo': entry.body,
+            'expira': datetime.utcnow() + timedelta(seconds=entry.expires_at - time.time())
+        }
+        # Transacción propia: la del handler ya terminó (commit o rollback). Si falla (p. ej. la
+        # base ocupada) la respuesta ya es definitiva: se registra y queda solo en memoria
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(**values).on_conflict_do_nothing())
+                if time.time() >= self._next_purge:
+                    self._next_purge = time.time() + PURGE_INTERVAL_SECONDS
+                    conn.execute(delete(table).where(table.c.expira <= datetime.utcnow()))
+        except Exception:
+            with self._lock:
+                self.persist_errors += 1
+            logger.exception('No se pudo guardar la respuesta idempotente de la clave %r', key[1])
+
+    def count_replay(self):
+        with self._lock:
+            self.replayed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._in_flight),
+                'replayed': self.replayed,
+                'conflicts': self.conflicts,
+                'persist_errors': self.persist_errors,
+            }
+
+
+store = IdempotencyStore()
+
+
+def _request_fingerprint():
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def idempotent(f):
+    """Repite la respuesta original si llega otra vez el mismo Idempotency-Key del mismo usuario.
+
+    Se aplica por fuera de rate_limit: un reintento ya respondido no gasta presupuesto ni
+    vuelve a tocar la base. Sin header (o sin sesión) el endpoint se comporta como siempre.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        clave = request.headers.get(HEADER)
+        if clave is None or 'user_id' not in session:
+            return f(*args, **kwargs)
+        if not clave or len(clave) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} debe tener entre 1 y {MAX_KEY_LENGTH} caracteres'}), 400
+
+        persist = current_app.config.get('IDEMPOTENCY_PERSIST', False)
+        key = (session['user_id'], clave)
+        huella = _request_fingerprint()
+
+        entry = store.get(key, persist)
+        if entry is None:
+            if not store.begin(key):
+                response = jsonify({'error': 'Ya hay una solicitud en curso con este Idempotency-Key'})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            try:
+                # Pudo terminar otro request con la misma clave entre get() y begin()
+                entry = store.get(key, persist)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code < 500 and response.status_code not in NOT_STORED_STATUSES:
+                        ttl = current_app.config.get('IDEMPOTENCY_TTL', DEFAULT_TTL)
+                        store.put(key, StoredResponse(
+                            huella, response.status_code, response.mimetype, response.get_data(),
+                            time.time() + ttl.total_seconds()
+                        ), persist)
+                    return response
+            finally:
+                store.finish(key)
+
+        if entry.huella != huella:
+            return jsonify({'error': f'{HEADER} ya se usó con otra solicitud'}), 422
+
+        store.count_replay()
+        response = current_app.response_class(entry.body, status=entry.status, mimetype=entry.mimetype)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    return decorated_function
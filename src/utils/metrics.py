@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event, text
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(labels)
+            if sample is None:
+                # [conteo por bucket..., +Inf], suma
+                sample = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            sample[0][index] += 1
+            sample[1] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, ("le", bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+
+    def render(self):
+        value = self.collect()
+        return [] if value is None else [f'{self.name} {value}']
+
+
+class CallbackCounter:
+    """Contador cuyos valores viven en otro módulo; collect() devuelve {labels: valor}"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames, collect):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self):
+        return [f'{self.name}{_labels(self.labelnames, labels)} {value}'
+                for labels, value in sorted(self.collect().items())]
+
+
+class CallbackGauge(CallbackCounter):
+    kind = 'gauge'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            samples = metric.render()
+            if not samples:
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'weev_http_requests_total', 'Requests HTTP por endpoint, método y status',
+    ('endpoint', 'method', 'status')))
+http_latency = registry.register(Histogram(
+    'weev_http_request_duration_seconds', 'Latencia de requests HTTP por endpoint',
+    LATENCY_BUCKETS, ('endpoint', 'method')))
+db_statements = registry.register(Histogram(
+    'weev_db_statements_per_request', 'Sentencias SQL ejecutadas por request',
+    STATEMENT_BUCKETS, ('endpoint',)))
+db_time = registry.register(Histogram(
+    'weev_db_time_seconds_per_request', 'Tiempo en la base de datos por request',
+    LATENCY_BUCKETS, ('endpoint',)))
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'none'
+    return 'background'
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_time = 0.0
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = current_endpoint()
+    http_latency.observe((endpoint, request.method), time.perf_counter() - start)
+    http_requests.inc((endpoint, request.method, str(response.status_code)))
+    db_statements.observe((endpoint,), g.get('sql_statements', 0))
+    db_time.observe((endpoint,), g.get('sql_time', 0.0))
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_time += elapsed
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+
+def _pool_gauges(engine):
+    pool = engine.pool
+
+    def stat(method):
+        def collect():
+            fn = getattr(pool, method, None)
+            return fn() if fn else None
+        return collect
+
+    return [
+        Gauge('weev_db_pool_size', 'Tamaño configurado del pool de conexiones', stat('size')),
+        Gauge('weev_db_pool_checked_out', 'Conexiones en uso', stat('checkedout')),
+        Gauge('weev_db_pool_checked_in', 'Conexiones libres en el pool', stat('checkedin')),
+        Gauge('weev_db_pool_overflow', 'Conexiones por encima del tamaño del pool', stat('overflow')),
+    ]
+
+
+def _sqlite_gauges(engine):
+    db_path = engine.url.database
+
+    def wal_bytes():
+        wal_path = f'{db_path}-wal'
+        return os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+    def db_bytes():
+        return os.path.getsize(db_path) if os.path.exists(db_path) else None
+
+    def wal_enabled():
+        with engine.connect() as conn:
+            return 1 if conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal' else 0
+
+    return [
+        Gauge('weev_sqlite_wal_enabled', 'journal_mode=WAL activo (1) o no (0)', wal_enabled),
+        Gauge('weev_sqlite_wal_bytes', 'Tamaño del archivo -wal pendiente de checkpoint', wal_bytes),
+        Gauge('weev_sqlite_db_bytes', 'Tamaño del archivo principal de la base', db_bytes),
+    ]
+
+
+def init_metrics(app, engine):
+    """Registra los hooks de Flask y SQLAlchemy que alimentan /api/metrics"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+    for gauge in _pool_gauges(engine):
+        registry.register(gauge)
+    if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        for gauge in _sqlite_gauges(engine):
+            registry.register(gauge)
@@ -0,0 +1,121 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, request, session
+
+# Presupuestos por defecto: (tokens por minuto, ráfaga máxima). Se pueden
+# sobreescribir con app.config['RATE_LIMITS'] = {'validate_code': (60, 20), ...}
+DEFAULT_LIMITS = {
+    'validate_code': (30, 10),
+    'activate': (10, 5),
+    'login': (10, 5),
+    'register': (5, 3),
+}
+
+MAX_TRACKED_KEYS = 100_000
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated_at = now
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, rate):
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)"""
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """Limitador en memoria con un token bucket por (presupuesto, IP) y (presupuesto, usuario).
+
+    Los buckets se guardan en un LRU acotado para que una inundación de IPs distintas
+    no haga crecer la memoria sin límite.
+    """
+
+    def __init__(self, max_keys=MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = {}
+        self.rejected = {}
+
+    def _bucket(self, key, burst, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def hit(self, budget, keys, per_minute, burst):
+        """Consume un token de cada key; devuelve los segundos de espera si alguna se agotó"""
+        rate = per_minute / 60.0
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            for key in keys:
+                bucket = self._bucket((budget,) + key, burst, now)
+                bucket.refill(rate, burst, now)
+                buckets.append((key[0], bucket))
+
+            for scope, bucket in buckets:
+                wait = bucket.wait_time(rate)
+                if wait:
+                    counter = (budget, scope)
+                    self.rejected[counter] = self.rejected.get(counter, 0) + 1
+                    return wait
+
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+            self.allowed[budget] = self.allowed.get(budget, 0) + 1
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buckets': len(self._buckets),
+                'allowed': dict(self.allowed),
+                'rejected': [
+                    {'budget': budget, 'scope': scope, 'count': count}
+                    for (budget, scope), count in sorted(self.rejected.items())
+                ],
+            }
+
+
+limiter = RateLimiter()
+
+
+def rate_limit(budget):
+    """Decorador que aplica el presupuesto indicado por IP y, si hay sesión, por usuario"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            limits = current_app.config.get('RATE_LIMITS', {})
+            per_minute, burst = limits.get(budget, DEFAULT_LIMITS[budget])
+
+            keys = [('ip', request.remote_addr or 'unknown')]
+            if 'user_id' in session:
+                keys.append(('user', session['user_id']))
+
+            wait = limiter.hit(budget, keys, per_minute, burst)
+            if wait:
+                response = jsonify({'error': 'Demasiadas solicitudes, intenta nuevamente más tarde'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+                return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
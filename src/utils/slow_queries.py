@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from sqlalchemy import event
+from src.utils.metrics import current_endpoint
+
+logger = logging.getLogger('weev.slow_queries')
+
+MAX_TRACKED_SHAPES = 10_000
+
+
+class SlowQueryLog:
+    """Registra en un log JSON rotativo las sentencias que superan el umbral.
+
+    La primera vez que aparece una forma de sentencia lenta (SQL + tipos de parámetros)
+    en SQLite se adjunta su EXPLAIN QUERY PLAN, marcando los SCAN sin índice.
+    """
+
+    def __init__(self, threshold_ms, explain=True):
+        self.threshold = threshold_ms / 1000.0
+        self.explain = explain
+        self._seen_shapes = {}  # dict ordenado usado como set con orden de inserción
+        self._lock = threading.Lock()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['slow_query_start'].pop()
+        if elapsed < self.threshold:
+            return
+
+        shape = parameter_shape(parameters, executemany)
+        shape_key = hashlib.sha1(f'{statement}|{shape}'.encode('utf-8')).hexdigest()[:16]
+        entry = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'duration_ms': round(elapsed * 1000, 3),
+            'endpoint': current_endpoint(),
+            'shape': shape_key,
+            'statement': statement,
+            'parameters': shape,
+        }
+
+        with self._lock:
+            first_seen = shape_key not in self._seen_shapes
+            if first_seen:
+                if len(self._seen_shapes) >= MAX_TRACKED_SHAPES:
+                    self._seen_shapes.pop(next(iter(self._seen_shapes)))
+                self._seen_shapes[shape_key] = None
+
+        if first_seen and self.explain and conn.dialect.name == 'sqlite':
+            plan = explain_query_plan(cursor, statement, parameters, executemany)
+            if plan is not None:
+                entry['query_plan'] = plan
+                entry['full_scans'] = [step for step in plan if is_full_scan(step)]
+
+        logger.warning(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def handle_error(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('slow_query_start'):
+            conn.info['slow_query_start'].pop()
+
+
+def parameter_shape(parameters, executemany):
+    """Tipos de los parámetros (nunca sus valores, que pueden ser datos personales)"""
+    if executemany:
+        batch = list(parameters or [])
+        first = batch[0] if batch else ()
+        return {'executemany': len(batch), 'row': parameter_shape(first, False)}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in (parameters or ())]
+
+
+def explain_query_plan(cursor, statement, parameters, executemany):
+    if executemany:
+        parameters = list(parameters or [[]])[0]
+    try:
+        # Cursor DBAPI nuevo: no dispara los eventos de SQLAlchemy ni altera el resultado original
+        raw = cursor.connection.cursor()
+        try:
+            raw.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+            return [row[3] for row in raw.fetchall()]
+        finally:
+            raw.close()
+    except Exception:
+        return None
+
+
+def is_full_scan(step):
+    return step.startswith('SCAN') and 'USING' not in step
+
+
+def init_slow_query_log(app, engine):
+    threshold_ms = app.config.get('SLOW_QUERY_MS')
+    if not threshold_ms:
+        return None
+
+    log_path = app.config.get('SLOW_QUERY_LOG', os.path.join(os.path.dirname(app.root_path), 'logs', 'slow_queries.log'))
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    if not logger.handlers:
+        handler = RotatingFileHandler(
+            log_path,
+            maxBytes=app.config.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024),
+            backupCount=app.config.get('SLOW_QUERY_LOG_BACKUPS', 5),
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.WARNING)
+        logger.propagate = False
+
+    slow_log = SlowQueryLog(threshold_ms, explain=app.config.get('SLOW_QUERY_EXPLAIN', True))
+    event.listen(engine, 'before_cursor_execute', slow_log.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', slow_log.after_cursor_execute)
+    event.listen(engine, 'handle_error', slow_log.handle_error)
+    return slow_log
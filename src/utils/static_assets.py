@@ -0,0 +1,118 @@
+import os
+import re
+import hashlib
+import mimetypes
+import brotli
+import zopfli.gzip
+from flask import Response, request
+
+# Tipos que vale la pena precomprimir (las imágenes raster ya vienen comprimidas)
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+)
+MIN_COMPRESS_BYTES = 256
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+# Referencias locales dentro del HTML del shell: href="styles.css", src="script.js"
+_ASSET_REF = re.compile(r'(?P<attr>href|src)="(?P<path>[^":?#]+)"')
+
+
+class StaticAsset:
+    def __init__(self, path, data, mimetype):
+        self.path = path
+        self.mimetype = mimetype
+        self.set_content(data)
+
+    def set_content(self, data):
+        self.variants = {'identity': data}
+        self.version = hashlib.sha256(data).hexdigest()[:16]
+        if any(self.mimetype.startswith(t) for t in COMPRESSIBLE_TYPES) and len(data) >= MIN_COMPRESS_BYTES:
+            mode = brotli.MODE_TEXT if self.mimetype.startswith('text/') else brotli.MODE_GENERIC
+            br = brotli.compress(data, quality=11, mode=mode)
+            gz = zopfli.gzip.compress(data)
+            if len(br) < len(data):
+                self.variants['br'] = br
+            if len(gz) < len(data):
+                self.variants['gzip'] = gz
+
+    def etag(self, encoding):
+        return self.version if encoding == 'identity' else f"{self.version}-{encoding}"
+
+
+class StaticIndex:
+    """Índice en memoria de src/static, construido una sola vez al arrancar.
+
+    Cada archivo se guarda con sus variantes precomprimidas (br, gzip) y un hash de
+    contenido que se usa como ETag y como huella (?v=) en las referencias del shell.
+    """
+
+    def __init__(self, folder, shell='index.html', skip_dirs=('uploads',)):
+        self.folder = folder
+        self.shell_name = shell
+        self.skip_dirs = set(skip_dirs)
+        self.assets = {}
+
+    def scan(self):
+        assets = {}
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if os.path.relpath(os.path.join(root, d), self.folder) not in self.skip_dirs]
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self.folder).replace(os.sep, '/')
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                with open(full_path, 'rb') as f:
+                    assets[rel_path] = StaticAsset(rel_path, f.read(), mimetype)
+
+        shell = assets.get(self.shell_name)
+        if shell:
+            shell.set_content(self._fingerprint(shell.variants['identity'], assets))
+
+        self.assets = assets
+        return self
+
+    def _fingerprint(self, html, assets):
+        """Agrega ?v=<hash> a las referencias locales para poder cachearlas como inmutables"""
+        def replace(match):
+            asset = assets.get(match.group('path').lstrip('/'))
+            if not asset:
+                return match.group(0)
+            return f'{match.group("attr")}="{match.group("path")}?v={asset.version}"'
+        return _ASSET_REF.sub(replace, html.decode('utf-8')).encode('utf-8')
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    @property
+    def shell(self):
+        return self.assets.get(self.shell_name)
+
+    def response(self, asset):
+        encoding = negotiate_encoding(asset.variants)
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(asset.etag(encoding))
+
+        # El shell siempre se revalida; el resto es inmutable solo si se pidió con la huella vigente
+        if asset.path != self.shell_name and request.args.get('v') == asset.version:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        else:
+            response.headers['Cache-Control'] = REVALIDATE_CACHE
+        return response.make_conditional(request)
+
+
+def negotiate_encoding(variants):
+    """Elige la mejor codificación disponible según Accept-Encoding"""
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepted[encoding] > 0:
+            return encoding
+    return 'identity'
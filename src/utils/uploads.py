@@ -0,0 +1,158 @@
+import os
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'uploads')
+UPLOAD_URL_PREFIX = '/static/uploads'
+
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024  # 5 MB
+# Un PNG de pocos KB puede declarar 20000×20000 px: se rechaza antes de decodificarlo
+MAX_IMAGE_SIDE = 8000
+MAX_IMAGE_PIXELS = 40_000_000
+
+# Formato detectado por Pillow -> extensión con que se guarda (no se usa la del nombre del archivo)
+FORMAT_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif'}
+CHUNK_SIZE = 64 * 1024
+
+# Tamaños (px) de las miniaturas cuadradas y formatos generados para cada una
+THUMBNAIL_SIZES = (64, 128, 256)
+THUMBNAIL_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+
+# Pool compartido para generar miniaturas fuera del request
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _validate_image(path):
+    """Decodifica la imagen completa una vez; devuelve la extensión según su formato real.
+
+    verify() solo revisa la estructura: un JPEG truncado lo pasa y recién falla al generar
+    las miniaturas, con la URL ya guardada.
+    """
+    try:
+        with Image.open(path) as img:
+            extension = FORMAT_EXTENSIONS.get(img.format)
+            width, height = img.size
+            img.verify()
+        if extension is None or max(width, height) > MAX_IMAGE_SIDE or width * height > MAX_IMAGE_PIXELS:
+            raise InvalidImage()
+        # verify() deja la imagen inutilizable: se vuelve a abrir para decodificarla
+        with Image.open(path) as img:
+            img.load()
+        return extension
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        raise InvalidImage()
+
+
+def save_stream(stream, max_bytes=MAX_UPLOAD_BYTES):
+    """Copia el stream a disco por bloques y lo guarda con el hash de su contenido como nombre.
+
+    Devuelve (hash SHA-256, extensión del formato detectado). Si ya existe un archivo con
+    el mismo contenido se reutiliza.
+    """
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    total = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                tmp.write(chunk)
+
+        extension = _validate_image(tmp_path)
+        content_hash = digest.hexdigest()
+        final_path = original_path(content_hash, extension)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+        return content_hash, extension
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def original_path(content_hash, extension):
+    return os.path.join(UPLOAD_FOLDER, f"{content_hash}.{extension}")
+
+
+def thumbnail_name(content_hash, size, fmt_ext):
+    return f"{content_hash}_{size}.{fmt_ext}"
+
+
+def thumbnail_urls(content_hash):
+    """URLs de todas las variantes, agrupadas por tamaño"""
+    return {
+        str(size): {
+            fmt_ext: f"{UPLOAD_URL_PREFIX}/{thumbnail_name(content_hash, size, fmt_ext)}"
+            for fmt_ext, _ in THUMBNAIL_FORMATS
+        }
+        for size in THUMBNAIL_SIZES
+    }
+
+
+def generate_thumbnails(content_hash, extension):
+    """Genera las miniaturas que falten para un archivo original"""
+    pending = [
+        (size, fmt_ext, pil_format)
+        for size in THUMBNAIL_SIZES
+        for fmt_ext, pil_format in THUMBNAIL_FORMATS
+        if not os.path.exists(os.path.join(UPLOAD_FOLDER, thumbnail_name(content_hash, size, fmt_ext)))
+    ]
+    if not pending:
+        return
+
+    with Image.open(original_path(content_hash, extension)) as img:
+        # Para JPEG, decodificar directamente a una escala reducida
+        img.draft('RGB', (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        for size, fmt_ext, pil_format in pending:
+            thumb = ImageOps.fit(img, (size, size), Image.LANCZOS)
+            target = os.path.join(UPLOAD_FOLDER, thumbnail_name(content_hash, size, fmt_ext))
+            # Escribir a un archivo temporal propio (dos subidas del mismo contenido pueden
+            # generar a la vez) para no servir miniaturas a medio escribir
+            fd, tmp_target = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    thumb.save(tmp, pil_format, quality=85, optimize=True)
+                os.replace(tmp_target, target)
+            except BaseException:
+                if os.path.exists(tmp_target):
+                    os.remove(tmp_target)
+                raise
+
+
+def schedule_thumbnails(content_hash, extension, on_error=None):
+    """Genera las miniaturas en el pool; si fallan se registra y se llama on_error(excepción)"""
+    def done(future):
+        error = future.exception()
+        if error is None:
+            return
+        logger.error('No se pudieron generar las miniaturas de %s.%s', content_hash, extension, exc_info=error)
+        if on_error is not None:
+            on_error(error)
+
+    future = _executor.submit(generate_thumbnails, content_hash, extension)
+    future.add_done_callback(done)
+    return future